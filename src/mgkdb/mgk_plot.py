@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+For rendering the diagnostic plots of runs in mgk_fusion to files in shell,
+without a display and in parallel
+"""
+
+import argparse
+
+from mgkdb.support.mgk_file_handling import Str2Query, load
+from mgkdb.support.mgk_login import f_login_dbase
+from mgkdb.support.diag_plot import render_batch, MAX_TRACE_POINTS
+
+def f_parse_args():
+    #==========================================================
+    # argument parser
+    #==========================================================
+    parser = argparse.ArgumentParser(description='Render the diagnostic plots of runs to files')
+
+    parser.add_argument('-Q', '--query', default= '{}',help='mongodb query selecting the runs')
+    parser.add_argument('-C', '--collection', choices=['linear','nonlinear'], default='linear', type=str, help='collection name in the database')
+    parser.add_argument('-A', '--authenticate', default = None, help='locally saved login info, a .pkl file')
+    parser.add_argument('-D', '--destination', default = './', help = 'directory where the figures are written to, one folder per run.')
+    parser.add_argument('-W', '--workers', default = 1, type=int, help = 'number of processes rendering runs in parallel')
+    parser.add_argument('-F', '--formats', choices=['png','pdf'], default = ['png'], nargs='+', help = 'file formats of the figures')
+    parser.add_argument('--max_points', default = MAX_TRACE_POINTS, type=int, help = 'time traces are thinned out to at most this number of points')
+    parser.add_argument('--force', action='store_true', help = 'render figures which are newer than the diagnostics again')
+
+    return parser.parse_args()
+
+### Main 
+def main_plot(query, collection, authenticate, destination, workers, formats, max_points, force):
+
+    ### Connect to database 
+    login = f_login_dbase(authenticate)
+    client, database = login.connect()
+    with client:
+        ## Dict to convert from argument to collection name in database
+        collection_dict={'linear':'LinearRuns','nonlinear':'NonlinRuns'}
+        collection_name =  getattr(database,collection_dict[collection])
+
+        print("working on query: {} ......".format(query))
+        records = load(database, collection_name, Str2Query(query), projection={'Metadata':1, 'Diagnostics':1}) or []
+        print('{} records found.'.format(len(records)))
+
+    written = render_batch(records, destination, workers=workers, formats=formats,
+                           max_points=max_points, force=force)
+    print('{} figures written to {}.'.format(len(written), destination))
+
+
+def main():
+
+    ### Parse arguments 
+    args = f_parse_args()
+
+    main_plot(**vars(args))
+
+
+if __name__=="__main__":
+    main()
@@ -26,10 +26,14 @@ def f_parse_args():
     
     parser.add_argument('-Ex', '--extra', dest='extra', default = False, action='store_true', help='whether or not to include any extra files for each suffix')
     parser.add_argument('-L', '--large_files', dest='large_files', default = False, action='store_true', help='whether or not to include large files')
+    parser.add_argument('-S', '--scan', dest='scan', default = False, action='store_true', help='upload a GENE scan with a scan.log as one batch')
+    parser.add_argument('-W', '--workers', dest='workers', default = 1, type=int, help='number of processes preparing the runs of a scan')
+    parser.add_argument('-CR', '--continuation', dest='continuation', default = False, action='store_true', help='upload GENE continuation runs as one run')
     
     return parser.parse_args()
 
-def main_upload(target, default, sim_type, extra, authenticate, verbose, large_files, config_file):
+def main_upload(target, default, sim_type, extra, authenticate, verbose, large_files, config_file, scan=False, workers=1,
+                continuation=False):
     '''
     Upload a set of suffixes with common Metadata
     '''
@@ -90,9 +94,22 @@ def main_upload(target, default, sim_type, extra, authenticate, verbose, large_f
                 if linked_id_strg is not None:
                     metadata['DBtag']['linkedObjectID'] = f_get_linked_oid(database, linked_id_strg)
 
+                ## Diagnostics time window, optional
+                if user_input.get('saturation') is not None:
+                    global_vars.saturation = user_input['saturation']
+                if user_input.get('time_windows'):
+                    global_vars.time_windows = user_input['time_windows']
+
                 no_prompts         = user_input['no_prompts']
                 reupload_if_exists = user_input['reupload_if_exists']
 
+                ## Scan upload, optional
+                scan = scan or bool(user_input.get('scan'))
+                workers = user_input.get('workers') or workers
+
+                ## Continuation runs as one run, optional
+                continuation = continuation or bool(user_input.get('continuation'))
+
             else: ## Get data through user input 
                 if extra: # this will change the global variable
                     ex_files = input('Please type FULL file names to update, separated by comma.\n').split(',')
@@ -128,7 +145,8 @@ def main_upload(target, default, sim_type, extra, authenticate, verbose, large_f
             reupload_if_exists = False
             
         upload_to_mongo(database, linear, metadata, upload_folder, suffixes, run_shared,
-                        large_files, verbose, manual_time_flag, global_vars, no_prompts=no_prompts, reupload_if_exists=reupload_if_exists)
+                        large_files, verbose, manual_time_flag, global_vars, no_prompts=no_prompts, reupload_if_exists=reupload_if_exists,
+                        scan=scan, workers=workers, continuation=continuation)
 
 def main():
 
@@ -1,7 +1,7 @@
 """ ParIO.py: Contains the class to handle reading and writing of parameter files """
-import re
 import sys
 from collections import namedtuple, OrderedDict
+from .data.par_reader import read_parameters, clearcomments
 
 
 class Parameters(object):
@@ -25,61 +25,24 @@ class Parameters(object):
 
     @staticmethod
     def clearcomments(variable):
-        regex = re.compile(r'\s*([-+\'\"\[\];.,/a-zA-Z0-9_\s*]*)\s*!?\s*(.*)')
-        result = regex.search(variable)
-        if result and result.group(2)[:4] != 'scan':
-            return regex.search(variable).group(1)
-        else:
-            return variable
+        return clearcomments(variable)
 
     def Read_Pars(self, path):
         """ Read parameters file and make it a dict """
-        # counts species namelists
-        countspec = 0
         try:
-#            print(path)
-            with open(path, "r") as parfile:
-                # Search file for parameters using regular expressions
-                for line in parfile:
-                    # Exclude commented lines
-                    if re.search(r'\s*!\w*\s*=.*', line) is None:
-                        # Check for and count species namelists
-                        if re.search(r'^\s*&(.*)', line):
-                            # if namelist belongs to a species, append its number to the namelist
-                            if re.search(r'^\s*&(.*)', line).group(1) == 'species':
-                                countspec += 1
-                                nml = re.search(r'^\s*&(.*)', line).group(1)+str(countspec)
-                            else:
-                                nml = re.search(r'^\s*&(.*)', line).group(1)
-                            if nml not in self.namelists:
-                                self.namelists.append(nml)
-                    # Search lines for <parameter> = <value> patterns
-                    p = re.compile(r'^\s*(.*)\s*=\s*(.*)')
-                    m = p.search(line)
-                    # Pick matching lines and build parameter dictionary
-                    if m:
-                        if m.group(1).strip() in self.spec_nl:
-                            self.pardict[m.group(1).strip()+str(countspec)] = m.group(2)
-                            self.nmldict[m.group(1).strip()+str(countspec)] = nml
-                        else:
-                            self.pardict[m.group(1).strip()] = m.group(2)
-                            self.nmldict[m.group(1).strip()] = nml
+            parsed = read_parameters(path)
         except IOError:
             sys.exit("ParIO: ReadPars: could not read parameters file in {}".format(path))
-        # clear the comments from all variables, cast some strings to integers and floats
-        for item in self.pardict:
-            self.pardict[item] = self.clearcomments(self.pardict[item])
-            try:    # Can it be converted to int?
-                self.pardict[item] = int(self.pardict[item])
-            except ValueError:
-                try:   # No, but can it be converted to float?
-                    self.pardict[item] = float(self.pardict[item])
-                except ValueError:
-                    pass
-            if self.pardict[item] in self.boolstr_t:    # cast switches to boolean values
-                self.pardict[item] = True
-            elif self.pardict[item] in self.boolstr_f:
-                self.pardict[item] = False
+        for entry in parsed.entries:
+            if entry.name in self.spec_nl:
+                key = entry.name + str(entry.species)
+            else:
+                key = entry.name
+            self.pardict[key] = entry.value
+            self.nmldict[key] = entry.namelist
+        for nml in parsed.namelists:
+            if nml not in self.namelists:
+                self.namelists.append(nml)
         # generate class attributes from all valid parameters
         # for k,v in self.pardict.iteritems():
         #    if len(k.split())==1 and k[0]!='!':vars(self)[k]=v
@@ -2,6 +2,7 @@
 
 import struct
 from bisect import bisect_left, bisect_right
+import mmap
 import os
 from os.path import getsize
 import abc
@@ -9,6 +10,8 @@ import h5py
 import numpy as np
 import types
 
+from .file_index import file_signature, read_index, write_index
+
 
 class File(abc.ABC):
     """ Base class to read files from GENE runs"""
@@ -172,8 +175,12 @@ class File(abc.ABC):
 
 class BinaryFile(File):
     """ Base class to read Fortran binary (unformatted) files from GENE runs        
+
+        With usemmap=True the file is memory mapped and variables are returned as
+        read-only, Fortran ordered views on the mapped buffer instead of copies.
     """
-    def __init__(self, folder=None, extension=None, file_type=None, parameters=None, spec=None):
+    def __init__(self, folder=None, extension=None, file_type=None, parameters=None, spec=None,
+                 usemmap=False):
         super().__init__(folder=None, extension=None, file_type=None, parameters=None, spec=None)
         
         # these are public so we can reuse the object if we have to by redirecting it to a new folder/extension
@@ -182,9 +189,13 @@ class BinaryFile(File):
         self.file_type=file_type
         self.__spec=spec
         self.varnames = None
+        self.usemmap = usemmap
+        self.cache = None                                    # optional StepCache shared between files
+        self.bytes_read = 0                                  # data bytes fetched from disk
         
         # fid for reading
         self.__fid = None                                    # file identifier for reading 
+        self.__mm = None                                     # memory map of the file if usemmap
    
         # point the object to folder/file_type+extension, setting fid, variables and sizes.
         self.redirect(folder, extension, parameters)      
@@ -213,6 +224,7 @@ class BinaryFile(File):
             self.extension = extension
             
         # make sure the file is closed
+        self.__unmap()
         try:
             self.__fid.close()
         except (AttributeError, OSError):
@@ -226,6 +238,8 @@ class BinaryFile(File):
             self.__fid = open(self.filename, 'rb')
         except:
             raise Exception(self.filename + " does not exist")
+        if self.usemmap:
+            self.__map()
         
         # now set the content of the file
         # do it only if is the first time
@@ -248,6 +262,8 @@ class BinaryFile(File):
 
 
     def __set_datatypes(self, parameters):
+        self.__precision = parameters.pardict['PRECISION']
+        self.__endianness = parameters.pardict['ENDIANNESS']
         if parameters.pardict['PRECISION'] == 'DOUBLE':
             self.__nprt = np.dtype(np.float64)
             self.__npct = np.dtype(np.complex128)
@@ -297,22 +313,177 @@ class BinaryFile(File):
         else:
             print("Something went terribly wrong here")
 
+    def __map(self):
+        """ Memory map the whole file, read only """
+        try:
+            self.__mm = mmap.mmap(self.__fid.fileno(), length=0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file, nothing to map
+            self.__mm = None
+
+    def __unmap(self):
+        """ Release the memory map. If views on it are still alive (e.g. kept by a
+            diagnostic) we only drop our reference and let them own the buffer """
+        try:
+            self.__mm.close()
+        except (AttributeError, BufferError):
+            pass
+        self.__mm = None
+
     def _readvar(self, idx):
         """ Return 3d field data at the time set in self.time"""
+        self.bytes_read += self.__entrysize
+        if self.usemmap:
+            return self.__mapvar(idx)
         self.__fid.seek(self.offset(idx))       
         var3d = np.fromfile(self.__fid, count=np.prod(self.boxsize),
                             dtype=self.__npct)
         
         return var3d.reshape(tuple(self.boxsize), order="F")
 
+    def __mapvar(self, idx):
+        """ Return 3d field data at the time set in self.time as a view on the mapped file"""
+        offset = self.offset(idx)
+        if self.__mm is None or offset + self.__entrysize > len(self.__mm):
+            # the file has grown since we mapped it (e.g. run still going)
+            self.__unmap()
+            self.__map()
+        return np.ndarray(tuple(self.boxsize), dtype=self.__npct, buffer=self.__mm,
+                          offset=offset, order="F")
+
+    def record_location(self, name, step, extension=None):
+        """ Tell where variable name of a given step is stored, so that it can be read
+            with a different file handle (e.g. by a prefetch thread)
+
+            returns filename, offset, shape and dtype
+        """
+        idx = {v: k for k, v in self.varnames.items()}[name]
+        filename = self.filename
+        if extension and not extension == self.extension:
+            filename = filename[:len(filename) - len(self.extension)] + extension
+        offset = self.__tesize + step*(self.__tesize + self.__leapfld) + idx*(
+            self.__entrysize + 2*self.__intsize) + self.__intsize
+        return filename, offset, tuple(self.boxsize), self.__npct
+
+    def preload(self, name, step, var3d, extension=None, filename=None):
+        """ Hand over data of variable name at step that has been read elsewhere, the
+            next request for that step will be served from it
+
+            filename: the file it was read from (see record_location), default: the
+            file of extension
+        """
+        if extension and not extension == self.extension:
+            self.redirect(self.folder, extension)
+        self.bytes_read += var3d.nbytes
+        if self.cache is not None:
+            self.cache.put((filename or self.filename, name, int(step)), var3d)
+            return
+        idx = {v: k for k, v in self.varnames.items()}[name]
+        self.loaded_step[idx] = step
+        self._step_to_time(idx)
+        setattr(self, name + "_data", var3d)
+
+    def read_planes(self, name, step, planes, extension=None):
+        """ Return variable name at step restricted to some z planes, as a (nx, nky, nplanes) array
+
+            In Fortran order a z plane is a contiguous block of the record, so only
+            those blocks are read. A full array already in the cache is sliced instead.
+        """
+        if extension and not extension == self.extension:
+            self.redirect(self.folder, extension)
+        step = int(self._fix_step(step))
+        planes = np.asarray(planes, dtype=int)
+        if self.cache is not None and (self.filename, name, step) in self.cache:
+            return self.cache.get((self.filename, name, step))[:, :, planes]
+
+        _, offset, shape, dtype = self.record_location(name, step)
+        self.bytes_read += shape[0]*shape[1]*planes.size*dtype.itemsize
+        if self.usemmap:
+            if self.__mm is None or offset + self.__entrysize > len(self.__mm):
+                self.__unmap()
+                self.__map()
+            # fancy indexing copies, only the pages of the selected planes are touched
+            return np.ndarray(shape, dtype=dtype, buffer=self.__mm, offset=offset,
+                              order="F")[:, :, planes]
+
+        planesize = shape[0]*shape[1]
+        out = np.empty(shape[:2] + (planes.size,), dtype=dtype, order="F")
+        for i_p, plane in enumerate(planes):
+            self.__fid.seek(offset + plane*planesize*dtype.itemsize)
+            out[:, :, i_p] = np.fromfile(self.__fid, count=planesize,
+                                         dtype=dtype).reshape(shape[:2], order="F")
+        return out
+
+    def read_window(self, name, steps, stride=1, extension=None):
+        """ Return variable name for several steps at once as a (nt, nx, nky, nz) array
+
+            steps can be a list, range or slice of steps in this file, stride thins it
+            further. With usemmap and evenly spaced steps the result is a strided view
+            on the mapped file, otherwise consecutive steps are read in one go.
+        """
+        if extension and not extension == self.extension:
+            self.redirect(self.folder, extension)
+        if not self.timearray:
+            self.get_timearray()
+        idx = {v: k for k, v in self.varnames.items()}[name]
+
+        nrec = len(self.timearray)
+        if isinstance(steps, slice):
+            steps = range(nrec)[steps]
+        steps = np.arange(nrec)[np.asarray(steps, dtype=int)][::stride]
+        shape = (steps.size,) + tuple(self.boxsize)
+        recsize = self.__leapfld + self.__tesize
+        itemsize = self.__npct.itemsize
+        inner = (itemsize, itemsize*self.boxsize[0], itemsize*self.boxsize[0]*self.boxsize[1])
+        varoffset = self.__tesize + idx*(self.__entrysize + 2*self.__intsize) + self.__intsize
+
+        if steps.size == 0:
+            return np.empty(shape, dtype=self.__npct)
+
+        dsteps = np.diff(steps)
+        self.bytes_read += steps.size*self.__entrysize
+        if self.usemmap and (steps.size == 1 or (dsteps[0] > 0 and np.all(dsteps == dsteps[0]))):
+            last = self.record_offsets[steps[-1]] + varoffset + self.__entrysize
+            if self.__mm is None or last > len(self.__mm):
+                self.__unmap()
+                self.__map()
+            return np.ndarray(shape, dtype=self.__npct, buffer=self.__mm,
+                              offset=self.record_offsets[steps[0]] + varoffset,
+                              strides=(int(dsteps[0]*recsize) if steps.size > 1 else recsize,) + inner)
+
+        out = np.empty(shape, dtype=self.__npct)
+        # split into runs of consecutive steps, each run is a single contiguous read
+        bounds = np.concatenate(([0], np.flatnonzero(dsteps != 1) + 1, [steps.size]))
+        for i_b, i_e in zip(bounds[:-1], bounds[1:]):
+            self.__fid.seek(self.record_offsets[steps[i_b]])
+            block = np.fromfile(self.__fid, dtype=np.uint8, count=(i_e - i_b)*recsize)
+            out[i_b:i_e] = np.ndarray((i_e - i_b,) + tuple(self.boxsize), dtype=self.__npct,
+                                      buffer=block, offset=varoffset, strides=(recsize,) + inner)
+        return out
+
     def get_timearray(self):
-        """ Get time array from file """
+        """ Get time array from the sidecar index, scanning the file only if
+            the index is missing or stale """
+        signature = file_signature(self.filename, self.__precision, self.__endianness,
+                                   self.__leapfld + self.__tesize)
+        index = read_index(self.filename, signature)
+        if index is None:
+            self.__scan_timearray()
+            write_index(self.filename, signature, self.timearray, self.record_offsets)
+        else:
+            self.timearray = index[0].tolist()
+            self.record_offsets = index[1]
+        return self.timearray
+
+    def __scan_timearray(self):
+        """ Walk through the file collecting the time stamps and record offsets """
         self.timearray = []
         self.__fid.seek(0)
-        for _ in range(int(getsize(self.filename)/(self.__leapfld + self.__tesize))):
+        nrec = int(getsize(self.filename)/(self.__leapfld + self.__tesize))
+        for _ in range(nrec):
             self.timearray.append(float(self.__tentry.unpack(self.__fid.read(self.__tesize))[1]))
             self.__fid.seek(self.__leapfld, 1)
-        return self.timearray   
+        self.record_offsets = np.arange(nrec, dtype=np.int64)*(self.__leapfld + self.__tesize)
     
 def read_method(afile, name, idx):
     def __my_read_method(self, time=None, step=None, extension=None):
@@ -320,7 +491,22 @@ def read_method(afile, name, idx):
             #this does not support change in precision
             self.redirect(self.folder, extension)
         
-        if time is not None and not self.loaded_time[idx] == time:
+        if self.cache is not None and (time is not None or step is not None):
+            # shared cache of the Data object, keyed by file, variable and step
+            if time is not None:
+                if not self.timearray:
+                    self.get_timearray()
+                step = self.timearray.index(time)
+            step = int(self._fix_step(step))
+            key = (self.filename, name, step)
+            var3d = self.cache.get(key)
+            if var3d is None:
+                self.loaded_step[idx] = step
+                self._step_to_time(idx)
+                var3d = self._readvar(idx)
+                self.cache.put(key, var3d)
+            setattr(self, name + "_data", var3d)
+        elif time is not None and not self.loaded_time[idx] == time:
             # loading by time but the data is not what we have been asked
             self.loaded_time[idx] = time
             # convert to step
@@ -412,14 +598,14 @@ class H5File(File):
 # pylint: disable=invalid-name
 
 
-def GENEfile(folder, extension, file_type, parameters, spec=None):
+def GENEfile(folder, extension, file_type, parameters, spec=None, usemmap=False):
     if parameters.pnt.write_h5:
         raise NotImplementedError('ADIOS not yet implemented')
     elif parameters.pnt.write_adios:
         raise NotImplementedError('ADIOS not yet implemented')
     else:
         try:        
-            afile = BinaryFile(folder, extension, file_type, parameters, spec=spec)
+            afile = BinaryFile(folder, extension, file_type, parameters, spec=spec, usemmap=usemmap)
             for idx, name in afile.varnames.items():
                 read_method(afile, name, idx)            
             return afile
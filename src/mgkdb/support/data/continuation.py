@@ -0,0 +1,54 @@
+""" Gluing of the time traces of continuation runs
+
+A chain of continuation runs gives one segment of times (and data) per run. Where
+segments overlap, the later run is preferred: an entry of a segment is dropped if
+its time is not before the first time of any following segment. Since the times of
+every segment are sorted, the number of entries kept from every segment is found
+by one bisection each, and the kept parts are copied once into a preallocated
+result. The nrg, profile, field and mom time traces of pydiag and the time steps
+of Data are glued this way.
+"""
+
+from bisect import bisect_left, bisect_right
+import numpy as np
+
+
+def continuation_cuts(timearrays, keep_equal=False):
+    """ Number of leading entries kept of every segment
+
+    :param timearrays: sorted times of the segments in the order of the chain
+    :param keep_equal: also keep times equal to the first time of a following segment
+    :returns: list with the number of entries kept per segment
+    """
+    cut = bisect_right if keep_equal else bisect_left
+    n_keep = []
+    first = None  # earliest start of the following segments
+    for times in reversed(timearrays):
+        n_keep.append(len(times) if first is None else cut(times, first))
+        if len(times) and (first is None or times[0] < first):
+            first = times[0]
+    return n_keep[::-1]
+
+
+def glue_arrays(arrays, n_keep):
+    """ The leading n_keep entries (along the first axis) of every array in one array
+
+    :param arrays: arrays, or lists of scalars or arrays, of the segments
+    :param n_keep: entries kept per segment, see continuation_cuts
+    """
+    parts = [part[:n] for part, n in zip(arrays, n_keep)]
+    samples = [np.asarray(part[0]) for part in parts if len(part)]
+    if not samples:
+        return np.asarray(arrays[0])[:0] if len(arrays) else np.empty(0)
+    result = np.empty((sum(len(part) for part in parts),) + samples[0].shape,
+                      dtype=np.result_type(*[sample.dtype for sample in samples]))
+    pos = 0
+    for part in parts:
+        result[pos:pos + len(part)] = part
+        pos += len(part)
+    return result
+
+
+def glue_lists(lists, n_keep):
+    """ The leading n_keep entries of every list in one list """
+    return [entry for entries, n in zip(lists, n_keep) for entry in entries[:n]]
@@ -1,12 +1,21 @@
 """ Module containing the Data class"""
 # -*- coding: utf-8 -*-
 
+from collections import OrderedDict
 from .base_file import GENEfile
+from .continuation import continuation_cuts, glue_arrays, glue_lists
 import numpy as np
 
+# default memory budget for decoded arrays kept by Data
+DEFAULT_CACHE_BYTES = 512*1024**2
+
 class Data:
     """ Class to provide the data containers of a GENE parameters/simulation"""
-    def __init__(self, in_folder, extensions, runs=None):  
+    def __init__(self, in_folder, extensions, runs=None, usemmap=False, cache_bytes=DEFAULT_CACHE_BYTES):  
+        # memory map the binary files and hand out views instead of copies
+        self.usemmap = usemmap
+        # arrays read by any diagnostic, shared by all files. 0 disables it
+        self.cache = StepCache(cache_bytes) if cache_bytes else None
         self.av_vars = {'field': False,
                         'mom': False}
     
@@ -34,7 +43,8 @@ class Data:
         # field file
         if parameters.pnt.istep_field > 0:
             if not self.av_vars['field']:
-                self.field=GENEfile(folder, extension, 'field', parameters)
+                self.field=GENEfile(folder, extension, 'field', parameters, usemmap=self.usemmap)
+                self.field.cache=self.cache
                 self.av_vars['field']=True
                 t,s,f=self.field.get_times_and_inds()
                 self.av_times['field']=TimeStep(t,s,f)
@@ -48,14 +58,21 @@ class Data:
             if not self.av_vars['mom']:
                 self.av_vars['mom']=True
                 for i_spec in np.arange(parameters.pnt.n_spec):
-                    self.mom.append(GENEfile(folder, extension, 'mom', parameters,parameters.species[i_spec]['name']))
+                    self.mom.append(GENEfile(folder, extension, 'mom', parameters,parameters.species[i_spec]['name'],
+                                             usemmap=self.usemmap))
+                    self.mom[-1].cache=self.cache
                 
                 t,s,f=self.mom[0].get_times_and_inds()
                 self.av_times['mom']=TimeStep(t,s,f)
             else:    
-                self.field.redirect(folder,extension,parameters)
-                t,s,f=self.field.get_times_and_inds()
+                for mom in self.mom:
+                    mom.redirect(folder,extension,parameters)
+                t,s,f=self.mom[0].get_times_and_inds()
                 self.av_times['mom'].join_continuation(t,s,f)
+
+    def bytes_read(self):
+        """ Data bytes fetched from the field and mom files so far """
+        return sum(afile.bytes_read for afile in [self.field] + self.mom if afile is not None)
    
 
 
@@ -63,19 +80,86 @@ class AvailableTimes:
     pass
 
 
+class StepCache:
+    """ Least recently used cache of decoded arrays, keyed by (file, variable, step)
+
+        The total size of the stored arrays is kept below max_bytes. hits and
+        misses count the lookups.
+    """
+    def __init__(self, max_bytes=DEFAULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.__store = OrderedDict()
+
+    def get(self, key):
+        """ Return the cached array or None """
+        var = self.__store.get(key)
+        if var is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.__store.move_to_end(key)
+        return var
+
+    def __contains__(self, key):
+        return key in self.__store
+
+    def put(self, key, var):
+        """ Store an array, evicting the least recently used ones if needed """
+        if var.nbytes > self.max_bytes:
+            return
+        if key in self.__store:
+            self.nbytes -= self.__store.pop(key).nbytes
+        self.__store[key] = var
+        self.nbytes += var.nbytes
+        while self.nbytes > self.max_bytes:
+            _, old = self.__store.popitem(last=False)
+            self.nbytes -= old.nbytes
+
+    def clear(self):
+        self.__store.clear()
+        self.nbytes = 0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': len(self.__store), 'nbytes': self.nbytes}
+
+
 class TimeStep:
+    """ times (in GENE units), steps in the file and file extensions of the steps of a run
+
+        Continuation runs are collected by join_continuation and glued once, when
+        times, steps or files are used.
+    """
     def __init__(self, times, steps, files):
-        self.times = times  # times in GENE units
-        self.steps = steps  # step in the file 
-        self.files = files  # file extension      
-        
+        self.__segments = [(times, steps, files)]
+        self.__glued = None
+
     def join_continuation(self, times, steps, files):
-        self.steps = np.append(self.steps[self.times<times[0]], steps)
-        for i, e in reversed(list(enumerate(self.files))):
-            if not self.times[i] < times[0]:
-                self.files.remove(e)
-            else:
-                break
-        self.files.extend(files)
-        self.times = np.append(self.times[self.times<times[0]], times)
+        """ Add a continuation, its steps replace those at the same or later times """
+        self.__segments.append((times, steps, files))
+        self.__glued = None
+
+    def __glue(self):
+        if self.__glued is None:
+            n_keep = continuation_cuts([seg[0] for seg in self.__segments])
+            self.__glued = (glue_arrays([seg[0] for seg in self.__segments], n_keep),
+                            glue_arrays([seg[1] for seg in self.__segments], n_keep),
+                            glue_lists([seg[2] for seg in self.__segments], n_keep))
+            self.__segments = [self.__glued]
+        return self.__glued
+
+    @property
+    def times(self):
+        return self.__glue()[0]
+
+    @property
+    def steps(self):
+        return self.__glue()[1]
+
+    @property
+    def files(self):
+        return self.__glue()[2]
         
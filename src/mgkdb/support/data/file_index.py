@@ -0,0 +1,78 @@
+""" Sidecar index files for GENE binary outputs
+
+The time stamps of a field/mom file can only be found by walking through the
+whole file. We keep them next to the data file (e.g. field_0001.mgkidx) together
+with the record offsets and the state of the data file they were built from, so
+that the next time the file is opened the scan can be skipped.
+"""
+
+import os
+import numpy as np
+
+INDEX_EXTENSION = '.mgkidx'
+INDEX_VERSION = 1
+
+
+def index_filename(filename):
+    """ Name of the sidecar index belonging to a data file """
+    return str(filename) + INDEX_EXTENSION
+
+
+def file_signature(filename, precision, endianness, record_size):
+    """ Describe the data file state an index is valid for
+
+    :param filename: data file the index belongs to
+    :param precision: 'DOUBLE' or 'SINGLE' as in the parameters file
+    :param endianness: 'LITTLE' or 'BIG' as in the parameters file
+    :param record_size: size in bytes of one time step (time entry + all variables)
+    """
+    stat = os.stat(filename)
+    return {'version': INDEX_VERSION,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'precision': str(precision),
+            'endianness': str(endianness),
+            'record_size': int(record_size)}
+
+
+def read_index(filename, signature):
+    """ Return (times, offsets) stored in the sidecar of filename
+
+    None is returned if there is no index or if it was built from a
+    different version of the data file, in which case it must be rebuilt.
+    """
+    idxfile = index_filename(filename)
+    if not os.path.isfile(idxfile):
+        return None
+    try:
+        with np.load(idxfile, allow_pickle=False) as index:
+            for key, value in signature.items():
+                if index[key].item() != value:
+                    return None
+            return index['times'], index['offsets']
+    except (OSError, KeyError, ValueError):
+        # unreadable or from an older layout, just rebuild it
+        return None
+
+
+def write_index(filename, signature, times, offsets):
+    """ Store times and record offsets of filename in its sidecar index
+
+    The index is written to a temporary file first and moved in place so that a
+    concurrent reader never sees a partial index. Failing to write (e.g. read-only
+    run folder) is not an error, the file will simply be scanned next time.
+    """
+    idxfile = index_filename(filename)
+    tmpfile = idxfile + '.{}.tmp'.format(os.getpid())
+    try:
+        with open(tmpfile, 'wb') as fid:
+            np.savez(fid, times=np.asarray(times, dtype=np.float64),
+                     offsets=np.asarray(offsets, dtype=np.int64),
+                     **{key: np.array(value) for key, value in signature.items()})
+        os.replace(tmpfile, idxfile)
+    except OSError as err:
+        print('Could not write index {}: {}'.format(idxfile, err))
+        try:
+            os.remove(tmpfile)
+        except OSError:
+            pass
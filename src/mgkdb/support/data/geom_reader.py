@@ -0,0 +1,208 @@
+""" Fast reading of GENE geometry files with a process wide cache
+
+A geometry file starts with a copy of the geometry namelist (up to a line '/').
+For local runs it is followed by one line of 16 values per z point. For global
+runs every quantity has its name on a line followed by its values, 16 per line.
+The data part is converted with numpy in one call per quantity.
+
+All suffixes of a scan and all objects of a run (Run, pydiag Geometry,
+diagnostics) reading the same file share one parsed GeomFile, keyed by the
+path, size and modification time of the file (the last GEOM_CACHE_SIZE files
+are kept). Setting DISK_CACHE = True also keeps the parsed arrays in a .npz
+next to the geometry file, so that the next process can skip the parsing.
+"""
+
+import os
+import re
+from collections import OrderedDict
+import numpy as np
+
+GEOM_CACHE_EXTENSION = '.mgkgeom.npz'
+GEOM_CACHE_VERSION = 1
+# number of parsed geometry files kept in memory
+GEOM_CACHE_SIZE = 64
+# also keep the parsed geometry next to the file, see read_geometry
+DISK_CACHE = False
+
+# the 16 columns of a local geometry file, named as the sections of global files
+LOCAL_COLUMNS = ['gxx', 'gxy', 'gxz', 'gyy', 'gyz', 'gzz', 'Bfield', 'dBdx', 'dBdy', 'dBdz',
+                 'jacobian', 'geo_R', 'geo_phi', 'geo_Z', 'geo_c1', 'geo_c2']
+# sections of a global geometry file holding one value per x (or y) only
+GLOBAL_1D = ['q', 'C_y', 'C_xy', 'dpdx_pm_arr']
+GLOBAL_FIELDS = LOCAL_COLUMNS + GLOBAL_1D
+
+_HEADER_LINE = re.compile(r'^\s*(\w+)\s*=\s*(.*)$')
+_CACHE = OrderedDict()
+
+
+class GeomFile:
+    """ Content of a geometry file
+
+    header: the namelist at the top of the file, {name: value}
+    fields: {name: array}, local (nz0) or global (nz0, nx0 or nky0) for 2d
+            quantities and (nx0 or nky0) for 1d ones. The arrays are read-only
+            since they are shared by everyone reading the file.
+    """
+
+    def __init__(self, header, fields):
+        self.header = header
+        self.fields = fields
+        self.__derived = {}
+        for arr in self.fields.values():
+            arr.flags.writeable = False
+
+    def __getitem__(self, name):
+        return self.fields[name]
+
+    def derived(self, name, compute):
+        """ Quantities computed from the fields (e.g. curvature terms) by compute(self),
+            computed once and shared as the fields """
+        if name not in self.__derived:
+            result = compute(self)
+            for arr in (result if isinstance(result, tuple) else (result,)):
+                arr.flags.writeable = False
+            self.__derived[name] = result
+        return self.__derived[name]
+
+    def scalar(self, name, default=None):
+        """ Value of a header entry as float """
+        try:
+            return float(self.header[name])
+        except (KeyError, ValueError):
+            return default
+
+
+def _split(text):
+    """ Header lines and the data part of a geometry file """
+    lines = text.splitlines(keepends=True)
+    for i_l, line in enumerate(lines):
+        if line.startswith('/'):
+            return lines[:i_l], ''.join(lines[i_l + 1:])
+    return [], text
+
+
+def _parse_header(lines):
+    header = {}
+    for line in lines:
+        match = _HEADER_LINE.match(line)
+        if match:
+            header[match.group(1)] = match.group(2).strip()
+    return header
+
+
+def parse_geometry(text, nz0, nxorny=None):
+    """ Parse the content of a geometry file
+
+    :param nz0: number of z points
+    :param nxorny: nx0 (x global) or nky0 (y global), None for local runs
+    :returns: GeomFile
+    """
+    header_lines, data = _split(text)
+    header = _parse_header(header_lines)
+    if nxorny is None:
+        values = np.fromstring(data, dtype=np.float64, sep=' ')
+        if values.size < 16*nz0:
+            raise IOError("Geometry file has less than nz0={} points".format(nz0))
+        geom = values[:16*nz0].reshape(nz0, 16).T.copy()
+        return GeomFile(header, dict(zip(LOCAL_COLUMNS, geom)))
+
+    # global: a section starts with a line holding only the name of the quantity
+    starts = []
+    data_lines = data.splitlines(keepends=True)
+    offset = 0
+    for line in data_lines:
+        token = line.split()
+        if len(token) == 1 and token[0] in GLOBAL_FIELDS:
+            starts.append((token[0], offset, offset + len(line)))
+        elif len(token) == 1:
+            try:  # Test if it is a single number (can occur for 1d arrays)
+                float(token[0])
+            except ValueError:
+                raise RuntimeError("Unknown entry name in geometry file")
+        offset += len(line)
+    # quantities missing in the file are zero
+    fields = {name: np.zeros(nxorny if name in GLOBAL_1D else (nz0, nxorny))
+              for name in GLOBAL_FIELDS}
+    for i_s, (name, _, begin) in enumerate(starts):
+        end = starts[i_s + 1][1] if i_s + 1 < len(starts) else len(data)
+        values = np.fromstring(data[begin:end], dtype=np.float64, sep=' ')
+        if name in GLOBAL_1D:
+            fields[name] = values[:nxorny].copy()
+        else:
+            fields[name] = values[:nz0*nxorny].reshape(nz0, nxorny)
+    return GeomFile(header, fields)
+
+
+def _signature(filename):
+    stat = os.stat(filename)
+    return {'version': GEOM_CACHE_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _read_disk_cache(filename, signature, layout):
+    cachefile = str(filename) + GEOM_CACHE_EXTENSION
+    if not os.path.isfile(cachefile):
+        return None
+    try:
+        with np.load(cachefile, allow_pickle=False) as cache:
+            for key, value in dict(signature, layout=layout).items():
+                if cache['_' + key].item() != value:
+                    return None
+            header = dict(zip(cache['_header_keys'].tolist(), cache['_header_values'].tolist()))
+            fields = {key: cache[key] for key in cache.files if not key.startswith('_')}
+        return GeomFile(header, fields)
+    except (OSError, KeyError, ValueError):
+        # unreadable or from an older layout, just parse the file
+        return None
+
+
+def _write_disk_cache(filename, signature, layout, geom):
+    """ Failing to write (e.g. read-only run folder) is not an error """
+    cachefile = str(filename) + GEOM_CACHE_EXTENSION
+    tmpfile = cachefile + '.{}.tmp'.format(os.getpid())
+    try:
+        with open(tmpfile, 'wb') as fid:
+            np.savez(fid, _layout=np.array(layout),
+                     _header_keys=np.array(list(geom.header.keys()), dtype=str),
+                     _header_values=np.array(list(geom.header.values()), dtype=str),
+                     **{'_' + key: np.array(value) for key, value in signature.items()},
+                     **geom.fields)
+        os.replace(tmpfile, cachefile)
+    except OSError as err:
+        print('Could not write geometry cache {}: {}'.format(cachefile, err))
+        try:
+            os.remove(tmpfile)
+        except OSError:
+            pass
+
+
+def read_geometry(filename, nz0, nxorny=None, disk_cache=None):
+    """ Read a geometry file, parsed only once per process (and file version)
+
+    :param nz0: number of z points
+    :param nxorny: nx0 (x global) or nky0 (y global), None for local runs
+    :param disk_cache: use the .npz next to the file, DISK_CACHE if not given
+    :returns: GeomFile shared with all other readers of this file
+    """
+    if disk_cache is None:
+        disk_cache = DISK_CACHE
+    signature = _signature(filename)
+    layout = '{}x{}'.format(nz0, nxorny or 0)
+    key = (os.path.abspath(filename), signature['size'], signature['mtime_ns'], layout)
+    if key in _CACHE:
+        _CACHE.move_to_end(key)
+        return _CACHE[key]
+    geom = _read_disk_cache(filename, signature, layout) if disk_cache else None
+    if geom is None:
+        with open(filename) as geomfile:
+            geom = parse_geometry(geomfile.read(), nz0, nxorny)
+        if disk_cache:
+            _write_disk_cache(filename, signature, layout, geom)
+    _CACHE[key] = geom
+    if len(_CACHE) > GEOM_CACHE_SIZE:
+        _CACHE.popitem(last=False)
+    return geom
+
+
+def clear_cache():
+    """ Forget all geometries parsed in this process """
+    _CACHE.clear()
@@ -0,0 +1,164 @@
+""" Fast reading of GENE nrg files
+
+An nrg file is a sequence of blocks, one per time step: a line with the time
+followed by one line of nrgcols values for each species. The whole file is
+parsed at once with numpy, and the first and last time can be found from the
+head and tail of the file only. A last line without newline is still being
+written and is ignored, any other value which is not a number is an error.
+"""
+
+import os
+import warnings
+import numpy as np
+
+from .continuation import continuation_cuts, glue_arrays
+
+# bytes read from the end of the file at a time when looking for the last block
+TAIL_CHUNK = 64*1024
+
+
+def nrg_layout(lines):
+    """ Return (n_spec, n_col) from the first lines of an nrg file
+
+    lines should reach up to the second time stamp, if there is one.
+    """
+    lines = [line.split() for line in lines if line.strip()]
+    if not lines or len(lines[0]) != 1:
+        raise IOError("nrg data does not start with a time stamp")
+    n_spec = 0
+    for line in lines[1:]:
+        if len(line) == 1:
+            break
+        n_spec += 1
+    if n_spec == 0:
+        raise IOError("nrg data has no species lines")
+    return n_spec, len(lines[1])
+
+
+def _iter_lines(text):
+    """ Lines of a str or bytes text one at a time, without splitting all of it """
+    newline = b'\n' if isinstance(text, bytes) else '\n'
+    start = 0
+    while start < len(text):
+        end = text.find(newline, start)
+        end = len(text) if end < 0 else end + 1
+        line = text[start:end]
+        yield line.decode() if isinstance(line, bytes) else line
+        start = end
+
+
+def _head(lines):
+    """ Lines of an iterable up to and including the second time stamp """
+    head = []
+    for line in lines:
+        head.append(line)
+        if len(head) > 1 and len(line.split()) == 1:
+            break
+    return head
+
+
+def _layout(head, n_spec, n_col):
+    """ Check the given layout against the file, fill in what is not given """
+    found_spec, found_col = nrg_layout(head)
+    if n_col is not None and n_col != found_col:
+        raise IOError("Incorrect number of columns")
+    return (n_spec or found_spec), found_col
+
+
+def _n_values(n_lines, n_spec, n_col):
+    """ Number of values in n_lines lines of nrg data """
+    n_blocks, n_rest = divmod(n_lines, 1 + n_spec)
+    return n_blocks*(1 + n_spec*n_col) + (1 + (n_rest - 1)*n_col if n_rest else 0)
+
+
+def _parse_values(text, n_spec, n_col):
+    """ All numbers of the text, IOError if any token is not a number """
+    newline = b'\n' if isinstance(text, bytes) else '\n'
+    end = text.rfind(newline) + 1
+    if end < len(text):
+        # a last line without newline is still being written
+        text = text[:end]
+    with warnings.catch_warnings():
+        # numpy only warns when it stops at a token it cannot parse
+        warnings.simplefilter('ignore', DeprecationWarning)
+        flat = np.fromstring(text, dtype=np.float64, sep=' ')
+    if flat.size != _n_values(text.count(newline), n_spec, n_col):
+        # numpy stopped early, or the layout is off (e.g. blank lines): check line by line
+        n_values = 0
+        for i_line, line in enumerate(_iter_lines(text)):
+            n_line = len(line.split())
+            if n_line not in (0, 1, n_col):
+                raise IOError("Malformed nrg data: line {} has {} values".format(i_line + 1, n_line))
+            n_values += n_line
+        if flat.size != n_values:
+            raise IOError("Malformed nrg data: value {} is not a number".format(flat.size + 1))
+    return flat
+
+
+def _reshape(flat, n_spec, n_col):
+    """ Cut the flat list of numbers into time and (nt, n_spec, n_col) data,
+        an incomplete last block (file still being written) is dropped """
+    blocksize = 1 + n_spec*n_col
+    n_t = flat.size//blocksize
+    blocks = flat[:n_t*blocksize].reshape(n_t, blocksize)
+    return blocks[:, 0].copy(), blocks[:, 1:].reshape(n_t, n_spec, n_col)
+
+
+def parse_nrg(text, n_spec=None, n_col=None):
+    """ Parse the content of an nrg file
+
+    :param text: content of the file (str or bytes)
+    :param n_spec: number of species, found from the data if not given
+    :param n_col: number of columns (nrgcols), found from the data if not given
+    :returns: time (nt) and data (nt, n_spec, n_col) arrays
+    :raises IOError: if the data contains anything else than numbers
+    """
+    n_spec, n_col = _layout(_head(_iter_lines(text)), n_spec, n_col)
+    return _reshape(_parse_values(text, n_spec, n_col), n_spec, n_col)
+
+
+def read_nrg(filename, n_spec=None, n_col=None):
+    """ Read an nrg file, see parse_nrg """
+    with open(filename, 'rb') as nrgfile:
+        return parse_nrg(nrgfile.read(), n_spec, n_col)
+
+
+def read_nrg_chain(filenames, n_spec=None, n_col=None):
+    """ Read the nrg files of a chain of continuation runs glued into one time trace
+
+    Where the files overlap in time the later one is used, see continuation.
+    """
+    segments = [read_nrg(filename, n_spec, n_col) for filename in filenames]
+    n_keep = continuation_cuts([time for time, _ in segments])
+    return (glue_arrays([time for time, _ in segments], n_keep),
+            glue_arrays([data for _, data in segments], n_keep))
+
+
+def nrg_time_bounds(filename, n_spec=None):
+    """ First and last time stamp of an nrg file, reading only its head and tail
+
+    Only complete blocks are considered for the last time.
+    """
+    with open(filename) as nrgfile:
+        head = _head(nrgfile)
+    n_spec, n_col = _layout(head, n_spec, None)
+    t_first = float(head[0])
+
+    with open(filename, 'rb') as nrgfile:
+        size = os.fstat(nrgfile.fileno()).st_size
+        chunk = TAIL_CHUNK
+        while True:
+            start = max(size - chunk, 0)
+            nrgfile.seek(start)
+            lines = nrgfile.read(size - start).decode().splitlines()
+            if start > 0:
+                # the first line may be cut
+                lines = lines[1:]
+            lines = [line.split() for line in lines if line.strip()]
+            for i_l in range(len(lines) - n_spec - 1, -1, -1):
+                if len(lines[i_l]) == 1 and all(len(line) == n_col for line in
+                                                lines[i_l + 1:i_l + n_spec + 1]):
+                    return t_first, float(lines[i_l][0])
+            if start == 0:
+                return t_first, t_first
+            chunk *= 4
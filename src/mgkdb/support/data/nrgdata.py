@@ -1,10 +1,10 @@
 import glob
 import os
-import csv
 import numpy as np
 import h5py
 import pathlib
 from putils.par_io import Parameters
+from data.nrg_reader import read_nrg
 from putils.plotter import *
 
 import matplotlib.pyplot as plt
@@ -94,28 +94,13 @@ class NrgData():
                     self.data[:, ispec, i_d] = nrgfile.get("/nrg" + spec + "/" + dset)[()]
             nrgfile.close()
         else:
-            #open file read as csv, build numpy arrays.
+            #parse the whole ascii file at once
             fname = os.path.join(self.folder, 'nrg' + extension)
             if not os.path.isfile(fname):
                 raise Exception(os.path.abspath(fname) + " does not exist")
-            data = []
-            time = []   
-            with open(fname) as nrgfile:
-                csvnrg = csv.reader(nrgfile, delimiter=' ', skipinitialspace=True)
-                for line in csvnrg:
-                    if len(line) == 0:
-                        continue
-                    if len(line) == 1:
-                        time.append(float(line[0]))
-                        data.append([[] for _ in range(parameters.pnt.n_spec)])
-                        ispec = 0
-                    elif len(line) == parameters.pnt.nrgcols:
-                        data[-1][ispec] = line
-                        ispec += 1
-                    else:
-                        raise IOError("Incorrect number of columns")
-            self.data.append(np.array(data).astype(float, copy=False))
-            self.time.append(np.array(time).astype(float, copy=False))         
+            time, data = read_nrg(fname, parameters.pnt.n_spec, parameters.pnt.nrgcols)
+            self.data.append(data)
+            self.time.append(time)         
 
     def __concatenate(self):
         """ sort and concatenate traces"""             
@@ -0,0 +1,107 @@
+""" Fast reading of GENE parameters files with a process wide memo
+
+The same parameters file is read many times while uploading a run (linear or
+not, global variables, diagnostics, Run objects, ...). It is parsed once per
+process and file version; the Parameters classes (ParIO.py, putils/par_io.py,
+pydiag/utils/ParIO.py) build their own dictionaries from the shared, immutable
+result.
+"""
+
+import os
+import re
+from collections import namedtuple, OrderedDict
+
+# number of parsed files kept in memory
+MEMO_SIZE = 4096
+
+_COMMENTED = re.compile(r'\s*!\w*\s*=.*')
+_NAMELIST = re.compile(r'^\s*&(.*)')
+_ASSIGNMENT = re.compile(r'^\s*(.*)\s*=\s*(.*)')
+_COMMENT = re.compile(r'\s*([-+\'\"\[\];.,/a-zA-Z0-9_\s*]*)\s*!?\s*(.*)')
+BOOLSTR_T = (".T.", ".t.", "T", "t", ".true.")
+BOOLSTR_F = (".F.", ".f.", "F", "f", ".false.")
+
+# name: parameter name, raw: value as in the file, value: value without comment
+# cast to int, float or bool where possible, namelist: namelist it belongs to
+# (species namelists are numbered, e.g. species2), species: number of species
+# namelists found so far
+ParEntry = namedtuple('ParEntry', ['name', 'raw', 'value', 'namelist', 'species'])
+ParsedParameters = namedtuple('ParsedParameters', ['path', 'entries', 'namelists'])
+
+_MEMO = OrderedDict()
+
+
+def clearcomments(variable):
+    """ Remove a trailing comment unless it is a scan """
+    result = _COMMENT.search(variable)
+    if result and result.group(2)[:4] != 'scan':
+        return result.group(1)
+    else:
+        return variable
+
+
+def cast_value(variable):
+    """ Clear the comment and cast to int, float or bool where possible """
+    variable = clearcomments(variable)
+    try:  # Can it be converted to int?
+        variable = int(variable)
+    except ValueError:
+        try:  # No, but can it be converted to float?
+            variable = float(variable)
+        except ValueError:
+            pass
+    if variable in BOOLSTR_T:  # cast switches to boolean values
+        variable = True
+    elif variable in BOOLSTR_F:
+        variable = False
+    return variable
+
+
+def parse_parameters(lines, path=None):
+    """ Parse the lines of a parameters file into a ParsedParameters """
+    entries = []
+    namelists = []
+    countspec = 0
+    nml = None
+    for line in lines:
+        # Exclude commented lines
+        if _COMMENTED.search(line) is None:
+            # Check for and count species namelists
+            match = _NAMELIST.search(line)
+            if match:
+                # if namelist belongs to a species, append its number to the namelist
+                nml = match.group(1)
+                if nml == 'species':
+                    countspec += 1
+                    nml += str(countspec)
+                if nml not in namelists:
+                    namelists.append(nml)
+        # Search lines for <parameter> = <value> patterns
+        match = _ASSIGNMENT.search(line)
+        if match:
+            entries.append(ParEntry(match.group(1).strip(), match.group(2), cast_value(match.group(2)),
+                                    nml, countspec))
+    return ParsedParameters(path, tuple(entries), tuple(namelists))
+
+
+def read_parameters(path):
+    """ Parse a parameters file, only once per process as long as it is unchanged
+
+    :returns: ParsedParameters shared with all other readers of the file
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    if key in _MEMO:
+        _MEMO.move_to_end(key)
+        return _MEMO[key]
+    with open(path, "r") as parfile:
+        parsed = parse_parameters(parfile, str(path))
+    _MEMO[key] = parsed
+    if len(_MEMO) > MEMO_SIZE:
+        _MEMO.popitem(last=False)
+    return parsed
+
+
+def clear_memo():
+    """ Forget all parameters files parsed in this process """
+    _MEMO.clear()
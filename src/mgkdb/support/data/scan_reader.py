@@ -0,0 +1,84 @@
+""" Reading of the scan.log of a GENE scan
+
+scan.log has a header line naming the scanned parameters, followed by one line per
+run of the scan: the run number, the value of every scanned parameter and
+growth rate and frequency of every eigenvalue,
+
+    #Run  |   kymin 1     |   omt 1     /Eigenvalue1
+    0001  |   0.1000E+00  |   0.2000E+01  |   0.1234E+00   0.5678E+00
+
+The runs are numbered in column major ("Fortran") order of the scan dimensions,
+which are given in the scan namelist of the parameters file of the scan (without
+suffix) in inverse order. Runs missing in the log have NaN growth rates.
+"""
+
+import os
+from collections import namedtuple
+import numpy as np
+
+from .par_reader import read_parameters
+
+# names: scanned parameters, dims: points per scanned parameter, grid: (*dims, len(dims))
+# parameter values, growthrates, frequencies: (*dims, n_ev), runs: run numbers in the log
+ScanLog = namedtuple('ScanLog', ['names', 'dims', 'grid', 'growthrates', 'frequencies', 'runs'])
+
+
+def scan_shape(path):
+    """ (dims, n_ev) of the scan from the parameters file of the scan in folder path """
+    scan_dims = None
+    n_ev = 1
+    for entry in read_parameters(os.path.join(path, 'parameters')).entries:
+        if entry.name == 'scan_dims':
+            scan_dims = entry.value
+        elif entry.name == 'n_ev':
+            n_ev = int(entry.value)
+    if scan_dims is None:
+        raise IOError("No scan_dims in the parameters file of {}".format(path))
+    # The dimensions in the namelist are in inverse order of the scan.log file!
+    return [int(dim) for dim in str(scan_dims).split()][::-1], n_ev
+
+
+def parse_scanlog(lines, dims, n_ev=1):
+    """ Parse the lines of a scan.log into a ScanLog """
+    lines = iter(lines)
+    header = next(lines).split()
+    # First comes "#Run" then |, then the parameter, a spec number, another | ...
+    names = [header[2 + 3*ipar] for ipar in range(len(dims))]
+    grid = np.full(tuple(dims) + (len(dims),), np.nan)
+    growthrates = np.full(tuple(dims) + (n_ev,), np.nan)
+    frequencies = np.full(tuple(dims) + (n_ev,), np.nan)
+    runs = []
+    for line in lines:
+        lst = line.split()
+        if not lst:
+            continue
+        run = int(lst[0])
+        coord = scan_coord(run, dims)
+        grid[coord] = [float(lst[2 + 2*ipar]) for ipar in range(len(dims))]
+        growthrates[coord] = [float(lst[-(2 + 3*i_ev)]) for i_ev in range(n_ev)]
+        frequencies[coord] = [float(lst[-(1 + 3*i_ev)]) for i_ev in range(n_ev)]
+        runs.append(run)
+    return ScanLog(names, list(dims), grid, growthrates, frequencies, runs)
+
+
+def read_scanlog(path):
+    """ Read scan.log of the scan in folder path
+
+    :returns: ScanLog
+    """
+    dims, n_ev = scan_shape(path)
+    with open(os.path.join(path, 'scan.log'), 'r') as scanlog:
+        return parse_scanlog(scanlog, dims, n_ev)
+
+
+def scan_coord(run, dims):
+    """ Index in the scan grid of run number run (starting at 1) """
+    return np.unravel_index(run - 1, dims, order='F')
+
+
+def suffix_to_run(suffix):
+    """ Run number of a scan suffix like _0012, None for other suffixes """
+    try:
+        return int(suffix.lstrip('_'))
+    except ValueError:
+        return None
@@ -13,19 +13,33 @@ import scipy.linalg as linalg
 import matplotlib.pyplot as plt
 from .putils import averages
 from .diagnostics.baseplot import Plotting
+import multiprocessing
+import json
 import time
 import os
 
+# time traces longer than this are thinned out for plotting (averages use all points)
+MAX_TRACE_POINTS = 2000
+# written next to the figures of a record by render_record, {diagnostic: [figure names]}
+RENDER_MANIFEST = 'rendered.json'
+
 class diag_plot():
-    def __init__(self, data_dict, save_fig = False, save_dir = './'):
+    def __init__(self, data_dict, save_fig = False, save_dir = './', formats = ('png',),
+                 max_points = MAX_TRACE_POINTS):
         '''
         data_dict retrieved from database via 'load_diag' method
+        save_fig: write the figures to save_dir in all formats and close them
+                  instead of showing them
         '''
         self.data = data_dict['Diagnostics']
         self._id = data_dict['_id']
         self.meta = data_dict['Metadata'] if 'Metadata' in data_dict else None
         self.save_fig = save_fig
         self.save_dir = save_dir
+        self.formats = formats
+        self.max_points = max_points
+        # files written with save_fig
+        self.written = []
 
         self.avail_plts = {"Amplitude Spectra": self.diag_amplitude_spectra,
                            "Flux Spectra": self.diag_flux_spectra,
@@ -36,20 +50,52 @@ class diag_plot():
                            "Cross Phase": self.diag_crossphase}
         
         self.avail_diags = self.avail_plts.keys()
+
+    def _show(self, fig, name):
+        '''
+        Show the figure, or with save_fig write it as save_dir/name.<format> and close it
+        '''
+        if not self.save_fig:
+            fig.show()
+            return
+        name = name.replace(os.sep, '_').replace(' ', '_')
+        for fmt in self.formats:
+            filename = os.path.join(self.save_dir, '{}.{}'.format(name, fmt))
+            fig.savefig(filename)
+            self.written.append(filename)
+        plt.close(fig)
+
+    def _thin(self, time_requested):
+        '''
+        At most max_points of the time points, and the slice selecting them
+        '''
+        stride = max(1, int(np.ceil(len(time_requested)/self.max_points)))
+        sel = slice(None, None, stride)
+        return np.asarray(time_requested)[sel], sel
+
+    @staticmethod
+    def _time_average(traces, key, time_requested):
+        '''
+        Time average of traces[key], or the one accumulated at upload if only that was stored
+        '''
+        if key in traces:
+            return averages.mytrapz(traces[key], time_requested)
+        return traces[key + '_avg']
         
     def diag_amplitude_spectra(self):
         
-        kx = self.data['Grid']['kx_pos']
-        ky = self.data['Grid']['ky']
+        amp_spect = self.data['Amplitude Spectra']
+        kx = amp_spect['kxgrid']
+        ky = amp_spect['kygrid']
         
-        time_requested = self.data['Time']
+        time_requested = amp_spect['time']
         
         plotbase = Plotting()
         plotbase.titles.update(
                 {"Ges": r"$\Gamma_{es}$", "Qes": r"$Q_{es}$", "Pes": r"$\Pi_{es}$",
                  "Gem": r"$\Gamma_{em}$", "Qem": r"$Q_{em}$", "Pem": r"$\Pi_{em}$"})
     
-        for quant in self.data['Amplitude Spectra']['kx'].keys():
+        for quant in amp_spect['field_mom_names']:
 
             fig = plt.figure(figsize=(6, 8))
 #            fig_list.append(fig)
@@ -61,8 +107,8 @@ class diag_plot():
             ax_loglin_ky = fig.add_subplot(3, 2, 4)
             ax_linlin_ky = fig.add_subplot(3, 2, 6)
 
-            amplitude_kx = averages.mytrapz(self.data['Amplitude Spectra']['kx'][quant], time_requested)
-            amplitude_ky = averages.mytrapz(self.data['Amplitude Spectra']['ky'][quant], time_requested)
+            amplitude_kx = self._time_average(amp_spect[quant], 'kx', time_requested)
+            amplitude_ky = self._time_average(amp_spect[quant], 'ky', time_requested)
 
             # log-log plots, dashed lines for negative values
             baselogkx, = ax_loglog_kx.plot(kx, amplitude_kx)
@@ -102,17 +148,15 @@ class diag_plot():
             fig.suptitle( str(self._id) )
                 
             fig.tight_layout()
-            #plt.show()
-            fig.show() 
-            #if self.save_fig:
-            #    fig.savefig(os.path.join(self.save_dir, 'AmplitudeSpectra-{}-{}.png'.format(quant, time.strftime("%y%m%d-%H%M%S"))) )
+            self._show(fig, 'AmplitudeSpectra-{}'.format(quant))
 
     def diag_flux_spectra(self):
         
-        kx = self.data['Grid']['kx_pos']
-        ky = self.data['Grid']['ky']
+        flux_spect = self.data['Flux Spectra']
+        kx = flux_spect['kxgrid']
+        ky = flux_spect['kygrid']
         
-        time_requested = self.data['Time']
+        time_requested = flux_spect['time']
         
         plotbase = Plotting()
         plotbase.titles={"Ges": r"$\Gamma_{es}$", "Qes": r"$Q_{es}$", "Pes": r"$\Pi_{es}$"}
@@ -120,7 +164,9 @@ class diag_plot():
         plotbase.titles.update({"Gem": r"$\Gamma_{em}$", "Qem": r"$Q_{em}$", "Pem": r"$\Pi_{em}$"})
         
         
-        for spec in self.data['Flux Spectra'].keys():
+        for spec, spec_flux in flux_spect.items():
+            if not isinstance(spec_flux, dict):  # grids, time and description
+                continue
             fig = plt.figure(figsize=(6, 8))
 
             ax_loglog_kx = fig.add_subplot(3, 2, 1)
@@ -130,8 +176,6 @@ class diag_plot():
             ax_loglin_ky = fig.add_subplot(3, 2, 4)
             ax_linlin_ky = fig.add_subplot(3, 2, 6)
 
-            spec_flux = self.data['Flux Spectra'][spec]
-            
 #            if self.meta is not None:
 #                fig.suptitle(str(self._id) + ' from ' + str(self.meta))
 #            else:
@@ -139,8 +183,8 @@ class diag_plot():
 
             for flux in spec_flux.keys():
 
-                flux_kx = averages.mytrapz(spec_flux[flux]['kx'], time_requested)
-                flux_ky = averages.mytrapz(spec_flux[flux]['ky'], time_requested)
+                flux_kx = self._time_average(spec_flux[flux], 'kx', time_requested)
+                flux_ky = self._time_average(spec_flux[flux], 'ky', time_requested)
                 # Mask negative flux values for solid lines
 
                 pos_flux_kx = np.ma.masked_where((flux_kx <= 0), flux_kx)
@@ -193,10 +237,7 @@ class diag_plot():
             ax_loglog_ky.set_title("{}".format(spec))
             ax_loglog_kx.set_title("{}".format(spec))
             #            fig.tight_layout()
-            #plt.show()
-            fig.show()
-            #if self.save_fig:
-            #    fig.savefig(os.path.join(self.save_dir, 'FluxSpectra-{}-{}-{}.png'.format(spec,flux, time.strftime("%y%m%d-%H%M%S"))))
+            self._show(fig, 'FluxSpectra-{}'.format(spec))
     
     def diag_shearing_rate(self):
         
@@ -218,6 +259,7 @@ class diag_plot():
         x_lbl = r'$x/\rho_{ref}$' if self.data['Shearing Rate']['x_local'] else r'x/a'
 
         if len(time_requested) > 1:
+            time_plot, sel = self._thin(time_requested)
             # some maps
             fig = plt.figure()
 #            if self.meta is not None:
@@ -226,28 +268,25 @@ class diag_plot():
             fig.suptitle( str(self._id) )
                 
             ax = fig.add_subplot(2, 2, 1)
-            plot_a_map(ax, time_requested, x,
-                       self.data['Shearing Rate']['phi_zonal_x'].T,
+            plot_a_map(ax, time_plot, x,
+                       self.data['Shearing Rate']['phi_zonal_x'][sel].T,
                        r'$ t c_{ref}/L_{ref}$ ', x_lbl, r'$ \langle\phi\rangle [c_{ref}/L_{ref}]$')
 
             ax = fig.add_subplot(2, 2, 2)
-            plot_a_map(ax, time_requested, x,
-                       self.data['Shearing Rate']['Er_x'].T, r'$t c_{ref}/L_{ref}$',
+            plot_a_map(ax, time_plot, x,
+                       self.data['Shearing Rate']['Er_x'][sel].T, r'$t c_{ref}/L_{ref}$',
                        x_lbl, r'$E_r [eT_{ref}/ (\rho^*_{ref})^2 L_{ref}]$')
 
             ax = fig.add_subplot(2, 2, 3)
-            plot_a_map(ax, time_requested, x,
-                       self.data['Shearing Rate']['vExB_x'].T, r'$t c_{ref}/L_{ref}$',
+            plot_a_map(ax, time_plot, x,
+                       self.data['Shearing Rate']['vExB_x'][sel].T, r'$t c_{ref}/L_{ref}$',
                        x_lbl, r'$v_{ExB} [c_{ref} \rho^*_{ref}]$')
 
             ax = fig.add_subplot(2, 2, 4)
-            plot_a_map(ax, time_requested, x,
-                       self.data['Shearing Rate']['omegaExB_x'].T,
+            plot_a_map(ax, time_plot, x,
+                       self.data['Shearing Rate']['omegaExB_x'][sel].T,
                        r'$t c_{ref}/L_{ref}$', x_lbl, r'$\omega_{ExB} [c_{ref}/L_{ref}]$')
-            fig.show()
-            #if self.save_fig:
-            #    fig.savefig(os.path.join(self.save_dir, 'ShearingRate-map-{}.png'.format(time.strftime("%y%m%d-%H%M%S"))))
-            #plt.show()
+            self._show(fig, 'ShearingRate-map')
 
             # time traces
             my_pos = self.data['Shearing Rate']['my_pos']
@@ -259,19 +298,19 @@ class diag_plot():
             fig.suptitle( str(self._id) )
             ax = fig.add_subplot(2 + self.data['Shearing Rate']['x_local'], 1, 1)
 #            print(self.data['Shearing Rate']['vExB_x'][my_pos].shape)
-            ax.plot(time_requested, self.data['Shearing Rate']['vExB_x'][:,my_pos].T)
+            ax.plot(time_plot, self.data['Shearing Rate']['vExB_x'][sel, my_pos].T)
             ax.set_xlabel(r'$t c_{ref}/L_{ref}$')
             ax.set_ylabel(r'$v_{ExB} [c_{ref} \rho^*_{ref}]$')
 
             ax = fig.add_subplot(2 + self.data['Shearing Rate']['x_local'], 1, 2)
-            ax.plot(time_requested,
-                    self.data['Shearing Rate']['omegaExB_x'][:,my_pos].T)
+            ax.plot(time_plot,
+                    self.data['Shearing Rate']['omegaExB_x'][sel, my_pos].T)
             ax.set_xlabel(r'$t c_{ref}/L_{ref}$')
             ax.set_ylabel(r'$\omega_{ExB} [c_{ref} \rho^*_{ref}]$')
 
             if self.data['Shearing Rate']['x_local']:
                 ax = fig.add_subplot(2 + self.data['Shearing Rate']['x_local'], 1, 3)
-                ax.plot(time_requested, np.sqrt(np.mean(np.power(np.abs(self.data['Shearing Rate']['omegaExB_x']), 2),axis=1)).T) 
+                ax.plot(time_plot, np.sqrt(np.mean(np.power(np.abs(self.data['Shearing Rate']['omegaExB_x'][sel]), 2),axis=1)).T) 
                          
                 ax.set_xlabel(r'$t c_{ref}/L_{ref}$')
                 ax.set_ylabel(r'$\sqrt{|\omega_{ExB}|^2} [c_{ref}/L_{ref}]$')
@@ -284,10 +323,7 @@ class diag_plot():
 #                    output.info_txt.insert(END, str_out + "\n")
 #                    output.info_txt.see(END)
 
-            fig.show()
-            #if self.save_fig:
-            #    fig.savefig(os.path.join(self.save_dir, 'ShearingRate-TT.png'.format(time.strftime("%y%m%d-%H%M%S")) ))
-            #plt.show()
+            self._show(fig, 'ShearingRate-TT')
 
         # zonal spectra
         if self.data['Shearing Rate']['x_local']:
@@ -311,10 +347,7 @@ class diag_plot():
             ax.plot(self.data['Grid']['kx_pos'], averages.mytrapz(self.data['Shearing Rate']['abs_phi_fs'], time_requested))
             ax.set_xlabel(r'$k_x \rho_{ref}$')
 
-            fig.show()
-            #if self.save_fig:
-            #    fig.savefig(os.path.join(self.save_dir, 'ShearingRate-ZS-{}.png'.format(time.strftime("%y%m%d-%H%M%S"))))
-            #plt.show()
+            self._show(fig, 'ShearingRate-ZS')
 
         # radial plots
         fig = plt.figure()
@@ -344,10 +377,7 @@ class diag_plot():
         ax.set_ylabel(r'$\omega_{ExB} [c_{ref} \rho^*_{ref}]$')
 
         fig.tight_layout()    
-        #plt.show()
-        fig.show()
-        #if self.save_fig:
-        #    fig.savefig(os.path.join(self.save_dir, 'ShearingRate-R-{}.png'.format(time.strftime("%y%m%d-%H%M%S"))))
+        self._show(fig, 'ShearingRate-R')
     
 #    def diag_ballamp(self):
 #        plotbase = Plotting()
@@ -510,7 +540,7 @@ class diag_plot():
                 ax_3.legend()
                 
                 fig.suptitle( str(self._id) )
-                fig.show()
+                self._show(fig, 'FreqGrowthRate-ky{:.3f}'.format(act_ky))
 
                 fig_t = plt.figure()
                 a_1 = fig_t.add_subplot(2, 1, 1)
@@ -525,7 +555,7 @@ class diag_plot():
                 a_2.set_ylabel(r"$\gamma c_{ref}/L_{ref}$")
                 
                 fig_t.suptitle( str(self._id) )
-                fig_t.show()
+                self._show(fig_t, 'FreqGrowthRate-ky{:.3f}-traces'.format(act_ky))
 
         plotbase = Plotting()
         plot_all = 1 if self.data['Freq Growth Rate']['opts']['show']['value'] else 0
@@ -549,7 +579,7 @@ class diag_plot():
         a_2.set_ylabel(r"$\omega c_{ref}/L_{ref}$")
         
         fig_f.suptitle( str(self._id) )
-        fig_f.show()
+        self._show(fig_f, 'FreqGrowthRate')
         
         
     def diag_crossphase(self):
@@ -576,7 +606,7 @@ class diag_plot():
             fig.colorbar(cm1)
             fig.tight_layout()
             fig.suptitle( str(self._id) )
-            fig.show()
+            self._show(fig, 'CrossPhase-{}'.format(spec))
             
     def diag_contours(self):
         plotbase = Plotting()
@@ -622,7 +652,7 @@ class diag_plot():
                                             averages.mytrapz(self.data['Contours']['contours'][quant], self.data['Time']),
                                             is_f, x_lbl, y_lbl, ttl)
                 fig.suptitle( str(self._id) )
-                fig.show()
+                self._show(fig, 'Contours-{}'.format(quant))
         else:
             for quant in self.data['Contours']['contours'].keys():
                 ind_str = quant.find('#')
@@ -636,13 +666,14 @@ class diag_plot():
                 plotbase.plot_contour_quant_timeseries(ax, fig, x, y, self.data['Contours']['contours'][quant], is_f,
                                                        self.data['Time'], x_lbl, y_lbl, ttl)
                 fig.suptitle( str(self._id) )
-                fig.show()
+                self._show(fig, 'Contours-{}'.format(quant))
 #        plt.show()
        
                 
     def plot_all(self):
         for p in self.avail_plts.keys():
-            self.avail_plts[p]()
+            if p in self.data:
+                self.avail_plts[p]()
     
     def print_avail_diags(self):
         print("Available diagnostics are: {}".format(self.avail_diags) )
@@ -660,8 +691,97 @@ class diag_plot():
 #        self.diag_ballamp()
 #        self.diag_crossphase()
 #        self.diag_freqgrowrate()
-        
-    
-        
-        
-        
+
+
+def _source_time(record):
+    '''
+    Time (seconds since epoch) the diagnostics of a record were last updated, None if unknown
+    '''
+    try:
+        return time.mktime(time.strptime(record['Metadata']['DBtag']['last_updated'], "%y%m%d-%H%M%S"))
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _up_to_date(out_dir, names, formats, source_time):
+    if source_time is None or not names:
+        return False
+    for name in names:
+        for fmt in formats:
+            filename = os.path.join(out_dir, '{}.{}'.format(name, fmt))
+            if not os.path.isfile(filename) or os.path.getmtime(filename) <= source_time:
+                return False
+    return True
+
+
+def render_record(record, out_dir, formats=('png',), max_points=MAX_TRACE_POINTS, force=False):
+    '''
+    Write the figures of all diagnostics of a record to out_dir/<_id>/<figure>.<format>
+
+    A diagnostic is skipped if its figures (as listed in the manifest of the last
+    rendering) are newer than the last update of the record, unless force is set.
+    Returns the list of files written.
+    '''
+    run_dir = os.path.join(out_dir, str(record['_id']))
+    os.makedirs(run_dir, exist_ok=True)
+    manifest_file = os.path.join(run_dir, RENDER_MANIFEST)
+    manifest = {}
+    if os.path.isfile(manifest_file):
+        try:
+            with open(manifest_file) as fid:
+                manifest = json.load(fid)
+        except (OSError, ValueError):
+            manifest = {}
+
+    plotter = diag_plot(record, save_fig=True, save_dir=run_dir, formats=formats, max_points=max_points)
+    source_time = _source_time(record)
+    written = []
+    for diag, plot in plotter.avail_plts.items():
+        if diag not in plotter.data:
+            continue
+        if not force and _up_to_date(run_dir, manifest.get(diag), formats, source_time):
+            continue
+        plotter.written = []
+        try:
+            plot()
+        except Exception as e:
+            print('Could not plot {} of {}: {}'.format(diag, record['_id'], e))
+            plt.close('all')
+            continue
+        manifest[diag] = sorted({os.path.splitext(os.path.basename(filename))[0]
+                                 for filename in plotter.written})
+        written += plotter.written
+
+    tmpfile = manifest_file + '.{}.tmp'.format(os.getpid())
+    try:
+        with open(tmpfile, 'w') as fid:
+            json.dump(manifest, fid, indent=1)
+        os.replace(tmpfile, manifest_file)
+    except OSError as err:
+        print('Could not write {}: {}'.format(manifest_file, err))
+    return written
+
+
+def _init_render_worker():
+    # no display in the workers, and the session of the caller keeps its backend
+    plt.switch_backend('Agg')
+
+
+def _render_record_star(args):
+    return render_record(*args)
+
+
+def render_batch(records, out_dir, workers=1, formats=('png',), max_points=MAX_TRACE_POINTS, force=False):
+    '''
+    Render the diagnostics of many records (as from load) headless, one record per
+    task of a pool of workers processes, see render_record.
+    Returns the list of all files written.
+    '''
+    records = [r for r in records if r is not None and 'Diagnostics' in r]
+    if not records:
+        return []
+    os.makedirs(out_dir, exist_ok=True)
+    tasks = [(record, out_dir, tuple(formats), max_points, force) for record in records]
+    with multiprocessing.Pool(max(1, min(workers, len(tasks))), initializer=_init_render_worker) as pool:
+        results = pool.map(_render_record_star, tasks, chunksize=1)
+    return [filename for result in results for filename in result]
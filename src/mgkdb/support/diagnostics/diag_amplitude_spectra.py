@@ -3,17 +3,23 @@
 from tkinter import END
 import matplotlib.pyplot as plt
 import numpy as np
-from ..putils.averages import mytrapz, xy_av3d
+from ..putils.averages import mytrapz
+from ..putils.time_traces import TraceStack
 from .baseplot import Plotting
 from .diagnostic import Diagnostic
 
 
 class DiagAmplitudeSpectra(Diagnostic):
+    partial_attrs = ['traces']
 
-    def __init__(self):
+    def __init__(self, keep=True, average=False):
+        """ keep: store the spectra of every time point
+            average: accumulate their time average, always done if not keep """
         super().__init__()
         self.name = 'Amplitude spectra'
         self.tabs = ['fluxtube']
+        self.keep = keep
+        self.average = average
 
     def get_info(self):
         self.need_file={'field': True,
@@ -23,17 +29,12 @@ class DiagAmplitudeSpectra(Diagnostic):
     
     def setup_options(self, run):
         self.specnames = run.parameters.pnt.specnames
-        self.time = []
         self.n_fields = run.parameters.pnt.n_fields
         self.n_moms = run.parameters.pnt.n_moms
         self.n_spectra = int(run.parameters.pnt.n_fields + run.parameters.pnt.n_moms*len(self.specnames))
         self.kx=run.spatialgrid.kx_pos
         self.ky=run.spatialgrid.ky
         self.z=run.spatialgrid.z
-        self.amplitude_spectra_kx=[]
-        self.amplitude_spectra_ky=[]
-        self.amplitude_profiles_z=[]
-        self.amplitude_profiles_z_ky0=[]
         self.momlist = ["dens", "tpar", "tperp", "qpar", "qperp", "upar", 'densI1', 'TparI1', 'TppI1']
         self.field_mom_names=[]
         self.field_mom_names.append('phi')
@@ -44,69 +45,76 @@ class DiagAmplitudeSpectra(Diagnostic):
         for i in self.specnames:
             for j in range(self.n_moms):
                 self.field_mom_names.append(self.momlist[j]+i)
-        
-        
+
+        if not (run.parameters.pnt.x_local and run.parameters.pnt.y_local):
+            raise NotImplementedError("Amplitude spectra only ready for local simulations")
+        # weights and fold indices used at every step
+        nx0 = run.parameters.pnt.nx0
+        self.__jac = run.geometry.jacobian/np.sum(run.geometry.jacobian)
+        self.__w_ky = np.full(self.ky.size, 2.0)
+        self.__w_ky[0] = 1.0
+        # finite kx gets the ky>0 modes of kx and -kx
+        self.__kx_pos = np.arange(1, self.kx.size)
+        self.__kx_neg = (nx0 - self.__kx_pos)%nx0
+
+        # |A|^2 of all fields and moments at one step
+        self.__power = np.empty((self.n_spectra, nx0, self.ky.size, self.z.size))
+        # results of all time points, [time, field or moment, k]
+        self.traces = TraceStack({'kx': (self.n_spectra, self.kx.size),
+                                  'ky': (self.n_spectra, self.ky.size),
+                                  'z': (self.n_spectra, self.z.size),
+                                  'z_ky0': (self.n_spectra, self.z.size)},
+                                 keep=self.keep, average=self.average)
+        self.time = self.traces.time
+
+    def reserve(self, nt):
+        self.traces.reserve(nt)
+
+    @property
+    def amplitude_spectra_kx(self):
+        return self.traces['kx']
+
+    @property
+    def amplitude_spectra_ky(self):
+        return self.traces['ky']
+
+    @property
+    def amplitude_profiles_z(self):
+        return self.traces['z']
+
+    @property
+    def amplitude_profiles_z_ky0(self):
+        return self.traces['z_ky0']
+
     def execute(self, data, run, steps, extensions,time_point):
-        self.time.append(time_point)
-        def kx_spectra(a_field):
-            #sum ky modes accounting for the complx conj.
-            spectra=np.zeros((self.kx.size,a_field.shape[-1]))
-            # kx=0 mode
-            spectra[0,:] = 2.0*np.sum(np.abs(a_field[0,1:,:])**2,axis=0) + np.abs(a_field[0,0,:])**2
-            #finite kx\
-            spectra[1:,:] = np.abs(a_field[1:self.kx.size,0,:])**2 + \
-                   np.sum(np.abs(a_field[1:self.kx.size,1:,:])**2 + 
-                   np.abs(a_field[-1:self.kx.size-2:-1,1:,:])**2,axis=1)
-            return spectra
-   
-        amplitude_kx=np.empty((self.n_spectra, run.spatialgrid.kx_pos.size))
-        amplitude_ky=np.empty((self.n_spectra, run.spatialgrid.ky.size))
-        amplitude_z=np.empty((self.n_spectra, run.spatialgrid.z.size))
-        amplitude_z_ky0=np.empty((self.n_spectra, run.spatialgrid.z.size))
-        tmp=data.field.phi(step=steps['field'], extension=extensions['field'])
-
-        amplitude_ky[0,:]=np.average(np.sum(np.abs(tmp)**2,axis=0), weights=run.geometry.jacobian, axis=-1)
-        amplitude_kx[0,:]=np.average(kx_spectra(tmp), weights=run.geometry.jacobian, axis=-1)
-        amplitude_z[0,:] = xy_av3d(abs(tmp)**2,run.geometry) 
-        amplitude_z_ky0[0,:] = np.sum(abs(tmp[:,0,:])**2,axis=0) 
-        #plt.plot(self.z,amplitude_z[0,:])
-        #plt.plot(self.z,amplitude_z_ky0[0,:])
-        #plt.title('amplitude_z')
-        #plt.show()
-        
-        if self.n_fields>1:
-            tmp=data.field.A_par(step=steps['field'], extension=extensions['field'])
-            amplitude_ky[1,:]=np.average(np.sum(np.abs(tmp)**2,axis=0), weights=run.geometry.jacobian, axis=-1)
-            amplitude_kx[1,:]=np.average(kx_spectra(tmp), weights=run.geometry.jacobian, axis=-1)
-            amplitude_z[1,:] = xy_av3d(abs(tmp)**2,run.geometry) 
-            amplitude_z_ky0[1,:] = np.sum(abs(tmp[:,0,:])**2,axis=0) 
-            
-        if self.n_fields>2:
-            tmp=data.field.B_par(step=steps['field'], extension=extensions['field'])
-            amplitude_ky[2,:]=np.average(np.sum(np.abs(tmp)**2,axis=0), weights=run.geometry.jacobian, axis=-1)
-            amplitude_kx[2,:]=np.average(kx_spectra(tmp), weights=run.geometry.jacobian, axis=-1)
-            amplitude_z[2,:] = xy_av3d(abs(tmp)**2,run.geometry) 
-            amplitude_z_ky0[2,:] = np.sum(abs(tmp[:,0,:])**2,axis=0) 
-             
+
+        quants = [(data.field, 'phi', 'field'), (data.field, 'A_par', 'field'),
+                  (data.field, 'B_par', 'field')][:self.n_fields]
         for i_spec, spec in enumerate(run.parameters.specnames):
-            for i_quant, quant in enumerate(data.mom[i_spec].varnames.values()):
-                tmp = getattr(data.mom[i_spec],quant)(step=steps['mom'], extension=extensions['mom'])
-                amplitude_ky[self.n_fields+len(self.specnames)*i_spec+i_quant,:]=np.average(
-                        np.sum(np.abs(tmp)**2,axis=0), weights=run.geometry.jacobian, axis=-1)
-                amplitude_kx[self.n_fields+len(self.specnames)*i_spec+i_quant,:]=np.average(
-                        kx_spectra(tmp), weights=run.geometry.jacobian, axis=-1) 
-                amplitude_z[self.n_fields+len(self.specnames)*i_spec+i_quant,:] = xy_av3d(abs(tmp)**2,run.geometry) 
-                amplitude_z_ky0[self.n_fields+len(self.specnames)*i_spec+i_quant,:] = np.sum(abs(tmp[:,0,:])**2,axis=0) 
-                
-        self.amplitude_spectra_ky.append(amplitude_ky)
-        self.amplitude_spectra_kx.append(amplitude_kx)
-        self.amplitude_profiles_z.append(amplitude_z)
-        self.amplitude_profiles_z_ky0.append(amplitude_z_ky0)
+            for quant in data.mom[i_spec].varnames.values():
+                quants.append((data.mom[i_spec], quant, 'mom'))
+        for i_q, (afile, quant, kind) in enumerate(quants):
+            tmp = getattr(afile, quant)(step=steps[kind], extension=extensions[kind])
+            np.square(tmp.real, out=self.__power[i_q])
+            self.__power[i_q] += np.square(tmp.imag)
+
+        out = self.traces.next()
+        # z average first, everything else is sums over kx and ky
+        power_xy = np.einsum('qxyz,z->qxy', self.__power, self.__jac)
+        np.sum(power_xy, axis=1, out=out['ky'])
+        #sum ky modes accounting for the complx conj.
+        kx_out = out['kx']
+        kx_out[:, 0] = power_xy[:, 0, 0] + 2.0*np.sum(power_xy[:, 0, 1:], axis=-1)
+        kx_out[:, 1:] = power_xy[:, self.__kx_pos, 0] + np.sum(
+                power_xy[:, self.__kx_pos, 1:] + power_xy[:, self.__kx_neg, 1:], axis=-1)
+        np.einsum('qxyz,y->qz', self.__power, self.__w_ky, out=out['z'])
+        np.sum(self.__power[:, :, 0, :], axis=1, out=out['z_ky0'])
+        self.traces.commit(time_point)
                 
     def dict_to_mgkdb(self):
         
         amp_spect = {}
-        amp_spect['Description'] = 'Spectra of the squares of all available fields and moments as a function of kx or ky (averaged over other variables).  The structure is [field_or_moment][kx or ky][time list][data on the kx or ky grid]. The time points are in [time].  The names of the fields and moments are in [field_mom_names].  The appropriate grids are in [kxgrid] and [kygrid] and  [zgrid].'
+        amp_spect['Description'] = 'Spectra of the squares of all available fields and moments as a function of kx or ky (averaged over other variables).  The structure is [field_or_moment][kx or ky], an array of [time point, kx or ky grid]. If time averages were accumulated they are in [kx_avg], [ky_avg], [z_avg] and [z_ky0_avg]. The time points are in [time].  The names of the fields and moments are in [field_mom_names].  The appropriate grids are in [kxgrid] and [kygrid] and  [zgrid].'
         amp_spect['time'] = self.time
         amp_spect['field_mom_names'] = self.field_mom_names
         amp_spect['kxgrid'] = self.kx
@@ -114,15 +122,11 @@ class DiagAmplitudeSpectra(Diagnostic):
         amp_spect['zgrid'] = self.z
         for i in range(len(self.field_mom_names)):
             amp_spect[self.field_mom_names[i]] = {}
-            amp_spect[self.field_mom_names[i]]['kx'] = []
-            amp_spect[self.field_mom_names[i]]['ky'] = []
-            amp_spect[self.field_mom_names[i]]['z'] = []
-            amp_spect[self.field_mom_names[i]]['z_ky0'] = []
-            for j in range(len(self.amplitude_spectra_ky)):
-                amp_spect[self.field_mom_names[i]]['kx'].append(self.amplitude_spectra_kx[j][i,:])
-                amp_spect[self.field_mom_names[i]]['ky'].append(self.amplitude_spectra_ky[j][i,:])
-                amp_spect[self.field_mom_names[i]]['z'].append(self.amplitude_profiles_z[j][i,:])
-                amp_spect[self.field_mom_names[i]]['z_ky0'].append(self.amplitude_profiles_z_ky0[j][i,:])
+            for k in ['kx', 'ky', 'z', 'z_ky0']:
+                if self.traces.keep:
+                    amp_spect[self.field_mom_names[i]][k] = self.traces[k][:, i, :]
+                if self.traces.average and self.traces.nt > 0:
+                    amp_spect[self.field_mom_names[i]][k + '_avg'] = self.traces.mean(k)[i, :]
         return amp_spect
         
     def plot(self, time_requested, output=None, out_folder=None):
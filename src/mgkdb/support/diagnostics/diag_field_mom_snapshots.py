@@ -5,9 +5,11 @@ import matplotlib.pyplot as plt
 import numpy as np
 from .baseplot import Plotting
 from .diagnostic import Diagnostic
+from ..putils.time_traces import TraceStack
 
 
 class DiagFieldMomSnapshots(Diagnostic):
+    partial_attrs = ['traces']
 
     def __init__(self):
         super().__init__()
@@ -23,10 +25,9 @@ class DiagFieldMomSnapshots(Diagnostic):
     
     def setup_options(self, run):
         self.specnames = run.parameters.pnt.specnames
-        self.time = []
         self.n_fields = run.parameters.pnt.n_fields
-        self.fm_snapshots = []
         self.fm_final = {}
+        self.__final = None
         self.n_moms = run.parameters.pnt.n_moms
         self.n_spectra = int(run.parameters.pnt.n_fields + run.parameters.pnt.n_moms*len(self.specnames))
         self.kx=run.spatialgrid.kx
@@ -46,68 +47,86 @@ class DiagFieldMomSnapshots(Diagnostic):
         for i in self.specnames:
             for j in range(self.n_moms):
                 self.field_mom_names.append(self.momlist[j]+i)
-        
+        # sparse snapshots of all time points, [time, field or moment, kx, ky, four z points]
+        if self.nonlinear:
+            self.traces = TraceStack({'fm': (self.n_spectra, run.parameters.pnt.nx0,
+                                             run.parameters.pnt.nky0, 4)}, dtype=complex)
+        else:
+            self.traces = TraceStack({})
+        self.time = self.traces.time
+
+    def reserve(self, nt):
+        self.traces.reserve(nt)
+
+    @property
+    def fm_snapshots(self):
+        return self.traces['fm']
         
     def execute(self, data, run, steps, extensions,time_point):
         #print('fms 47')
-        self.time.append(time_point)
         nz0 = run.parameters.pnt.nz0
         #print(run.parameters.pnt.nonlinear)
         #print('nonlinear',nonlinear)
         #dummy = input("press key")
         self.zgrid_sparse = [self.zgrid[0],self.zgrid[int(nz0/4)],self.zgrid[int(nz0/2)],self.zgrid[int(3*nz0/4)]]
-        if self.nonlinear:
-            fm_sparse = np.empty((self.n_spectra,run.parameters.pnt.nx0,run.parameters.pnt.nky0,4),dtype='complex')
-   
-        #print('fms 54')
-        #print('shape of fm_sparse',np.shape(fm_sparse))
-        tmp=data.field.phi(step=steps['field'], extension=extensions['field'])
-        #print('shape of tmp',np.shape(tmp))
-        self.fm_final[self.field_mom_names[0]] = tmp
-        if self.nonlinear:
-            fm_sparse[0,:,:,0] = tmp[:,:,0]
-            fm_sparse[0,:,:,1] = tmp[:,:,int(nz0/4)]
-            fm_sparse[0,:,:,2] = tmp[:,:,int(nz0/2)]
-            fm_sparse[0,:,:,3] = tmp[:,:,int(3*nz0/4)]
-        #print('fms 60')
-        if self.n_fields>1:
-            tmp=data.field.A_par(step=steps['field'], extension=extensions['field'])
-            if self.nonlinear:
-                fm_sparse[1,:,:,0] = tmp[:,:,0]
-                fm_sparse[1,:,:,1] = tmp[:,:,int(nz0/4)]
-                fm_sparse[1,:,:,2] = tmp[:,:,int(nz0/2)]
-                fm_sparse[1,:,:,3] = tmp[:,:,int(3*nz0/4)]
-            self.fm_final[self.field_mom_names[1]] = tmp
-        if self.n_fields>2:
-            tmp=data.field.B_par(step=steps['field'], extension=extensions['field'])
-            if self.nonlinear:
-                fm_sparse[2,:,:,0] = tmp[:,:,0]
-                fm_sparse[2,:,:,1] = tmp[:,:,int(nz0/4)]
-                fm_sparse[2,:,:,2] = tmp[:,:,int(nz0/2)]
-                fm_sparse[2,:,:,3] = tmp[:,:,int(3*nz0/4)]
-            self.fm_final[self.field_mom_names[2]] = tmp
-             
+        if not self.nonlinear:
+            self.__read_final(data, run, steps, extensions)
+            self.traces.commit(time_point)
+            return
+
+        # only the sparse z planes are read here, the full 3D data of the
+        # final time point is read once in dict_to_mgkdb
+        self.__final = (data, run, steps, extensions)
+        planes = [0, int(nz0/4), int(nz0/2), int(3*nz0/4)]
+        fm_sparse = self.traces.next()['fm']
+        for i_field, quant in enumerate(['phi', 'A_par', 'B_par'][:self.n_fields]):
+            fm_sparse[i_field] = data.field.read_planes(quant, steps['field'], planes, extensions['field'])
         #print('fms 73')
         for i_spec, spec in enumerate(run.parameters.specnames):
             for i_quant, quant in enumerate(data.mom[i_spec].varnames.values()):
-                tmp = getattr(data.mom[i_spec],quant)(step=steps['mom'], extension=extensions['mom'])
-                if self.nonlinear:
-                    fm_sparse[self.n_fields+len(self.specnames)*i_spec+i_quant,:,:,0] = tmp[:,:,0]
-                    fm_sparse[self.n_fields+len(self.specnames)*i_spec+i_quant,:,:,1] = tmp[:,:,int(nz0/4)]
-                    fm_sparse[self.n_fields+len(self.specnames)*i_spec+i_quant,:,:,2] = tmp[:,:,int(nz0/2)]
-                    fm_sparse[self.n_fields+len(self.specnames)*i_spec+i_quant,:,:,3] = tmp[:,:,int(3*nz0/4)]
-                self.fm_final[self.field_mom_names[self.n_fields+len(self.specnames)*i_spec+i_quant]] = tmp
-                        
+                fm_sparse[self.n_fields+self.n_moms*i_spec+i_quant] = data.mom[i_spec].read_planes(
+                        quant, steps['mom'], planes, extensions['mom'])
         #print('fms 82')
-        if self.nonlinear:
-            self.fm_snapshots.append(fm_sparse)
-                
+        self.traces.commit(time_point)
+
+    def __read_final(self, data, run, steps, extensions):
+        """ Full 3D data of all fields and moments """
+        for i_field, quant in enumerate(['phi', 'A_par', 'B_par'][:self.n_fields]):
+            self.fm_final[self.field_mom_names[i_field]] = getattr(data.field, quant)(
+                    step=steps['field'], extension=extensions['field'])
+        for i_spec, spec in enumerate(run.parameters.specnames):
+            for i_quant, quant in enumerate(data.mom[i_spec].varnames.values()):
+                tmp = getattr(data.mom[i_spec],quant)(step=steps['mom'], extension=extensions['mom'])
+                self.fm_final[self.field_mom_names[self.n_fields+self.n_moms*i_spec+i_quant]] = tmp
+
+    def partial_result(self):
+        partial = super().partial_result()
+        if self.nonlinear and self.__final is not None:
+            self.__read_final(*self.__final)
+            self.__final = None
+        partial['fm_final'] = self.fm_final
+        partial['zgrid_sparse'] = getattr(self, 'zgrid_sparse', None)
+        return partial
+
+    def merge(self, partials):
+        super().merge(partials)
+        for partial in partials:
+            if partial['fm_final']:
+                # the last block with data has the final time point
+                self.fm_final = partial['fm_final']
+                self.__final = None
+            if partial['zgrid_sparse'] is not None:
+                self.zgrid_sparse = partial['zgrid_sparse']
+
     def dict_to_mgkdb(self):
         
         #print('fms 83')
+        if self.nonlinear and self.__final is not None:
+            self.__read_final(*self.__final)
+            self.__final = None
         fm_out = {}
         if self.nonlinear:
-            fm_out['Description'] = 'All fields and moments at selected time points at z = -pi,-pi/2,0,pi/2.  The structure is [field_or_moment][time list][kx,ky,four z points]. The time points are in [time].  The names of the fields and moments are in [field_mom_names].  The appropriate grids are in [kxgrid], [kygrid], and [zgrid_sparse].  The full 3D data for each field and moment at the final time point is stored in [field_mom_final][name]'
+            fm_out['Description'] = 'All fields and moments at selected time points at z = -pi,-pi/2,0,pi/2.  The structure is [field_or_moment], an array of [time point,kx,ky,four z points]. The time points are in [time].  The names of the fields and moments are in [field_mom_names].  The appropriate grids are in [kxgrid], [kygrid], and [zgrid_sparse].  The full 3D data for each field and moment at the final time point is stored in [field_mom_final][name]'
         else:
             fm_out['Description'] = 'For linear: The final time point is in [time].  The names of the fields and moments are in [field_mom_names].  The appropriate grids are in [kxgrid], [kygrid], and [zgrid].  The full 3D data for each field and moment at the final time point is stored in [field_mom_final][name]'
         fm_out['time'] = self.time
@@ -121,9 +140,7 @@ class DiagFieldMomSnapshots(Diagnostic):
         #print('fms 91')
         if self.nonlinear:
             for i in range(len(self.field_mom_names)):
-                fm_out[self.field_mom_names[i]] = []
-                for j in range(len(self.fm_snapshots)):
-                    fm_out[self.field_mom_names[i]].append(self.fm_snapshots[j][i,:,:,:])
+                fm_out[self.field_mom_names[i]] = self.fm_snapshots[:, i]
         return fm_out
         
     def plot(self, time_requested, output=None, out_folder=None):
@@ -4,7 +4,8 @@ import os
 import h5py
 import matplotlib.pyplot as plt
 import numpy as np
-from ..putils.averages import flux_spectra_yz_av, flux_spectra_xz_av, xy_av3d_zprofile, mytrapz
+from ..putils.averages import flux_spectra_weights, flux_spectra_batch, mytrapz
+from ..putils.time_traces import TraceStack
 from .baseplot import Plotting
 from .diagnostic import Diagnostic
 from copy import deepcopy
@@ -12,14 +13,23 @@ from copy import deepcopy
 
 class DiagFluxSpectra(Diagnostic):
     # pylint: disable=invalid-name
-    def __init__(self, avail_vars=None, specnames=None):
+    partial_attrs = ['traces']
+
+    def __init__(self, avail_vars=None, specnames=None, keep=True, average=False):
+        """ keep: store the spectra of every time point
+            average: accumulate their time average, always done if not keep """
         super().__init__()
         self.name = 'Flux spectra'
         self.tabs = ['fluxtube']
+        self.keep = keep
+        self.average = average
 
     def get_info(self):
         self.need_file={'field': True,
-                        'mom': True}
+                        'mom': True,
+                        'vars': {'field': ['phi', 'A_par', 'B_par'],
+                                 'mom': ['dens', 'T_par', 'T_perp', 'u_par', 'q_par', 'q_perp',
+                                         'densI1', 'TparI1', 'TppI1']}}
 
         return self.need_file
     
@@ -29,168 +39,147 @@ class DiagFluxSpectra(Diagnostic):
         self.kx=run.spatialgrid.kx_pos
         self.ky=run.spatialgrid.ky
         self.z=run.spatialgrid.z
-        self.flux_spectra_kx=[]
-        self.flux_spectra_ky=[]
-        self.flux_profile_z=[]
-        self.time = []
-
-    def execute(self, data, run, steps, extensions,time_point):
-        #We use species, quantity kx y
-        print("Executing flux spectra.")
-        __spectra_kx=np.empty((len(self.specnames), 6 if self.has_EM else 3,
-                               run.spatialgrid.kx_pos.size))
-        __spectra_ky=np.empty((len(self.specnames), 6 if self.has_EM else 3,
-                               run.spatialgrid.ky.size))
-        __profile_z=np.empty((len(self.specnames), 6 if self.has_EM else 3,
-                               run.spatialgrid.z.size))
-
-        self.time.append(time_point)
-        vE_x = -1.0j*run.spatialgrid.ky[np.newaxis, :, np.newaxis] \
-            * data.field.phi(step=steps['field'], extension=extensions['field'])
-
-        if run.parameters.pnt.n_fields>1:
-            B_x = 1.0j*run.spatialgrid.ky[np.newaxis, :, np.newaxis] \
-                * data.field.A_par(step=steps['field'], extension=extensions['field'])
-
-            
-        #print("56")
+        self.__ky = run.spatialgrid.ky[:, np.newaxis]
+        self.__Bfield = run.geometry.Bfield
+        self.__weights = flux_spectra_weights(run.geometry)
+
+        # every flux is Re(field*conj(sum of moments)), we group them by field term:
+        # vE (ExB velocity), B (A_par flutter), dB (B_par compression) and store
+        # the weight of each moment in each flux for all species
+        nspec = len(self.specnames)
+        nflux = 6 if self.has_EM else 3
+        self.__groups = [('vE', ['dens', 'T_par', 'T_perp', 'u_par'])]
+        if self.has_EM:
+            self.__groups.append(('B', ['dens', 'T_par', 'u_par', 'q_par', 'q_perp']))
+            if run.parameters.pnt.bpar:
+                self.__groups.append(('dB', ['densI1', 'TparI1', 'TppI1']))
+        self.__coef = {key: np.zeros((nspec, nflux, len(names))) for key, names in self.__groups}
         for i_spec,spec in enumerate(run.parameters.specnames):
             n0 = run.parameters.pardict["dens{}".format(spec)]
             T0 = run.parameters.pardict["temp{}".format(spec)]
             mass = run.parameters.pardict["mass{}".format(spec)]
             charge = run.parameters.pardict["charge{}".format(spec)]
+            # G_es, Q_es, P_es
+            self.__coef['vE'][i_spec, 0] = [n0, 0, 0, 0]
+            self.__coef['vE'][i_spec, 1] = [3./2.*n0*T0, 0.5*n0*T0, n0*T0, 0]
+            self.__coef['vE'][i_spec, 2] = [0, 0, 0, n0*mass]
+            if self.has_EM:
+                # G_em, Q_em, P_em
+#TODO verify PEM something is wrong in either GENE or here
+                self.__coef['B'][i_spec, 3] = [0, 0, n0, 0, 0]
+                self.__coef['B'][i_spec, 4] = [0, 0, 0, n0*T0, n0*T0]
+                self.__coef['B'][i_spec, 5] = [n0*mass, n0*mass, 0, 0, 0]
+            if 'dB' in self.__coef:
+                # todo check if the normalization is correct
+                self.__coef['dB'][i_spec, 3] = [n0*T0/charge, 0, 0]
+                self.__coef['dB'][i_spec, 4] = [0, n0*T0*T0/charge, n0*T0*T0/charge]
+        for key in self.__coef:
+            self.__coef[key] /= run.geometry.Cxy
+
+        # spectra of all time points, [time, species, flux, k]
+        self.traces = TraceStack({'kx': (nspec, nflux, self.kx.size),
+                                  'ky': (nspec, nflux, self.ky.size),
+                                  'z': (nspec, nflux, self.z.size)},
+                                 keep=self.keep, average=self.average)
+        self.time = self.traces.time
+
+        # moments of all species are stacked into these buffers at each step
+        shape = (run.parameters.pnt.nx0, run.parameters.pnt.nky0, run.parameters.pnt.nz0)
+        self.__moms = {key: np.empty((nspec, len(names)) + shape, dtype=complex)
+                       for key, names in self.__groups}
 
-            dens = data.mom[i_spec].dens(step=steps['mom'], extension=extensions['mom'])
-            T_par = data.mom[i_spec].T_par(step=steps['mom'], extension=extensions['mom'])
-            T_perp = data.mom[i_spec].T_perp(step=steps['mom'], extension=extensions['mom'])
-            u_par = data.mom[i_spec].u_par(step=steps['mom'], extension=extensions['mom'])
+    def execute(self, data, run, steps, extensions,time_point):
+        #We use species, quantity kx y
+        print("Executing flux spectra.")
 
-            G_es = vE_x*np.conj(dens)*n0/run.geometry.Cxy
-            __spectra_kx[i_spec,0,:]=flux_spectra_yz_av(G_es, run.geometry)
-            __spectra_ky[i_spec,0,:]=flux_spectra_xz_av(G_es, run.geometry)
-            __profile_z[i_spec,0,:] = xy_av3d_zprofile(np.real(G_es),run.geometry)
-            
-            Q_es = (vE_x*np.conj(0.5*T_par + T_perp + 3./2.*dens)*n0*T0)/run.geometry.Cxy
-            __spectra_kx[i_spec,1,:]=flux_spectra_yz_av(Q_es, run.geometry)
-            __spectra_ky[i_spec,1,:]=flux_spectra_xz_av(Q_es, run.geometry)
-            __profile_z[i_spec,1,:] = xy_av3d_zprofile(np.real(Q_es),run.geometry)
-            #plt.plot(self.__spectra_ky[i_spec,1,:])
-            #plt.title(str(time_point))
-            #plt.show()
-            #plt.plot(self.__spectra_kx[i_spec,1,:])
-            #plt.title(str(time_point))
-            #plt.show()
-            
-            P_es = (vE_x*np.conj(u_par)*n0*mass)/run.geometry.Cxy
-            __spectra_kx[i_spec,2,:]=flux_spectra_yz_av(P_es, run.geometry)
-            __spectra_ky[i_spec,2,:]=flux_spectra_xz_av(P_es, run.geometry)
-            __profile_z[i_spec,2,:] = xy_av3d_zprofile(np.real(P_es),run.geometry)
-            
-            #print("89")
-            if run.parameters.pnt.n_fields>1:
-                Q_par = data.mom[i_spec].q_par(step=steps['mom'], extension=extensions['mom'])
-                Q_perp = data.mom[i_spec].q_perp(step=steps['mom'], extension=extensions['mom'])
-
-                G_em = B_x*np.conj(u_par)*n0/run.geometry.Cxy
-                Q_em = B_x*np.conj(Q_par + Q_perp)*n0*T0/run.geometry.Cxy
-                P_em = B_x*np.conj(T_par + dens)*n0*mass/run.geometry.Cxy
-#TODO verify PEM something is wrong in either GENE or here
-                if run.parameters.pnt.bpar:
-                    # todo check if the normalization is correct
-                    dBpar_dy_norm = -1j*run.spatialgrid.ky[np.newaxis,:,np.newaxis]* \
-                            data.field.B_par(step=steps['field'], extension=extensions['field'])/ \
-                            run.geometry.Bfield[np.newaxis, np.newaxis,:]*T0/charge
-                            
-                    densI1 = data.mom[i_spec].densI1(step=steps['mom'], extension=extensions['mom'])
-                    TparI1 = data.mom[i_spec].TparI1(step=steps['mom'], extension=extensions['mom'])
-                    TppI1 = data.mom[i_spec].TppI1(step=steps['mom'], extension=extensions['mom'])
-
-                    G_em = G_em + (dBpar_dy_norm*np.conj(densI1))*n0/run.geometry.Cxy
-                    Q_em = Q_em + (dBpar_dy_norm*np.conj(TparI1 + TppI1))*n0*T0/run.geometry.Cxy
-                    
-                __spectra_kx[i_spec,3,:]=flux_spectra_yz_av(G_em, run.geometry)
-                __spectra_ky[i_spec,3,:]=flux_spectra_xz_av(G_em, run.geometry)
-                __profile_z[i_spec,3,:] = xy_av3d_zprofile(np.real(G_em),run.geometry)
-                __spectra_kx[i_spec,4,:]=flux_spectra_yz_av(Q_em, run.geometry)
-                __spectra_ky[i_spec,4,:]=flux_spectra_xz_av(Q_em, run.geometry)
-                __profile_z[i_spec,4,:] = xy_av3d_zprofile(np.real(Q_em),run.geometry)
-                __spectra_kx[i_spec,5,:]=flux_spectra_yz_av(P_em, run.geometry)
-                __spectra_ky[i_spec,5,:]=flux_spectra_xz_av(P_em, run.geometry)
-                __profile_z[i_spec,5,:] = xy_av3d_zprofile(np.real(P_em),run.geometry)
-                           
-        #plt.plot(self.ky,__spectra_ky[1,1,:])
-        #plt.title(str(time_point))
-        #plt.show()
-        #print("124")
-        #if len(self.flux_spectra_ky) > 0:
-        #    plt.plot(self.flux_spectra_ky[0][1,1,:])
-        #    plt.show()
-        self.flux_spectra_kx.append((__spectra_kx))
-        self.flux_spectra_ky.append((__spectra_ky))
-        self.flux_profile_z.append(__profile_z)
+        def get_field(name):
+            return getattr(data.field, name)(step=steps['field'], extension=extensions['field'])
+
+        def get_mom(i_spec, name):
+            return getattr(data.mom[i_spec], name)(step=steps['mom'], extension=extensions['mom'])
+
+        __spectra_kx, __spectra_ky, __profile_z = self.__compute(get_field, get_mom, self.__moms)
+        self.traces.append(time_point, kx=__spectra_kx, ky=__spectra_ky, z=__profile_z)
+
+    def execute_window(self, data, run, steps, extension, time_points):
+        """ Same as execute for several time points of one file at once
+
+            steps is a dictionary {'field': list of steps, 'mom': list of steps}
+        """
+        print("Executing flux spectra for {} time points.".format(len(time_points)))
+        self.traces.reserve(self.traces.nt + len(time_points))
+
+        def get_field(name):
+            return data.field.read_window(name, steps['field'], extension=extension)
+
+        def get_mom(i_spec, name):
+            return data.mom[i_spec].read_window(name, steps['mom'], extension=extension)
+
+        __spectra_kx, __spectra_ky, __profile_z = self.__compute(get_field, get_mom)
+        for it, time_point in enumerate(time_points):
+            self.traces.append(time_point, kx=__spectra_kx[it], ky=__spectra_ky[it], z=__profile_z[it])
+
+    def reserve(self, nt):
+        self.traces.reserve(nt)
+
+    @property
+    def flux_spectra_kx(self):
+        return self.traces['kx']
+
+    @property
+    def flux_spectra_ky(self):
+        return self.traces['ky']
+
+    @property
+    def flux_profile_z(self):
+        return self.traces['z']
+
+    def __compute(self, get_field, get_mom, moms=None):
+        """ All flux spectra of all species, the flux of each field term is done in one go """
+        result = None
+        for key, names in self.__groups:
+            if key == 'vE':
+                field = -1.0j*self.__ky*get_field('phi')
+            elif key == 'B':
+                field = 1.0j*self.__ky*get_field('A_par')
+            else:
+                field = -1.0j*self.__ky*get_field('B_par')/self.__Bfield
+            if moms is None:
+                stack = np.stack([np.stack([get_mom(i_spec, name) for name in names], axis=-4)
+                                  for i_spec in range(len(self.specnames))], axis=-5)
+            else:
+                stack = moms[key]
+                for i_spec in range(len(self.specnames)):
+                    for i_mom, name in enumerate(names):
+                        stack[i_spec, i_mom] = get_mom(i_spec, name)
+            spectra = flux_spectra_batch(field, stack, self.__coef[key], self.__weights)
+            if result is None:
+                result = spectra
+            else:
+                for total, part in zip(result, spectra):
+                    total += part
+        return result
 
 
     def dict_to_mgkdb(self):
         self.flux = {}
-        self.flux['Description'] = 'Spectra of all fluxes as a function of kx or ky (averaged over other variables).  The structure is [species][which_flux][kx or ky][time list][data on the kx or ky grid]. The z profiles of fluxes (averaged over kx, ky and with a factor of 1/gxx**0.5) are in [species][which flux][z][time list][data on z grid]. The time points are in [time].  The appropriate grids are in [kxgrid], [kygrid], and [zgrid].'  
+        self.flux['Description'] = 'Spectra of all fluxes as a function of kx or ky (averaged over other variables).  The structure is [species][which_flux][kx or ky], an array of [time point, kx or ky grid]. The z profiles of fluxes (averaged over kx, ky and with a factor of 1/gxx**0.5) are in [species][which flux][z], an array of [time point, z grid]. If time averages were accumulated they are in [kx_avg], [ky_avg] and [z_avg]. The time points are in [time].  The appropriate grids are in [kxgrid], [kygrid], and [zgrid].'  
         #plt.plot(self.flux_spectra_kx[0][0,0,:])
         #plt.show()
         self.flux['kxgrid'] = self.kx
         self.flux['kygrid'] = self.ky
         self.flux['zgrid'] = self.z
         self.flux['time'] = self.time
+        fluxnames = ['Ges', 'Qes', 'Pes', 'Gem', 'Qem', 'Pem'][:6 if self.has_EM else 3]
         for i in range(len(self.specnames)):
             self.flux[self.specnames[i]]={}
-            self.flux[self.specnames[i]]['Qes']={}
-            self.flux[self.specnames[i]]['Pes']={}
-            self.flux[self.specnames[i]]['Ges']={}
-            self.flux[self.specnames[i]]['Ges']['kx'] = []
-            self.flux[self.specnames[i]]['Qes']['kx'] = []
-            self.flux[self.specnames[i]]['Pes']['kx'] = []
-            self.flux[self.specnames[i]]['Ges']['ky'] = []
-            self.flux[self.specnames[i]]['Qes']['ky'] = []
-            self.flux[self.specnames[i]]['Pes']['ky'] = []
-            self.flux[self.specnames[i]]['Ges']['z'] = []
-            self.flux[self.specnames[i]]['Qes']['z'] = []
-            self.flux[self.specnames[i]]['Pes']['z'] = []
-                    
-            #print('dfs 120')
-            if self.has_EM:
-                #print('dfs 122')
-                self.flux[self.specnames[i]]['Gem']={}
-                self.flux[self.specnames[i]]['Qem']={}
-                self.flux[self.specnames[i]]['Pem']={}
-                self.flux[self.specnames[i]]['Gem']['kx'] = []
-                self.flux[self.specnames[i]]['Qem']['kx'] = []
-                self.flux[self.specnames[i]]['Pem']['kx'] = []
-                self.flux[self.specnames[i]]['Gem']['ky'] = []
-                self.flux[self.specnames[i]]['Qem']['ky'] = []
-                self.flux[self.specnames[i]]['Pem']['ky'] = []
-                self.flux[self.specnames[i]]['Gem']['z'] = []
-                self.flux[self.specnames[i]]['Qem']['z'] = []
-                self.flux[self.specnames[i]]['Pem']['z'] = []
-            for j in range(len(self.flux_spectra_kx)):
-                #print('len(self.flux_spectra_kx)',len(self.flux_spectra_kx))
-                #print('dfs 133')
-                self.flux[self.specnames[i]]['Ges']['kx'].append( self.flux_spectra_kx[j][i,0,:])
-                self.flux[self.specnames[i]]['Qes']['kx'].append( self.flux_spectra_kx[j][i,1,:])
-                self.flux[self.specnames[i]]['Pes']['kx'].append( self.flux_spectra_kx[j][i,2,:])
-                self.flux[self.specnames[i]]['Ges']['ky'].append( self.flux_spectra_ky[j][i,0,:])
-                self.flux[self.specnames[i]]['Qes']['ky'].append( self.flux_spectra_ky[j][i,1,:])
-                self.flux[self.specnames[i]]['Pes']['ky'].append( self.flux_spectra_ky[j][i,2,:])
-                self.flux[self.specnames[i]]['Ges']['z'].append(self.flux_profile_z[j][i,0,:])
-                self.flux[self.specnames[i]]['Qes']['z'].append(self.flux_profile_z[j][i,1,:])
-                self.flux[self.specnames[i]]['Pes']['z'].append(self.flux_profile_z[j][i,2,:])
-                if self.has_EM:
-                    self.flux[self.specnames[i]]['Gem']['kx'].append(self.flux_spectra_kx[j][i,3,:])
-                    self.flux[self.specnames[i]]['Qem']['kx'].append(self.flux_spectra_kx[j][i,4,:])
-                    self.flux[self.specnames[i]]['Pem']['kx'].append(self.flux_spectra_kx[j][i,5,:])
-                    self.flux[self.specnames[i]]['Gem']['ky'].append(self.flux_spectra_ky[j][i,3,:])
-                    self.flux[self.specnames[i]]['Qem']['ky'].append(self.flux_spectra_ky[j][i,4,:])
-                    self.flux[self.specnames[i]]['Pem']['ky'].append(self.flux_spectra_ky[j][i,5,:])
-                    self.flux[self.specnames[i]]['Gem']['z'].append(self.flux_profile_z[j][i,3,:])
-                    self.flux[self.specnames[i]]['Qem']['z'].append(self.flux_profile_z[j][i,4,:])
-                    self.flux[self.specnames[i]]['Pem']['z'].append(self.flux_profile_z[j][i,5,:])
+            for j, fluxname in enumerate(fluxnames):
+                self.flux[self.specnames[i]][fluxname] = {}
+                for k in ['kx', 'ky', 'z']:
+                    if self.traces.keep:
+                        self.flux[self.specnames[i]][fluxname][k] = self.traces[k][:, i, j, :]
+                    if self.traces.average and self.traces.nt > 0:
+                        self.flux[self.specnames[i]][fluxname][k + '_avg'] = self.traces.mean(k)[i, j, :]
         return self.flux
         
     def plot(self, time_requested, output=None, out_folder=None):
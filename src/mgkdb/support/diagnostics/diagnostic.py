@@ -32,6 +32,25 @@ class Diagnostic(abc.ABC):
 #    def save(self, time_requested, output=None, out_folder=None):
 #        """ This saves the data on disk"""
 
+    # lists (or TraceStacks) with one entry per executed time point, see partial_result/merge
+    partial_attrs = ['time']
+
+    def reserve(self, nt):
+        """ Called before the loop with the number of times execute will be called,
+            so results can be preallocated """
+
+    def partial_result(self):
+        """ What execute has accumulated, e.g. in a worker process that only got
+            part of the time points. Must be picklable """
+        return {attr: getattr(self, attr) for attr in self.partial_attrs}
+
+    def merge(self, partials):
+        """ Append the partial results of other instances, given in time order.
+            setup_options must have been called on this one """
+        for partial in partials:
+            for attr in self.partial_attrs:
+                getattr(self, attr).extend(partial[attr])
+
 
     def set_defaults(self):
         """ we set the default options, in case the option gui is not called"""
@@ -1,109 +1,156 @@
-import numpy as np
-from .interp import *
-
-def get_mat_fd_d1_o4(size,dx,plot_matrix=False):
-    """Creates matrix for centered finite difference, first derivative, 4th order.
-    size: size of (number of elements in) quantity to be differentiated
-    dx: grid spacing (for constant grid)."""
-
-    prefactor=1.0/(12.0*dx)
-    mat=np.zeros((size,size),dtype='float')    
-    for i in range(size):
-        if i-1 >= 0:
-            mat[i,i-1]=-8
-        if i-2 >= 0:
-            mat[i,i-2]=1
-        if i+1 <= size-1:
-            mat[i,i+1]=8
-        if i+2 <= size-1:
-            mat[i,i+2]=-1
-   
-    mat=prefactor*mat
-
-    if plot_matrix:
-        plt.contourf(mat,50)
-        plt.colorbar()
-        plt.show()
-
-    return mat
-
-    
-def fd_d1_o4(var,grid,mat=False):
-    """Centered finite difference, first derivative, 4th order.
-    var: quantity to be differentiated.
-    grid: grid for var 
-    mat: matrix for the finite-differencing operator. if mat=False then it is created"""
-
-    if not mat:
-        mat=get_mat_fd_d1_o4(len(var),grid[1]-grid[0])
-
-    dvar=-np.dot(mat,var)
-    dvar[0]=0.0
-    dvar[1]=0.0
-    #dvar[2]=0.0
-    dvar[-1]=0.0
-    dvar[-2]=0.0
-    #dvar[-3]=0.0
-    return -dvar 
-
-def fd_d1_o4_uneven(var,grid,mat=False,return_new_grid = False):
-    """Centered finite difference, first derivative, 4th order.  Evenly spaced grid is created and var is interpolated onto this grid.  Derivative is interpolated back onto original grid.
-    var: quantity to be differentiated.
-    grid: grid for var 
-    mat: matrix for the finite-differencing operator. if mat=False then it is created"""
-
-    N = 2.0*len(grid)
-    grid0 = np.linspace(grid[0],grid[-1],N)
-    var0 = interp(grid,var,grid0)
-
-    if not mat:
-        mat=get_mat_fd_d1_o4(len(var0),grid0[1]-grid0[0])
-
-    dvar0=-np.dot(mat,var0)
-    dvar0[0]=0.0
-    dvar0[1]=0.0
-    dvar0[-1]=0.0
-    dvar0[-2]=0.0
-
-    if return_new_grid:
-        return grid0,-dvar0
-    else:
-        dvar = np.zeros(len(grid))
-        dvar[2:-2] = interp(grid0[2:-2],dvar0[2:-2],grid[2:-2])
-        return -dvar 
-
-def fd_d1_o4_smoothend(var,grid,mat=False):
-    """Centered finite difference, first derivative, 4th order using extrapolation to get boundary points
-    var: quantity to be differentiated.
-    grid: grid for var 
-    mat: matrix for the finite-differencing operator. if mat=False then it is created"""
-
-    dx = grid[1]-grid[0]
-    grid0 = np.linspace(grid[0]-2*dx,grid[-1]+2*dx,len(grid)+4)
-    var0 = interp(grid,var,grid0)
-
-    if not mat:
-        mat=get_mat_fd_d1_o4(len(var0),grid0[1]-grid0[0])
-
-    dvar0=-np.dot(mat,var0)
-    dvar_out=dvar0[2:-2]
-
-    return -dvar_out 
- 
-    
-def invert_fd_d1_o4(var,grid,mat=False):
-    """Invert cenntered finite difference, first derivative, 4th order.
-    var: quantity to be integrated.
-    grid: grid for var 
-    mat: matrix for the finite-differencing operator. if mat=False then it is created
-    note--mat will be inverted for this operation"""
-
-    if not mat:
-        mat=get_mat_fd_d1_o4(len(var),grid[1]-grid[0])
-
-    imat=np.linalg.inv(mat)
-
-    ivar=np.dot(imat,var)
-    return ivar 
-
-
+import numpy as np
+from scipy import sparse
+from scipy.interpolate import make_interp_spline
+from scipy.linalg import solve_banded
+from .interp import *
+
+# centered first derivative, 4th order: (f[i-2] - 8f[i-1] + 8f[i+1] - f[i+2])/(12dx)
+FD_D1_O4_OFFSETS = (-2, -1, 1, 2)
+FD_D1_O4_COEFFS = (1.0, -8.0, 8.0, -1.0)
+# banded operators by (size, dx), see get_sparse_fd_d1_o4
+_SPARSE_CACHE = {}
+
+
+def get_mat_fd_d1_o4(size,dx,plot_matrix=False):
+    """Creates matrix for centered finite difference, first derivative, 4th order.
+    size: size of (number of elements in) quantity to be differentiated
+    dx: grid spacing (for constant grid).
+    The derivatives below do not need the matrix, use get_sparse_fd_d1_o4 for a banded one."""
+
+    prefactor=1.0/(12.0*dx)
+    mat=np.zeros((size,size),dtype='float')
+    ind=np.arange(size)
+    for offset,coeff in zip(FD_D1_O4_OFFSETS,FD_D1_O4_COEFFS):
+        rows=ind[max(0,-offset):size-max(0,offset)]
+        mat[rows,rows+offset]=coeff
+
+    mat=prefactor*mat
+
+    if plot_matrix:
+        import matplotlib.pyplot as plt
+        plt.contourf(mat,50)
+        plt.colorbar()
+        plt.show()
+
+    return mat
+
+
+def get_sparse_fd_d1_o4(size,dx):
+    """Same operator as get_mat_fd_d1_o4 as a scipy.sparse banded (csr) matrix.
+    Operators are cached by (size, dx) and shared, do not modify them."""
+
+    key=(int(size),float(dx))
+    if key not in _SPARSE_CACHE:
+        prefactor=1.0/(12.0*dx)
+        _SPARSE_CACHE[key]=sparse.diags([prefactor*coeff for coeff in FD_D1_O4_COEFFS],
+                                        FD_D1_O4_OFFSETS,shape=(size,size),format='csr')
+    return _SPARSE_CACHE[key]
+
+
+def apply_fd_d1_o4(var,dx,axis=0):
+    """Product of get_mat_fd_d1_o4 with var along axis, from the 5 point stencil.
+    var: array of any dimension, all 1d slices along axis are differentiated at once
+    dx: grid spacing"""
+
+    var=np.moveaxis(np.asarray(var),axis,0)
+    # the matrix rows at the boundaries are the stencil with zeros outside
+    padded=np.zeros((var.shape[0]+4,)+var.shape[1:],dtype=np.result_type(var,float))
+    padded[2:-2]=var
+    dvar=(padded[:-4]-padded[4:]+8.0*(padded[3:-1]-padded[1:-3]))/(12.0*dx)
+    return np.moveaxis(dvar,0,axis)
+
+
+def _apply_mat(mat,var,axis):
+    """mat (dense or sparse) times all 1d slices of var along axis"""
+
+    var=np.moveaxis(np.asarray(var),axis,0)
+    dvar=mat.dot(var.reshape(var.shape[0],-1)).reshape(var.shape)
+    return np.moveaxis(dvar,0,axis)
+
+
+def _d1_o4(var,dx,mat,axis):
+    if mat is None or mat is False:
+        return apply_fd_d1_o4(var,dx,axis)
+    return _apply_mat(mat,var,axis)
+
+
+def _spline(grid,var,axis):
+    """Cubic interpolating spline of var along axis, as interp"""
+
+    return make_interp_spline(grid,var,k=3,axis=axis)
+
+
+def fd_d1_o4(var,grid,mat=False,axis=0):
+    """Centered finite difference, first derivative, 4th order.
+    var: quantity to be differentiated.
+    grid: grid for var
+    mat: matrix for the finite-differencing operator. if mat=False the stencil is used
+    axis: axis of var along grid"""
+
+    dvar=_d1_o4(var,grid[1]-grid[0],mat,axis)
+    edges=np.moveaxis(dvar,axis,0)
+    edges[[0,1,-2,-1]]=0.0
+    return dvar
+
+def fd_d1_o4_uneven(var,grid,mat=False,return_new_grid = False,axis=0):
+    """Centered finite difference, first derivative, 4th order.  Evenly spaced grid is created and var is interpolated onto this grid.  Derivative is interpolated back onto original grid.
+    var: quantity to be differentiated.
+    grid: grid for var
+    mat: matrix for the finite-differencing operator. if mat=False the stencil is used
+    axis: axis of var along grid"""
+
+    N = 2*len(grid)
+    grid0 = np.linspace(grid[0],grid[-1],N)
+    var0 = _spline(grid,var,axis)(grid0)
+
+    dvar0=_d1_o4(var0,grid0[1]-grid0[0],mat,axis)
+    dvar0=np.moveaxis(dvar0,axis,0)
+    dvar0[[0,1,-2,-1]]=0.0
+
+    if return_new_grid:
+        return grid0,np.moveaxis(dvar0,0,axis)
+    else:
+        dvar = np.zeros((len(grid),)+dvar0.shape[1:])
+        dvar[2:-2] = _spline(grid0[2:-2],dvar0[2:-2],0)(grid[2:-2])
+        return np.moveaxis(dvar,0,axis)
+
+def fd_d1_o4_smoothend(var,grid,mat=False,axis=0):
+    """Centered finite difference, first derivative, 4th order using extrapolation to get boundary points
+    var: quantity to be differentiated.
+    grid: grid for var
+    mat: matrix for the finite-differencing operator. if mat=False the stencil is used
+    axis: axis of var along grid"""
+
+    dx = grid[1]-grid[0]
+    grid0 = np.linspace(grid[0]-2*dx,grid[-1]+2*dx,len(grid)+4)
+    var0 = _spline(grid,var,axis)(grid0)
+
+    dvar0=_d1_o4(var0,grid0[1]-grid0[0],mat,axis)
+    dvar_out=np.moveaxis(np.moveaxis(dvar0,axis,0)[2:-2],0,axis)
+
+    return dvar_out
+
+
+def invert_fd_d1_o4(var,grid,mat=False,axis=0):
+    """Invert cenntered finite difference, first derivative, 4th order.
+    var: quantity to be integrated.
+    grid: grid for var
+    mat: matrix for the finite-differencing operator. if mat=False the banded system is solved
+    axis: axis of var along grid
+    note--the operator is singular for an odd number of points"""
+
+    var=np.moveaxis(np.asarray(var),axis,0)
+    flat=var.reshape(var.shape[0],-1)
+    if mat is None or mat is False:
+        prefactor=1.0/(12.0*(grid[1]-grid[0]))
+        # diagonal ordered form, row u - j holds the diagonal with offset j
+        banded=np.zeros((5,var.shape[0]))
+        for offset,coeff in zip(FD_D1_O4_OFFSETS,FD_D1_O4_COEFFS):
+            if offset > 0:
+                banded[2-offset,offset:]=prefactor*coeff
+            else:
+                banded[2-offset,:offset]=prefactor*coeff
+        ivar=solve_banded((2,2),banded,flat)
+    else:
+        ivar=np.linalg.solve(mat.toarray() if sparse.issparse(mat) else mat,flat)
+    return np.moveaxis(ivar.reshape(var.shape),0,axis)
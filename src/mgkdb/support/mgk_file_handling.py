@@ -18,6 +18,8 @@ reading and writing to database containing:
 """
 
 import sys
+import copy
+import multiprocessing
 import numpy as np
 from bson.objectid import ObjectId
 import os
@@ -32,7 +34,13 @@ from bson.binary import Binary
 from .pyro_gk import create_gk_dict_with_pyro
 from .ParIO import Parameters
 from .diag_plot import diag_plot
-from .mgk_post_processing import get_parsed_params, get_suffixes, get_diag_from_run
+from .mgk_post_processing import get_parsed_params, get_suffixes, get_diag_from_run, get_time_window, \
+    get_nrg_flux_stats, get_continuation_chains, NRG_FLUX_COLUMNS
+from .data.nrg_reader import parse_nrg
+from .data.scan_reader import read_scanlog, scan_coord, suffix_to_run
+
+# runs of a scan inserted into the database with one insert_many, see upload_scan
+SCAN_INSERT_BATCH = 200
 
 #=======================================================
 
@@ -47,6 +55,9 @@ class Global_vars():
         self.Docs_ex = [] 
         self.update_docs_keys()
         self.troubled_runs = [] # a global list to collection runs where exception happens
+        #diagnostics time window, see get_diag_with_user_input
+        self.saturation = None   # saturation detector parameters, False to use the whole nrg time range
+        self.time_windows = {}   # per suffix: [t_start, t_end], detector parameters or False
 
     def set_vars(self, sim_type):
         if sim_type=="GENE":
@@ -299,19 +310,60 @@ def get_time_for_diag(run_suffix):
     
     return tspan
 
-def get_diag_with_user_input(out_dir, suffix,  manual_time_flag):
+def get_diag_with_user_input(out_dir, suffix,  manual_time_flag, global_vars=None):
+    '''
+    Run the GENE diagnostics of a suffix, returns Diag_dict, manual_time_flag and
+    the time window used (see get_time_window).
+    Without manual input, the window given for the suffix in the config file is used
+    if any (global_vars.time_windows), else the saturated phase of nonlinear runs
+    is detected with the parameters in global_vars.saturation.
+    For a continuation chain (list of suffixes) the window is given for its first suffix.
+    '''
+    tspan = None
+    saturation = None
+    head = suffix if isinstance(suffix, str) else suffix[0]
+    if global_vars is not None:
+        saturation = global_vars.saturation
+        override = global_vars.time_windows.get(head)
+        if isinstance(override, dict):
+            saturation = {**(saturation or {}), **override}
+        elif override is False:
+            saturation = False
+        elif override is not None:
+            tspan = [float(t) for t in override]
 
     if manual_time_flag:
-        tspan = get_time_for_diag(suffix)
-        if tspan == -1:
+        user_tspan = get_time_for_diag(head)
+        if user_tspan == -1:
             manual_time_flag = False
-            Diag_dict = get_diag_from_run(out_dir, suffix, None)
-        else:
-            Diag_dict = get_diag_from_run(out_dir, suffix, tspan) 
-    else:
-        Diag_dict = get_diag_from_run(out_dir, suffix, None)
+        elif user_tspan is not None:
+            tspan = user_tspan
+
+    t_start, t_end, time_window = get_time_window(out_dir, suffix, tspan, saturation)
+    Diag_dict = get_diag_from_run(out_dir, suffix, [t_start, t_end])
         
-    return Diag_dict, manual_time_flag
+    return Diag_dict, manual_time_flag, time_window
+
+def f_add_nrg_flux_stats(Diag_dict, out_dir, suffix, time_window):
+    '''
+    Store the nrg flux statistics of a nonlinear GENE run over the diagnostics time window
+    as plain scalars in Diag_dict (not in gridfs) so that they can be queried directly, e.g.
+    {'Diagnostics.NrgFluxStats': {'$elemMatch': {'species': 'i', 'Q_es': {'$gt': 10}}}}
+    '''
+    try:
+        Diag_dict['NrgFluxStats'] = get_nrg_flux_stats(out_dir, suffix, time_window['t_start'], time_window['t_end'])
+    except Exception as e:
+        print(f"Could not compute nrg flux statistics for suffix {suffix}: {e}")
+
+def f_create_flux_stats_index(runs_coll):
+    '''
+    Index the time averaged nrg fluxes of each species, see f_add_nrg_flux_stats
+    '''
+    try:
+        for flux in NRG_FLUX_COLUMNS:
+            runs_coll.create_index([('Diagnostics.NrgFluxStats.species', 1), ('Diagnostics.NrgFluxStats.' + flux, 1)])
+    except Exception as e:
+        print(f"Could not create the nrg flux statistics index: {e}")
 
 def get_data(key, *args):
     '''
@@ -355,23 +407,12 @@ def get_data_from_nrg(db, filepath):
     fs = gridfs.GridFS(db)
     if fs.exists({"filepath": filepath}):
         file = fs.find_one({"filepath": filepath}) # assuming only one
-        contents = file.read().decode('utf8').split('\n')
         header = []
-        data = []
-        time = []
-        count = 0
-        for line in contents[:-1]: # last line is ''
-            if count % 2 == 0:
-#               print(count)
-               time.append(float(line))
-            else:
-                d_str = line.split()
-                if d_str:
-                    data.append([float(num) for num in d_str])
-            count += 1
-        
-#        data = np.array(data)
-        return {'_header_': header, '_time_': np.array(time), '_data_': np.array(data)}
+        time, data = parse_nrg(file.read())
+        # single species keeps the former (ntime, ncols) layout
+        if data.shape[1] == 1:
+            data = data[:, 0, :]
+        return {'_header_': header, '_time_': time, '_data_': data}
     
     else:
         print("No entry in current database matches the specified filepath.")
@@ -459,7 +500,7 @@ def get_file_list(out_dir, begin):
     files_list = []
     
     #unwanted filetype suffixes for general list
-    bad_ext = ('.ps','.png', '.jpg', '.dat~', '.h5')
+    bad_ext = ('.ps','.png', '.jpg', '.dat~', '.h5', '.mgkidx', '.mgkgeom.npz')
     
 #    print('Searching in {} with key {}'.format(out_dir, begin))
     #scan files in GENE output directory, ignoring files in '/in_par', and return list
@@ -668,13 +709,13 @@ def _loadNPArrays(db, document):
     return document
 
 def query_plot(db, collection, query, projection = {'Metadata':1, 'Diagnostics':1}):
-    data_list = load(db, collection, query, projection)
+    data_list = load(db, collection, query, projection) or []
     print('{} records found.'.format(len(data_list)))
     
     data_to_plot = [diag_plot(da) for da in data_list]
     
     for i in range(len(data_to_plot)):
-         data_to_plot.plot_all()    
+         data_to_plot[i].plot_all()    
     
     
 def isLinear(folder_name, sim_type):
@@ -901,6 +942,20 @@ def download_file_by_id(db, _id, destination, fname=None, session = None):
         fs.download_to_stream(_id, f)
     print("Download completed!")
     
+def _download_continuation_files(db, record, path):
+    '''
+    Download the files of the continuation runs of a record (see upload_runs) to path,
+    their object ids are replaced by strings for the json summary
+    '''
+    fs = gridfs.GridFSBucket(db)
+    for seg in record.get('ContinuationFiles', []):
+        for key, val in seg['Files'].items():
+            if val is not None:
+                filename = db.fs.files.find_one(val)['filename']
+                with open(os.path.join(path, filename),'wb+') as f:
+                    fs.download_to_stream(val, f, session=None)
+            seg['Files'][key] = str(val)
+
 def download_dir_by_name(db, runs_coll, dir_name, destination):  
     '''
     db: database name
@@ -958,6 +1013,7 @@ def download_dir_by_name(db, runs_coll, dir_name, destination):
                 
         if 'generr' in record['Files'].keys():  ## Fix for when 'generr' doesn't exist 
             record['Files']['geneerr'] = str(record['Files']['geneerr'])
+        _download_continuation_files(db, record, path)
         
         '''
         Deal with diagnostic data
@@ -979,7 +1035,8 @@ def download_dir_by_name(db, runs_coll, dir_name, destination):
                 
         record['_id'] = str(record['_id'])
         with open(os.path.join(path, 'mgkdb_summary_for_run'+record['Metadata']['DBtag']['run_suffix']+'.json'), 'w') as f:
-            json.dump(record, f)
+            # default=str for the other object ids, e.g. Metadata.DBtag.scan_id
+            json.dump(record, f, default=str)
            
     print ("Successfully downloaded to the directory %s " % path)
 
@@ -1018,6 +1075,7 @@ def download_runs_by_id(db, runs_coll, _id, destination):
 #                    fs.download_to_stream_by_name(filename, f, revision=-1, session=None)
                 fs.download_to_stream(val, f, session=None)
             record['Files'][key] = str(val)
+    _download_continuation_files(db, record, path)
             
     '''
     Deal with diagnostic data
@@ -1039,13 +1097,30 @@ def download_runs_by_id(db, runs_coll, _id, destination):
     record['_id'] = str(_id)
 
     with open(os.path.join(path, 'mgkdb_summary_for_run'+record['Metadata']['DBtag']['run_suffix']+'.json'), 'w') as f:
-        json.dump(record, f)
+        # default=str for the other object ids, e.g. Metadata.DBtag.scan_id
+        json.dump(record, f, default=str)
     print("Successfully downloaded files in the collection {} to directory {}".format( record['_id'],path) )   
     
-def update_mongo(db, metadata, out_dir, runs_coll, linear, suffixes=None):
+def _gridfs_delete_unshared(fs, runs_coll, oid, key, out_dir, run_ids):
+    '''
+    fs.delete the file oid (Files.key of runs in out_dir), unless runs other than run_ids
+    still refer to it, e.g. a shared file of the runs not updated. Returns True if deleted.
+    '''
+    query = {"Metadata.DBtag.run_collection_name": out_dir, "_id": {"$nin": run_ids},
+             "$or": [{'Files.' + key: oid}, {'ContinuationFiles.Files.' + key: oid}]}
+    if runs_coll.find_one(query, {'_id': 1}) is not None:
+        return False
+    fs.delete(oid)
+    return True
+
+def update_mongo(db, metadata, out_dir, runs_coll, linear, suffixes=None, global_vars=None):
 
     '''
     only update file related entries, no comparison made before update
+    global_vars: the diagnostics time windows (saturation, time_windows) are taken
+                 from it as in upload_runs
+    The suffix of a continuation run updates the run it was uploaded with (see upload_runs),
+    the diagnostics of that run are redone on the whole chain.
     '''
     
     sim_type = metadata['CodeTag']['sim_type']
@@ -1060,6 +1135,9 @@ def update_mongo(db, metadata, out_dir, runs_coll, linear, suffixes=None):
         keys_to_update = input('Please type key names for each file you typed, separated by comma.\n').split(',')
 
         updated = []
+        run_ids = [run['_id'] for run in runs_coll.find({"Metadata.DBtag.run_collection_name": out_dir,
+                                                         "Metadata.DBtag.run_suffix": {"$in": suffixes}},
+                                                        {'_id': 1})]
         print('Uploading files .......')
         # update the storage chunk
         for doc, field in zip(files_to_update, keys_to_update):
@@ -1067,12 +1145,14 @@ def update_mongo(db, metadata, out_dir, runs_coll, linear, suffixes=None):
             file = os.path.join(out_dir, doc)
             assert os.path.exists(file), "File %s not found"%(file)
             
-            # delete ALL history
+            # delete ALL history, except files still used by runs not updated
             grid_out = fs.find({'filepath': file})
             for grid in grid_out:
                 print('File with path tag:\n{}\n'.format(grid.filepath) )
-                fs.delete(grid._id)
-                print('deleted!')
+                if _gridfs_delete_unshared(fs, runs_coll, grid._id, field, out_dir, run_ids):
+                    print('deleted!')
+                else:
+                    print('kept, still used by other runs.')
 
             with open(file, 'rb') as f:
                 _id = fs.put(f, encoding='UTF-8', filepath=file, filename=os.path.basename(file))
@@ -1106,43 +1186,65 @@ def update_mongo(db, metadata, out_dir, runs_coll, linear, suffixes=None):
         
         for doc in files_to_update:
             manual_time_flag = True
+            diag_updated = []
             for suffix in run_suffixes:
-                if affect_QoI:
-                    input_fname = f_get_input_fname(out_dir, suffix, sim_type)
+                # the suffix of a run, or of a continuation run uploaded with it, see upload_runs
+                run = runs_coll.find_one({"Metadata.DBtag.run_collection_name": out_dir,
+                                          "$or": [{"Metadata.DBtag.run_suffix": suffix},
+                                                  {"Metadata.DBtag.continuation": suffix}]})
+                if run is None:
+                    print(f'No run with suffix {suffix} in {out_dir} in the database. Skipping suffix')
+                    continue
+                chain = run['Metadata']['DBtag'].get('continuation') or [run['Metadata']['DBtag']['run_suffix']]
+                # a single suffix as before, the whole chain for the diagnostics of continuation runs
+                chain_suffixes = chain if len(chain) > 1 else chain[0]
+                run_query = {'_id': run['_id']}
+
+                if affect_QoI and run['_id'] not in diag_updated:
+                    input_fname = f_get_input_fname(out_dir, chain[-1], sim_type)
                     GK_dict, quasi_linear = create_gk_dict_with_pyro(input_fname, sim_type)   
 
+                    updates = {'gyrokineticsIMAS': GK_dict}
                     if sim_type in ['CGYRO','TGLF','GS2','GX']:
                         Diag_dict = {}
                     elif sim_type=='GENE': 
-                        Diag_dict, manual_time_flag = get_diag_with_user_input(out_dir, suffix, manual_time_flag)
+                        Diag_dict, manual_time_flag, time_window = get_diag_with_user_input(out_dir, chain_suffixes, manual_time_flag, global_vars)
+                        updates['Metadata.DiagTag'] = {'time_window': time_window}
 
-                    run = runs_coll.find_one({ "Metadata.DBtag.run_collection_name": out_dir, "Metadata.DBtag.run_suffix": suffix})
                     for key, val in run['Diagnostics'].items():
-                        if val != 'None':
+                        if isinstance(val, ObjectId):
                             # print((key, val))
                             fs.delete(val)
                             # print('deleted!')
 
                     for key, val in Diag_dict.items():
                         Diag_dict[key] = gridfs_put_npArray(db, Diag_dict[key], out_dir, key, sim_type)
+                    if sim_type=='GENE' and not linear:
+                        f_add_nrg_flux_stats(Diag_dict, out_dir, chain_suffixes, time_window)
 
-                    runs_coll.update_one({ "Metadata.DBtag.run_collection_name": out_dir, "Metadata.DBtag.run_suffix": suffix },
-                            { "$set": {'gyrokineticsIMAS': GK_dict, 'Diagnostics':Diag_dict}}
-                                 )
+                    runs_coll.update_one(run_query, { "$set": {**updates, 'Diagnostics':Diag_dict}})
+                    diag_updated.append(run['_id'])
 
                 # Use f_get_full_fname to handle both GENE and TGLF formats correctly
                 file = f_get_full_fname(sim_type, out_dir, suffix, doc)
                 grid_out = fs.find({'filepath': file})
                 for grid in grid_out:
                     print('File with path tag:\n{}\n'.format(grid.filepath) )
-                    fs.delete(grid._id)
-                    print('deleted!')
+                    if _gridfs_delete_unshared(fs, runs_coll, grid._id, doc, out_dir, [run['_id']]):
+                        print('deleted!')
+                    else:
+                        print('kept, still used by other runs.')
                 
                 with open(file, 'rb') as f:
                     _id = fs.put(f, encoding='UTF-8', filepath=file, filename=os.path.basename(file))
 
-                runs_coll.update_one({ "Metadata.DBtag.run_collection_name": out_dir, "Metadata.DBtag.run_suffix": suffix }, 
-                                 { "$set": {'Files.'+ doc: _id, "Metadata.DBtag.last_updated": strftime("%y%m%d-%H%M%S")} }
+                if suffix == chain[0]:
+                    file_field = 'Files.' + doc
+                else:
+                    segments = [seg['suffix'] for seg in run['ContinuationFiles']]
+                    file_field = 'ContinuationFiles.{}.Files.{}'.format(segments.index(suffix), doc)
+                runs_coll.update_one(run_query, 
+                                 { "$set": {file_field: _id, "Metadata.DBtag.last_updated": strftime("%y%m%d-%H%M%S")} }
                                  )
         print("Update complete")
     
@@ -1175,13 +1277,24 @@ def remove_from_mongo(out_dir, db, runs_coll):
 #                    print("Deleted!")
                 
         for key, val in run['Diagnostics'].items():
-            if val != 'None':
+            if isinstance(val, ObjectId):
                 print((key, val))
                 fs.delete(val)
                 print('deleted!')
+
+        # files of continuation runs, see upload_runs
+        for seg in run.get('ContinuationFiles', []):
+            for key, val in seg['Files'].items():
+                if val is not None:
+                    print((seg['suffix'] + key, val))
+                    fs.delete(val)
+                    print('deleted!')
                 
 #        delete the header file
         runs_coll.delete_one(run)
+
+    # scan grids of upload_scan
+    db.Scans.delete_many({ "run_collection_name": out_dir })
         
 def f_update_global_var(global_vars, out_dir, suffix, sim_type, is_linear, large_files, count):
     '''
@@ -1318,10 +1431,15 @@ def f_get_input_fname(out_dir, suffix, sim_type):
     return fname_dict[sim_type]
 
 def upload_runs(db, metadata, out_dir, is_linear=True, suffixes=None, run_shared=None,
-                large_files=False, verbose=True, manual_time_flag=True, global_vars=None):
+                large_files=False, verbose=True, manual_time_flag=True, global_vars=None, continuation=False):
     """
     Uploads simulation run data to the database, handling both linear and nonlinear runs.
 
+    With continuation, GENE continuation runs (see get_continuation_chains) are uploaded as
+    one run: the diagnostics are done on the whole chain, the files of the first suffix are
+    in 'Files' and those of the following ones in 'ContinuationFiles', the suffixes of the
+    chain are listed in Metadata.DBtag.continuation.
+
     Parameters:
     - db: Database connection object.
     - metadata: Dictionary containing metadata for the run.
@@ -1333,6 +1451,7 @@ def upload_runs(db, metadata, out_dir, is_linear=True, suffixes=None, run_shared
     - verbose: Boolean to print detailed output. Default: True.
     - manual_time_flag: Boolean to handle user-specified time spans for diagnostics. Default: True.
     - global_vars: Object containing global variables for the upload process.
+    - continuation: Boolean to upload GENE continuation chains as one run. Default: False.
 
     Returns:
     None
@@ -1346,27 +1465,41 @@ def upload_runs(db, metadata, out_dir, is_linear=True, suffixes=None, run_shared
     if suffixes is None:
         suffixes = get_suffixes(out_dir, sim_type)
 
+    if sim_type == 'GENE' and continuation:
+        chains = get_continuation_chains(out_dir, suffixes)
+        for chain in chains:
+            if len(chain) > 1:
+                print(f'Suffixes {chain} form a chain of continuation runs, uploaded as one run.')
+    else:
+        chains = [[suffix] for suffix in suffixes]
+
     if isinstance(run_shared, list):
         shared_not_uploaded = [True for _ in run_shared]
     else:
         shared_not_uploaded = [False]
     shared_file_dict = {}
 
-    for count, suffix in enumerate(suffixes):
+    if sim_type == 'GENE' and not is_linear:
+        f_create_flux_stats_index(runs_coll)
+
+    for count, chain in enumerate(chains):
+        suffix = chain[0]
+        # a single suffix as before, the whole chain for the diagnostics of continuation runs
+        run_suffixes = chain if len(chain) > 1 else suffix
+        uploaded_ids = {}
         try:
             print('='*40)
             print(f'Working on files with suffix: {suffix} in folder {out_dir}.......')
 
             f_update_global_var(global_vars, out_dir, suffix, sim_type, is_linear, large_files, count)
 
-            uploaded_ids = {}
-
-            files_exist = f_check_required_files(global_vars, out_dir, suffix, sim_type)
-            assert files_exist, "Required files don't exist. Skipping folder"
+            for seg in chain:
+                files_exist = f_check_required_files(global_vars, out_dir, seg, sim_type)
+                assert files_exist, "Required files don't exist. Skipping folder"
 
-            # Compute gyrokinetics IMAS using pyrokinetics package
+            # Compute gyrokinetics IMAS using pyrokinetics package, on the latest state of a chain
             print("Computing gyrokinetics IMAS using pyrokinetics")
-            input_fname = f_get_input_fname(out_dir, suffix, sim_type)
+            input_fname = f_get_input_fname(out_dir, chain[-1], sim_type)
             GK_dict, quasi_linear = create_gk_dict_with_pyro(input_fname, sim_type)
 
             # Upload files to DB
@@ -1385,6 +1518,15 @@ def upload_runs(db, metadata, out_dir, is_linear=True, suffixes=None, run_shared
                 print('Error occured during input file upload')
                 raise ValueError(err_msg)
 
+            continuation_files = []
+            for seg in chain[1:]:
+                f_dict, _, err_occured, err_msg = upload_file_chunks(db, out_dir, sim_type, seg, None, global_vars)
+                continuation_files.append({'suffix': seg, 'Files': {k: v['oid'] for k, v in f_dict.items()}})
+                uploaded_ids.update({seg + k: v['oid'] for k, v in f_dict.items() if v['oid'] is not None})
+                if err_occured:
+                    print('Error occured during input file upload')
+                    raise ValueError(err_msg)
+
             print('='*60)
             # Metadata dictionary
             time_upload = strftime("%y%m%d-%H%M%S")
@@ -1393,6 +1535,9 @@ def upload_runs(db, metadata, out_dir, is_linear=True, suffixes=None, run_shared
             metadata['DBtag']['run_suffix'] = '' + suffix
             metadata['DBtag']['time_uploaded'] = time_upload
             metadata['DBtag']['last_updated'] = time_upload
+            metadata['DBtag'].pop('continuation', None)
+            if len(chain) > 1:
+                metadata['DBtag']['continuation'] = chain
             metadata['CodeTag']['IsLinear'] = is_linear
             metadata['CodeTag']['quasi_linear'] = quasi_linear
             metadata['CodeTag']['Has1DFluxes'] = GK_dict['non_linear']['fluxes_1d']['particles_phi_potential'] != 0
@@ -1405,12 +1550,13 @@ def upload_runs(db, metadata, out_dir, is_linear=True, suffixes=None, run_shared
             elif sim_type == 'GENE':
                 print('='*60)
                 # print('\n Working on diagnostics with user specified tspan .....\n')
-                Diag_dict, manual_time_flag = get_diag_with_user_input(out_dir, suffix, manual_time_flag)
+                Diag_dict, manual_time_flag, time_window = get_diag_with_user_input(out_dir, run_suffixes, manual_time_flag, global_vars)
+                meta_dict['DiagTag'] = {'time_window': time_window}
                 print('='*60)
 
                 if is_linear:
                     # Add omega info to Diag_dict for linear runs
-                    omega_val = get_omega(out_dir, suffix)
+                    omega_val = get_omega(out_dir, chain[-1])
                     Diag_dict['omega'] = {
                         'ky': omega_val[0],
                         'gamma': omega_val[1],
@@ -1422,6 +1568,8 @@ def upload_runs(db, metadata, out_dir, is_linear=True, suffixes=None, run_shared
                     Diag_dict[key] = oid ## Rewrite array with oid of stored file
                     if oid is not None: 
                         uploaded_ids[key] = oid
+                if not is_linear:
+                    f_add_nrg_flux_stats(Diag_dict, out_dir, run_suffixes, time_window)
 
             # Combine dictionaries and upload
             run_data = {
@@ -1430,6 +1578,8 @@ def upload_runs(db, metadata, out_dir, is_linear=True, suffixes=None, run_shared
                 'gyrokineticsIMAS': GK_dict,
                 'Diagnostics': Diag_dict
             }
+            if continuation_files:
+                run_data['ContinuationFiles'] = continuation_files
             
             main_record_oid = runs_coll.insert_one(run_data).inserted_id
 
@@ -1456,8 +1606,249 @@ def upload_runs(db, metadata, out_dir, is_linear=True, suffixes=None, run_shared
         global_vars.reset_docs_keys(sim_type)
 
 
+def isScan(out_dir, sim_type):
+    '''
+    Check if out_dir holds a GENE scan with a scan.log, see upload_scan
+    '''
+    return sim_type == 'GENE' and os.path.isfile(os.path.join(out_dir, 'scan.log'))
+
+def _prepare_scan_run(args):
+    '''
+    Everything of one run of a scan which does not need the database: files (with their
+    sizes), gyrokinetics IMAS and diagnostics. Done in the worker processes of upload_scan.
+    Returns a dictionary, or the error message if the run cannot be uploaded.
+    '''
+    out_dir, suffix, sim_type, is_linear, large_files, global_vars, omega_val = args
+    try:
+        f_update_global_var(global_vars, out_dir, suffix, sim_type, is_linear, large_files, 0)
+        if not f_check_required_files(global_vars, out_dir, suffix, sim_type):
+            return "Required files don't exist. Skipping suffix"
+
+        files = {}
+        for doc, key in zip(global_vars.all_file_docs, global_vars.all_file_keys):
+            file = f_get_full_fname(sim_type, out_dir, suffix, doc)
+            if os.path.isfile(file):
+                files[key] = (file, os.path.getsize(file))
+            else:
+                print(f'{file} not found in {out_dir}')
+
+        GK_dict, quasi_linear = create_gk_dict_with_pyro(f_get_input_fname(out_dir, suffix, sim_type), sim_type)
+        Diag_dict, _, time_window = get_diag_with_user_input(out_dir, suffix, False, global_vars)
+        if is_linear:
+            # growth rate and frequency from scan.log, the omega file only if the run is not in it
+            if omega_val is None or np.isnan(omega_val[1]):
+                omega_val = get_omega(out_dir, suffix)
+            Diag_dict['omega'] = {'ky': omega_val[0], 'gamma': omega_val[1], 'omega': omega_val[2]}
+
+        return {'files': files, 'GK_dict': GK_dict, 'quasi_linear': quasi_linear,
+                'Diag_dict': Diag_dict, 'time_window': time_window}
+    except Exception as e:
+        return str(e)
+    finally:
+        global_vars.reset_docs_keys(sim_type)
+
+def _put_file_once(db, filepath, size, sim_type, uploaded_files):
+    '''
+    gridfs_put for files not uploaded yet (by path), returns (oid, True if new).
+    Only files without a suffix (shared by the runs) have the same path in several runs,
+    so the gridfs filename and filepath of a file are always the ones of the run.
+    '''
+    MAX_FILE_SIZE = 10 * 1024 * 1024  # 10 MB limit
+
+    if filepath in uploaded_files:
+        return uploaded_files[filepath], False
+    if size > MAX_FILE_SIZE:
+        raise ValueError(
+            "Size of the file %s is %s MB and it exceeds size limit of %s MB" %
+            (filepath, size / (1024 * 1024), MAX_FILE_SIZE / (1024 * 1024))
+        )
+    uploaded_files[filepath] = gridfs_put(db, filepath, sim_type)
+    return uploaded_files[filepath], True
+
+def _insert_scan_batch(fs, runs_coll, run_docs, suffixes, new_ids, uploaded_files, global_vars, out_dir):
+    '''
+    insert_many of the prepared runs of a scan, returns the number of runs inserted.
+    new_ids: for every run, the files ((path, key, oid)) first uploaded for it and its
+             diagnostics oids, deleted if the run is not inserted.
+    '''
+    try:
+        runs_coll.insert_many(run_docs, ordered=False)
+        print(f'{len(run_docs)} runs of the scan in folder {out_dir} uploaded.')
+        failed = []
+    except Exception as e:
+        failed = [err['index'] for err in getattr(e, 'details', {}).get('writeErrors', [])] \
+                 if hasattr(e, 'details') else range(len(run_docs))
+        print(f'Error inserting runs of the scan in folder {out_dir}: {e}')
+        for i in failed:
+            global_vars.troubled_runs.append(out_dir + '##' + suffixes[i])
+            print(f'cleaning suffix {suffixes[i]} ......')
+            new_files, diag_ids = new_ids[i]
+            for file, key, _id in new_files:
+                # later runs of the scan may use the same file
+                if _gridfs_delete_unshared(fs, runs_coll, _id, key, out_dir, []):
+                    uploaded_files.pop(file, None)
+            for _id in diag_ids:
+                fs.delete(_id)
+    n_inserted = len(run_docs) - len(failed)
+    run_docs.clear()
+    suffixes.clear()
+    new_ids.clear()
+    return n_inserted
+
+def upload_scan(db, metadata, out_dir, is_linear=True, suffixes=None, run_shared=None,
+                large_files=False, verbose=False, global_vars=None, workers=1):
+    """
+    Uploads the runs of a GENE scan as one batch.
+
+    scan.log is read once, the scan grid with the growth rates and frequencies of all
+    runs is stored as one document in the Scans collection, linked from every run
+    (Metadata.DBtag.scan_id, with the position of the run in Metadata.DBtag.scan_coord).
+    Growth rates of linear runs are taken from scan.log instead of the omega files.
+    Files without a suffix (run_shared, or the same file in several runs) are stored
+    once and shared by the runs. The runs are prepared (files, gyrokinetics IMAS,
+    diagnostics) by workers processes and inserted with insert_many.
+
+    Parameters:
+    - As upload_runs, diagnostics time windows are never asked for.
+    - workers: Number of processes preparing the runs. Default: 1.
+
+    Returns:
+    None
+    """
+    sim_type = metadata['CodeTag']['sim_type']
+    runs_coll = db.LinearRuns if is_linear else db.NonlinRuns
+
+    if suffixes is None:
+        suffixes = get_suffixes(out_dir, sim_type)
+
+    scan = read_scanlog(out_dir)
+    n_scan = int(np.prod(scan.dims))
+    print(f'Scan over {scan.names} with dimensions {scan.dims}, {len(scan.runs)} runs in scan.log')
+
+    time_upload = strftime("%y%m%d-%H%M%S")
+    scan_oid = db.Scans.insert_one({
+        'run_collection_name': out_dir,
+        'sim_type': sim_type,
+        'IsLinear': is_linear,
+        'time_uploaded': time_upload,
+        'names': scan.names,
+        'dims': scan.dims,
+        'runs': scan.runs,
+        'grid': _npArray2Binary(scan.grid),
+        'growthrates': _npArray2Binary(scan.growthrates),
+        'frequencies': _npArray2Binary(scan.frequencies)
+    }).inserted_id
+
+    if sim_type == 'GENE' and not is_linear:
+        f_create_flux_stats_index(runs_coll)
+
+    tasks = []
+    coords = []
+    for suffix in suffixes:
+        run = suffix_to_run(suffix)
+        coord = scan_coord(run, scan.dims) if run is not None and 0 < run <= n_scan else None
+        omega_val = None
+        if coord is not None:
+            par = Parameters()
+            par.Read_Pars(os.path.join(out_dir, 'parameters' + suffix))
+            omega_val = [par.pardict.get('kymin', np.nan), scan.growthrates[coord][0], scan.frequencies[coord][0]]
+        coords.append(None if coord is None else [int(c) for c in coord])
+        tasks.append((out_dir, suffix, sim_type, is_linear, large_files, global_vars, omega_val))
+
+    fs = gridfs.GridFS(db)
+    uploaded_files = {} # path: oid of the files uploaded for the scan
+    shared_file_dict = {}
+    if isinstance(run_shared, list):
+        for sh in run_shared:
+            file = os.path.join(out_dir, sh)
+            if os.path.isfile(file):
+                shared_file_dict[sh.replace('.', '_')], _ = _put_file_once(
+                    db, file, os.path.getsize(file), sim_type, uploaded_files)
+            else:
+                print(f'{file} not found in {out_dir}')
+
+    run_docs, run_suffixes, run_new_ids = [], [], []
+    n_inserted = 0
+    pool = multiprocessing.Pool(workers) if workers > 1 else None
+    try:
+        prepared = pool.imap(_prepare_scan_run, tasks) if pool else map(_prepare_scan_run, tasks)
+        for suffix, coord, run in zip(suffixes, coords, prepared):
+            print('='*40)
+            print(f'Working on files with suffix: {suffix} in folder {out_dir}.......')
+            new_files, new_ids = [], []  # (path, key, oid) of the files, oids of the diagnostics
+            try:
+                if isinstance(run, str):
+                    raise ValueError(run)
+                files_dict = {}
+                for key, (file, size) in run['files'].items():
+                    files_dict[key], is_new = _put_file_once(db, file, size, sim_type, uploaded_files)
+                    if is_new:
+                        new_files.append((file, key, files_dict[key]))
+                files_dict = {**files_dict, **shared_file_dict}
+
+                Diag_dict = run['Diag_dict']
+                for key, val in Diag_dict.items():
+                    oid = gridfs_put_npArray(db, val, out_dir, key, sim_type)
+                    Diag_dict[key] = oid
+                    if oid is not None:
+                        new_ids.append(oid)
+                if sim_type == 'GENE' and not is_linear:
+                    f_add_nrg_flux_stats(Diag_dict, out_dir, suffix, run['time_window'])
+
+                meta_dict = copy.deepcopy(metadata)
+                meta_dict['DBtag']['run_collection_name'] = out_dir
+                meta_dict['DBtag']['run_suffix'] = '' + suffix
+                meta_dict['DBtag']['time_uploaded'] = time_upload
+                meta_dict['DBtag']['last_updated'] = time_upload
+                meta_dict['DBtag']['scan_id'] = scan_oid
+                meta_dict['DBtag']['scan_coord'] = coord
+                meta_dict['CodeTag']['IsLinear'] = is_linear
+                meta_dict['CodeTag']['quasi_linear'] = run['quasi_linear']
+                meta_dict['CodeTag']['Has1DFluxes'] = run['GK_dict']['non_linear']['fluxes_1d']['particles_phi_potential'] != 0
+                meta_dict['DiagTag'] = {'time_window': run['time_window']}
+
+                run_docs.append({
+                    'Metadata': meta_dict,
+                    'Files': files_dict,
+                    'gyrokineticsIMAS': run['GK_dict'],
+                    'Diagnostics': Diag_dict
+                })
+                run_suffixes.append(suffix)
+                run_new_ids.append((new_files, new_ids))
+                if verbose:
+                    print(run_docs[-1])
+            except Exception as e1:
+                print(e1)
+                print(f"Skip suffix {suffix} in \n {out_dir} \n")
+                global_vars.troubled_runs.append(out_dir + '##' + suffix)
+                print('cleaning ......')
+                # only files first uploaded for this run, no other run refers to them yet
+                for file, key, _id in new_files:
+                    uploaded_files.pop(file)
+                    fs.delete(_id)
+                for _id in new_ids:
+                    fs.delete(_id)
+                continue
+
+            if len(run_docs) >= SCAN_INSERT_BATCH:
+                n_inserted += _insert_scan_batch(fs, runs_coll, run_docs, run_suffixes, run_new_ids,
+                                                 uploaded_files, global_vars, out_dir)
+        if run_docs:
+            n_inserted += _insert_scan_batch(fs, runs_coll, run_docs, run_suffixes, run_new_ids,
+                                             uploaded_files, global_vars, out_dir)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+        if n_inserted == 0:
+            print(f'No run of the scan in folder {out_dir} uploaded, removing the scan grid and shared files.')
+            db.Scans.delete_one({'_id': scan_oid})
+            for _id in shared_file_dict.values():
+                fs.delete(_id)
+
 def upload_to_mongo(db, linear, metadata, out_dir, suffixes=None, run_shared=None,
-                    large_files=False, verbose=False, manual_time_flag=False, global_vars=None, no_prompts=False, reupload_if_exists=False):
+                    large_files=False, verbose=False, manual_time_flag=False, global_vars=None, no_prompts=False, reupload_if_exists=False,
+                    scan=False, workers=1, continuation=False):
     """
     Wrapper function to upload simulation runs to MongoDB, handling both linear and nonlinear runs.
 
@@ -1474,6 +1865,9 @@ def upload_to_mongo(db, linear, metadata, out_dir, suffixes=None, run_shared=Non
     - global_vars: Object containing global variables for the upload process.
     - no_prompts: Autoupload with no prompts. Default = False
     - reupload_if_exists: Delete and reupload if existing folder name is present in DB. Default: False
+    - scan: Upload a GENE scan with a scan.log as one batch, see upload_scan. Default: False
+    - workers: Number of processes preparing the runs of a scan. Default: 1
+    - continuation: Upload GENE continuation chains as one run, see upload_runs. Default: False
     Returns:
     None
     """
@@ -1484,6 +1878,10 @@ def upload_to_mongo(db, linear, metadata, out_dir, suffixes=None, run_shared=Non
     run_type = 'linear' if linear else 'nonlinear'
     print(f'Upload {run_type} runs ******')
 
+    scan_upload = scan and isScan(out_dir, metadata['CodeTag']['sim_type'])
+    if scan and not scan_upload:
+        print(f'No scan.log in {out_dir}, uploading the suffixes one by one.')
+
     # Check if folder is already uploaded
     if isUploaded(out_dir, runs_coll):
         print(f'Folder tag:\n {out_dir} \n exists in database')
@@ -1497,13 +1895,23 @@ def upload_to_mongo(db, linear, metadata, out_dir, suffixes=None, run_shared=Non
             # Delete and reupload
             print("Deleting {out_dir} and reuploading")
             remove_from_mongo(out_dir, db, runs_coll)
-            upload_runs(db, metadata, out_dir, is_linear=linear, suffixes=suffixes, run_shared=run_shared,
-                        large_files=large_files, verbose=verbose, manual_time_flag=manual_time_flag, global_vars=global_vars)
+            if scan_upload:
+                upload_scan(db, metadata, out_dir, is_linear=linear, suffixes=suffixes, run_shared=run_shared,
+                            large_files=large_files, verbose=verbose, global_vars=global_vars, workers=workers)
+            else:
+                upload_runs(db, metadata, out_dir, is_linear=linear, suffixes=suffixes, run_shared=run_shared,
+                            large_files=large_files, verbose=verbose, manual_time_flag=manual_time_flag, global_vars=global_vars,
+                            continuation=continuation)
         elif update == '1':
-            update_mongo(db, metadata, out_dir, runs_coll, linear)
+            update_mongo(db, metadata, out_dir, runs_coll, linear, global_vars=global_vars)
         else:
             print(f'Run collection \'{out_dir}\' skipped.')
     else:
         print(f'Folder tag:\n{out_dir}\n not detected, creating new.\n')
-        upload_runs(db, metadata, out_dir, is_linear=linear, suffixes=suffixes, run_shared=run_shared,
-                    large_files=large_files, verbose=verbose, manual_time_flag=manual_time_flag, global_vars=global_vars)
+        if scan_upload:
+            upload_scan(db, metadata, out_dir, is_linear=linear, suffixes=suffixes, run_shared=run_shared,
+                        large_files=large_files, verbose=verbose, global_vars=global_vars, workers=workers)
+        else:
+            upload_runs(db, metadata, out_dir, is_linear=linear, suffixes=suffixes, run_shared=run_shared,
+                        large_files=large_files, verbose=verbose, manual_time_flag=manual_time_flag, global_vars=global_vars,
+                        continuation=continuation)
@@ -17,6 +17,7 @@ from sys import exit
 import os
 import glob
 import base64
+import multiprocessing
 
 from .fieldlib import fieldfile
 from .ParIO import Parameters
@@ -26,8 +27,11 @@ from .pydiag.utils import comm
 from .pydiag.data import datafiles
 
 from .pydiag.utils.gkdb import GKDB_linear, GKDB_nonlin
-from .putils.loader import Loader
+from .putils.loader import FusedLoader
 from .data.data import Data
+from .data.nrg_reader import read_nrg, read_nrg_chain, nrg_time_bounds
+from .putils.time_traces import find_saturated_window, mytrapz
+from .putils.errors import integrated_autocorrtime, effective_samples
 #from .putils.geom import Geometry
 from .putils.run import Run
 from .putils.simulation import Simulation
@@ -40,6 +44,26 @@ from .diagnostics.diag_amplitude_spectra import DiagAmplitudeSpectra
 from .diagnostics.diag_field_mom_snapshots import DiagFieldMomSnapshots
 #=======================================================
 
+# Q_es and Q_em in the nrg file, summed over species for the saturation detection
+NRG_HEAT_FLUX_COLUMNS = [6, 7]
+# parameters of find_saturated_window
+SATURATION_DEFAULTS = {'n_windows': 20, 'ref_fraction': 0.3, 'tolerance': 1.0, 'min_fraction': 0.2}
+# flux columns of the nrg file
+NRG_FLUX_COLUMNS = {'Gamma_es': 4, 'Gamma_em': 5, 'Q_es': 6, 'Q_em': 7, 'Pi_es': 8, 'Pi_em': 9}
+# namelists and parameters which may differ between a GENE run and its continuation
+CONTINUATION_IGNORED_NAMELISTS = ('info', 'in_out', 'parallelization')
+CONTINUATION_IGNORED_PARAMETERS = ('timelim', 'ntimesteps', 'simtimelim', 'dt_max', 'dt_vlasov',
+                                   'ev_coll', 'init_cond', 'perf_vec', 'nblocks', 'perf_tsteps')
+# largest gap between the end of a run and the start of its continuation, relative to the run length
+CONTINUATION_TIME_GAP = 0.01
+
+def _chain(suffix):
+    '''
+    Suffixes of a run, suffix is a single suffix or the list of suffixes of a
+    continuation chain (see get_continuation_chains)
+    '''
+    return [suffix] if isinstance(suffix, str) else list(suffix)
+
 def get_nspec(out_dir,suffix):
     #grab parameters dictionary from ParIO.py - Parameters()
     par = Parameters()
@@ -57,58 +81,50 @@ def get_nrg(out_dir, suffix):
     par.Read_Pars(os.path.join(out_dir, 'parameters' + suffix))
     pars = par.pardict 
     
-    #initializations
-    ncols=pars['nrgcols']
-    time=np.empty(0,dtype='float')  # confused about the use of 0
-    nrg0=np.empty((1,ncols))
-    nrg1=np.empty((0,ncols),dtype='float')
-    
-    #grab 'n_spec' from 'parameters'
-#    nspec = get_nspec(out_dir,suffix)
-    nspec = pars['n_spec']
-    
-    #separate initializations for different 'n_spec' values
-    if nspec<=2:
-        nrg2=np.empty((0,ncols),dtype='float')
-    if nspec<=3:
-        nrg2=np.empty((0,ncols),dtype='float')
-        nrg3=np.empty((0,ncols),dtype='float')
-    
-    
-    #open 'nrg' file
-    f=open(os.path.join(out_dir , 'nrg' + suffix),'r')
-    nrg_in=f.read()
-
-    #format 'nrg' file for reading
-    nrg_in_lines=nrg_in.split('\n')
-    for j in range(len(nrg_in_lines)):
-        if nrg_in_lines[j] and j % (nspec+1) == 0:
-            time=np.append(time,nrg_in_lines[j])
-        elif nrg_in_lines[j] and j % (nspec+1) == 1:
-            nline=nrg_in_lines[j].split()
-            for i in range(ncols):
-                nrg0[0,i]=nline[i]
-            nrg1=np.append(nrg1,nrg0,axis=0)
-        elif nspec>=2 and nrg_in_lines[j] and j % (nspec+1) ==2:
-            nline=nrg_in_lines[j].split()
-            for i in range(ncols):
-                nrg0[0,i]=nline[i]
-            nrg2=np.append(nrg2,nrg0,axis=0)
-        elif nspec==3 and nrg_in_lines[j] and j % (nspec+1) ==3:
-            nline=nrg_in_lines[j].split()
-            for i in range(ncols):
-                nrg0[0,i]=nline[i]
-            nrg3=np.append(nrg3,nrg0,axis=0)
-
-    #return 'time' and 'nrgx' arrays
-    if nspec==1:
-        return time,nrg1
-    elif nspec==2:
-        return time,nrg1,nrg2
-    else:
-        return time,nrg1,nrg2,nrg3
+    #returns 'time' and one (ntime, nrgcols) array per species
+    time, nrg = read_nrg(os.path.join(out_dir , 'nrg' + suffix), pars['n_spec'], pars['nrgcols'])
+    return (time,) + tuple(nrg[:, i_spec, :] for i_spec in range(nrg.shape[1]))
 
     
+def get_nrg_flux_stats(out_dir, suffix, t_start = None, t_end = None):
+    '''
+    Statistics of the nrg fluxes between t_start and t_end (whole file if not given).
+    Returns one dictionary of scalars per species, with for each flux in
+    NRG_FLUX_COLUMNS its time average (e.g. 'Q_es'), standard deviation ('Q_es_std'),
+    integrated autocorrelation time ('Q_es_tau') and effective number of
+    independent samples ('Q_es_neff').
+    '''
+    suffixes = _chain(suffix)
+    pars = get_parsed_params(os.path.join(out_dir, 'parameters' + suffixes[0]))
+    time, nrg = read_nrg_chain([os.path.join(out_dir , 'nrg' + s) for s in suffixes],
+                               pars['n_spec'], pars['nrgcols'])
+    inwindow = np.ones(time.size, dtype=bool)
+    if t_start is not None:
+        inwindow &= time >= t_start
+    if t_end is not None:
+        inwindow &= time <= t_end
+    time = time[inwindow]
+    if time.size == 0:
+        raise ValueError('No nrg data between {} and {} for suffix {}'.format(t_start, t_end, suffix))
+    fluxes = nrg[inwindow][:, :, list(NRG_FLUX_COLUMNS.values())]
+
+    mean = mytrapz(fluxes, time)
+    std = np.std(fluxes, axis=0)
+    tau = integrated_autocorrtime(fluxes, time)
+    n_eff = effective_samples(tau, time)
+
+    stats = []
+    for i_spec in range(pars['n_spec']):
+        spec_stats = {'species': str(pars['name{}'.format(i_spec + 1)]).strip("'\""),
+                      't_start': float(time[0]), 't_end': float(time[-1]), 'n_samples': int(time.size)}
+        for i_f, flux in enumerate(NRG_FLUX_COLUMNS):
+            spec_stats[flux] = float(mean[i_spec, i_f])
+            spec_stats[flux + '_std'] = float(std[i_spec, i_f])
+            spec_stats[flux + '_tau'] = float(tau[i_spec, i_f])
+            spec_stats[flux + '_neff'] = float(n_eff[i_spec, i_f])
+        stats.append(spec_stats)
+    return stats
+
 def get_parsed_params(filepath):
     par = Parameters()
     par.Read_Pars(filepath)
@@ -155,6 +171,38 @@ def get_suffixes(out_dir, sim_type):
     suffixes.sort()
     return suffixes
 
+def _continuation_pars(out_dir, suffix):
+    par = Parameters()
+    par.Read_Pars(os.path.join(out_dir, 'parameters' + suffix))
+    return {key: value for key, value in par.pardict.items()
+            if par.nmldict[key] not in CONTINUATION_IGNORED_NAMELISTS
+            and key not in CONTINUATION_IGNORED_PARAMETERS}
+
+def get_continuation_chains(out_dir, suffixes):
+    '''
+    Group the suffixes of GENE runs into chains of continuation runs.
+    A suffix continues the one before it (in sorted order) if the parameters match,
+    up to time limits, checkpointing and performance settings, and its nrg file
+    starts within the time range of the previous one (or at most CONTINUATION_TIME_GAP
+    of its length after it). Returns a list of chains (lists of suffixes), a run
+    which is not continued is a chain of one suffix.
+    '''
+    chains = []
+    previous = None  # parameters, first and last nrg time of the previous suffix
+    for suffix in sorted(suffixes):
+        try:
+            t_first, t_last = nrg_time_bounds(os.path.join(out_dir, 'nrg' + suffix))
+            current = (_continuation_pars(out_dir, suffix), t_first, t_last)
+        except (IOError, ValueError):
+            current = None
+        if previous and current and current[0] == previous[0] and \
+                previous[1] < current[1] <= previous[2] + CONTINUATION_TIME_GAP*(previous[2] - previous[1]):
+            chains[-1].append(suffix)
+        else:
+            chains.append([suffix])
+        previous = current
+    return chains
+
 def get_gyrokinetics_from_dir(out_dir,user, linear):
     suffixes = get_suffixes(out_dir)
     numscan = len(suffixes)
@@ -187,12 +235,124 @@ def get_gyrokinetics_from_run(out_dir, suffix, user, linear, tspan = None):
     
     return tst.gkdict
 
-def get_diag_from_run(out_dir, suffix, t_span = None):
+def _setup_diags(simulation, nonlinear, t_start, t_end, prefetch=0, time_average=False):
+    '''
+    All diagnostics are run in a single pass over the data, each step is read
+    once and handed to every diagnostic that needs it
+    '''
+    run = simulation.runs[0]
+    selected_diags = []
+    diag_keys = []
+    loader=FusedLoader()
+    if nonlinear:   #Only calculate spectra for nonlinear
+        selected_diags.append(DiagFluxSpectra(average=time_average))
+        diag_keys.append('Flux Spectra')
+        selected_diags.append(DiagAmplitudeSpectra(average=time_average))
+        diag_keys.append('Amplitude Spectra')
+        loader.add(selected_diags[:], 1)
+
+    '''
+    Get appropriate time information for snapshots.  We want maximum of 30, minumum of 15
+    Note: the sparse z-grid snapshots are only done for nonlinear
+    '''
+    ntime = len(simulation.data.av_times['mom'].times)
+    if nonlinear:
+        step = int(np.floor(ntime/30)) + 1
+        print("Getting snapshots and final for fields and moments")
+    else:
+        step = 1
+        print("Getting final for fields and moments")
+    #print("Number of time points, step",ntime,step)
+    selected_diags.append(DiagFieldMomSnapshots())
+    diag_keys.append('Field Mom Snapshots')
+    loader.add(selected_diags[-1:], step, final_only=not nonlinear)  #Only final time for linear
+
+    loader.set_interval(simulation.data, run, t_start, t_end, prefetch)
+    return diag_keys, selected_diags, loader
+
+def _run_diags(simulation, loader, its):
+    run = simulation.runs[0]
+    loader.reserve(its)
+    for it in its:
+        time = loader.times[it]
+        print(" time {}".format(time))
+        loader.wait(it)
+        for diag in loader.diags[it]:
+            diag.execute(simulation.data, run, loader.steps[it], loader.files[it], time)
+    loader.close()
+
+def _diag_worker(args):
+    '''
+    Run the diagnostics on the time points i_start:i_end with its own readers,
+    returns the partial results of all diagnostics and the bytes read
+    '''
+    out_dir, suffix, nonlinear, t_start, t_end, time_average, i_start, i_end = args
+    simulation=Simulation(out_dir, None, _chain(suffix), usemmap=True)
+    _, selected_diags, loader = _setup_diags(simulation, nonlinear, t_start, t_end,
+                                             time_average=time_average)
+    _run_diags(simulation, loader, range(i_start, i_end))
+    return [diag.partial_result() for diag in selected_diags], simulation.data.bytes_read()
+
+def get_time_window(out_dir, suffix, t_span = None, saturation = None):
+    '''
+    Time window the diagnostics are run on, returns t_start, t_end and a
+    dictionary describing how they were chosen (stored in the Metadata).
+
+    t_span:     [t_start, t_end] given by the user, used as is
+    saturation: parameters of find_saturated_window overriding SATURATION_DEFAULTS,
+                or False to use the whole nrg time range. The detector runs on the
+                total heat flux of nonlinear runs only.
+    For a continuation chain (list of suffixes) the glued nrg time trace is used.
+    '''
+    if t_span is not None and len(t_span)==2:
+        return t_span[0], t_span[-1], {'t_start': t_span[0], 't_end': t_span[-1], 'method': 'manual'}
+
+    print('Time span not speficied, searching it in NRG file\n')
+    suffixes = _chain(suffix)
+    nrgfiles = [os.path.join(out_dir , 'nrg' + s) for s in suffixes]
+    if not all(os.path.isfile(nrgfile) for nrgfile in nrgfiles):
+        print('NRG files not found for suffix {}. Using t_start = 0.0 and t_end = 100.0'.format(suffix))
+        return 0.0, 100.0, {'t_start': 0.0, 't_end': 100.0, 'method': 'default'}
+
+    pars = get_parsed_params(os.path.join(out_dir , 'parameters' + suffixes[0]))
+    nonlinear = pars['nonlinear'] == 'T' or pars['nonlinear'] == True
+    if not nonlinear or saturation is False:
+        #only the first and last time are needed, no need to parse the whole files
+        t_start = nrg_time_bounds(nrgfiles[0], pars['n_spec'])[0]
+        t_end = nrg_time_bounds(nrgfiles[-1], pars['n_spec'])[1]
+        return t_start, t_end, {'t_start': t_start, 't_end': t_end, 'method': 'nrg'}
+
+    detector = dict(SATURATION_DEFAULTS)
+    detector.update(saturation or {})
+    time, nrg = read_nrg_chain(nrgfiles, pars['n_spec'], pars['nrgcols'])
+    heat_flux = np.sum(nrg[:, :, NRG_HEAT_FLUX_COLUMNS], axis=(1, 2))
+    t_start, t_end, saturated = find_saturated_window(time, heat_flux, **detector)
+    t_start, t_end = float(t_start), float(t_end)
+    if saturated:
+        print('Saturated phase of suffix {} found from {} to {}'.format(suffix, t_start, t_end))
+    else:
+        print('No saturated phase found for suffix {}, using the whole nrg time range'.format(suffix))
+    return t_start, t_end, {'t_start': t_start, 't_end': t_end, 'method': 'saturation',
+                            'saturated': saturated, 'detector': detector}
+
+def get_diag_from_run(out_dir, suffix, t_span = None, prefetch = 0, workers = 1, time_average = False,
+                      saturation = None):
 #    t_start = 0.0 # use start/end time in nrg files?
 #    t_end = 100.0
+    '''
+    prefetch: number of steps read ahead in a background thread while the
+              diagnostics run (0 disables it). Helps on slow parallel filesystems.
+    workers:  number of processes the time points are split over. Each works on
+              a contiguous block of times and the results are merged in time order.
+    time_average: also store the time averages of the spectra (*_avg entries)
+    saturation: parameters of the saturated phase detection used without t_span,
+                see get_time_window
+    suffix:     a suffix, or the list of suffixes of a continuation chain which is
+                processed as one run
+    '''
 
     par0 = Parameters()
-    par0.Read_Pars(os.path.join(out_dir , 'parameters' + suffix))
+    par0.Read_Pars(os.path.join(out_dir , 'parameters' + _chain(suffix)[0]))
     pars0 = par0.pardict 
 
     if pars0['nonlinear'] == 'T' or pars0['nonlinear'] == True:
@@ -200,105 +360,41 @@ def get_diag_from_run(out_dir, suffix, t_span = None):
     else:
         nonlinear = False
 
-    if t_span is not None and len(t_span)==2:
-        t_start = t_span[0]
-        t_end = t_span[-1]
-        
-    else:
-        print('Time span not speficied, searching it in NRG file\n')
-        
-        nspec = pars0['n_spec']
-        if os.path.isfile(os.path.join(out_dir , 'nrg' + suffix) ):
-            if nspec==1:
-                tn,_ =get_nrg(out_dir, suffix)
-                t_start = float(tn[0])
-                t_end = float(tn[-1])
-            elif nspec==2:
-                tn,_,_ =get_nrg(out_dir, suffix)
-                t_start = float(tn[0])
-                t_end = float(tn[-1])
-            elif nspec==3:
-                tn,_,_,_ =get_nrg(out_dir, suffix)
-                t_start = float(tn[0])
-                t_end = float(tn[-1])
-            else:
-                exit("Not ready for nspec>3")
-        else:
-            t_start = 0.0
-            t_end = 100.0
-            print('NRG files not found for suffix {}. Using t_start = 0.0 and t_end = 100.0'.format(suffix))
-        
+    t_start, t_end, _ = get_time_window(out_dir, suffix, t_span, saturation)
 
     print('****** Diagnostics start at {} and end at {}. ******'.format(t_start, t_end))
     
     Diag_dict = {}
        
     #all is also included in the run object
-    simulation=Simulation(out_dir, None, [suffix])
+    #diagnostics only reduce the data, so read views on memory mapped files
+    simulation=Simulation(out_dir, None, _chain(suffix), usemmap=True)
     run = simulation.runs[0]
 
-    data = Data(run.parameters,suffix)
-    
     #selected_diags= {'Flux Spectra':DiagFluxSpectra(avail_vars=data.av_vars, specnames=run.specnames),
     #                 'Amplitude Spectra':DiagAmplitudeSpectra(avail_vars=data.av_vars, specnames=run.specnames,parameters = run.parameters[0].pardict,spatialgrid = run.spatialgrid[0]),
     
-    '''
-    Creat a folder for saving plots if it does not exist
-    '''
-    if nonlinear:   #Only calculate spectra for nonlinear
-        selected_diags = []
-        diag_keys = []
-        #selected_diags.append(DiagFieldMomSnapshots())
-        #diag_keys.append('Field Mom Snapshots')
-        selected_diags.append(DiagFluxSpectra())
-        diag_keys.append('Flux Spectra')
-        selected_diags.append(DiagAmplitudeSpectra())
-        diag_keys.append('Amplitude Spectra')
-
-        loader=Loader()
-        step = 1
-        loader.set_interval(selected_diags, simulation.data,run, t_start,t_end,step)
-        for it, time in enumerate(loader.times):
-            print(" time {}".format(time))
-            for i_d, diag in enumerate(selected_diags):
-                diag.execute(simulation.data, simulation.runs[0], loader.steps[it], loader.files[it],time)
-        for i in range(len(diag_keys)): 
-            print(diag_keys[i])
-            Diag_dict[diag_keys[i]] = selected_diags[i].dict_to_mgkdb()
-
-    '''
-    Get appropriate time information for snapshots.  We want maximum of 30, minumum of 15
-    Note: the sparse z-grid snapshots are only done for nonlinear
-    '''
-    ntime = len(simulation.data.av_times['mom'].times)
-    if nonlinear:
-        step = int(np.floor(ntime/30)) + 1
-    else:
-        step = 1
-    '''
-    Get snapshots and final fields and moments
-    '''
-    if nonlinear:
-        print("Getting snapshots and final for fields and moments")
+    diag_keys, selected_diags, loader = _setup_diags(simulation, nonlinear, t_start, t_end,
+                                                     prefetch if workers <= 1 else 0, time_average)
+    nchunks = min(workers, loader.times.size)
+    if nchunks > 1:
+        bounds = np.linspace(0, loader.times.size, nchunks + 1).astype(int)
+        with multiprocessing.Pool(nchunks) as pool:
+            partials = pool.map(_diag_worker, [(out_dir, suffix, nonlinear, t_start, t_end, time_average, i_s, i_e)
+                                               for i_s, i_e in zip(bounds[:-1], bounds[1:])])
+        for i_d, diag in enumerate(selected_diags):
+            diag.merge([partial[0][i_d] for partial in partials])
+        bytes_read = sum(partial[1] for partial in partials)
     else:
-        print("Getting final for fields and moments")
-    #print("Number of time points, step",ntime,step)
-    selected_diags = []
-    diag_keys = []
-    selected_diags.append(DiagFieldMomSnapshots())
-    diag_keys.append('Field Mom Snapshots')
- 
-    loader2=Loader()
-    loader2.set_interval(selected_diags, simulation.data,run, t_start,t_end,step)
-    for it, time in enumerate(loader2.times):
-        if nonlinear or time == loader2.times[-1]:  #Only final time for linear
-            print(" time {}".format(time))
-            for i_d, diag in enumerate(selected_diags):
-                diag.execute(simulation.data, simulation.runs[0], loader2.steps[it], loader2.files[it],time)
+        _run_diags(simulation, loader, range(loader.times.size))
+        bytes_read = simulation.data.bytes_read()
+        print('Data cache: {}'.format(simulation.data.cache.stats()))
     for i in range(len(diag_keys)): 
         print(diag_keys[i])
         Diag_dict[diag_keys[i]] = selected_diags[i].dict_to_mgkdb()
     
+    print('Read {:.1f} MB of field/mom data for suffix {}'.format(bytes_read/1024**2, suffix))
+
     '''
     Grid
     '''
@@ -1,6 +1,6 @@
 """ Module containing averaging functions for diagnostics"""
+import weakref
 import numpy as np
-import os
 
 
 def mytrapz(yvar, timefld):
@@ -23,6 +23,97 @@ def mytrapz(yvar, timefld):
         return np.trapz(yvar, x=tmpt, axis=0)
 
 
+class Averager:
+    """ Spatial averages of (..., nx0, nky0, nz0) data of one geometry
+
+    The weights (jacobian, negative kx or ky half of the Fourier space) are set
+    up once per set of axes. An average is one weighted sum (einsum) which does
+    not modify or copy its input, leading axes (quantities, species) are
+    averaged in the same call.
+
+        averager = get_averager(geom)
+        averager.av(var, 'yz')                           # as yz_av3d(var, geom)
+        averager.av(np.stack([phi, apar]), 'xy', out=buf)
+    """
+
+    def __init__(self, geom):
+        self.x_local = geom.pnt.x_local
+        self.y_local = geom.pnt.y_local
+        if not self.y_local:
+            raise NotImplementedError("No support for y-global")
+        jacobian = np.asarray(geom.jacobian, dtype=np.float64)
+        if not self.x_local and jacobian.shape != (geom.pnt.nx0, geom.pnt.nz0):
+            jacobian = jacobian.T
+        # (nz0) for local, (nx0, nz0) for x-global runs
+        self.__jacobian = jacobian
+        self.__gxx = geom.gxx
+        self.__weights = {}
+
+    def __fold(self, size):
+        """ Add the negative half of the Fourier space, the 0 mode only once """
+        weight = np.full(size, 2.0)
+        weight[0] = 1.0
+        return weight
+
+    def __setup(self, axes, ny, zprofile):
+        """ einsum subscripts and weights for averaging over axes """
+        jac = self.__jacobian
+        factors = []
+        if 'y' in axes:
+            factors.append(('y', self.__fold(ny)))
+        if self.x_local:
+            # x is spectral, the kx modes are summed
+            if 'z' in axes:
+                factors.append(('z', jac/np.sum(jac)))
+        elif ('x' in axes or 'z' in axes) and axes != 'x':
+            # jacobian weighted average over x and/or z (x alone is summed as before)
+            norm_axes = tuple(i for i, dim in enumerate('xz') if dim in axes)
+            factors.append(('xz', jac/np.sum(jac, axis=norm_axes, keepdims=True)))
+        if zprofile:
+            factors.append(('z', 1.0/self.__gxx**0.5))
+        dims = set(axes).union(*(dim for dim, _ in factors))
+        var_dims = 'xyz'[min('xyz'.index(dim) for dim in dims):]
+        out_dims = ''.join(dim for dim in var_dims if dim not in axes)
+        subscripts = ','.join(['...' + var_dims] + [dim for dim, _ in factors]) + '->...' + out_dims
+        return subscripts, [weight for _, weight in factors]
+
+    def av(self, var, axes, out=None):
+        """ Average var over axes, a string of x, y and z
+
+        :param var: (..., nx0, nky0, nz0) data, only the last dimension for 'z' of local runs
+        :param out: array to write the result into
+        """
+        axes = ''.join(dim for dim in 'xyz' if dim in axes)
+        return self.__av(var, axes, False, out)
+
+    def xy_zprofile(self, var, out=None):
+        """ x and y average including 1/gxx**0.5 to match GENE diagnostic tool """
+        if not self.x_local:
+            raise NotImplementedError("Only ready for local simulations")
+        return self.__av(var, 'xy', True, out)
+
+    def __av(self, var, axes, zprofile, out):
+        if not axes:
+            return var
+        ny = np.shape(var)[-2] if 'y' in axes else None
+        key = (axes, ny, zprofile)
+        if key not in self.__weights:
+            self.__weights[key] = self.__setup(axes, ny, zprofile)
+        subscripts, weights = self.__weights[key]
+        return np.einsum(subscripts, var, *weights, out=out)
+
+
+# one Averager per geometry object
+_AVERAGERS = weakref.WeakKeyDictionary()
+
+
+def get_averager(geom):
+    """ The Averager of geom, created on first use """
+    if geom not in _AVERAGERS:
+        _AVERAGERS[geom] = Averager(geom)
+    return _AVERAGERS[geom]
+
+
 def z_av3d(var, geom):
     """ Perform the average in z direction for a 3d variable
 
@@ -30,16 +121,7 @@ def z_av3d(var, geom):
     :param geom: GENE geomtry object
 
     """
-    if geom.pnt.x_local:
-        if geom.pnt.y_local:
-            return np.average(var, weights=geom.jacobian, axis=-1)
-        else:
-            return np.average(var, weights=geom.jaco3d.T, axis=-1)
-    else:
-        if geom.pnt.y_local:
-            return np.average(var, weights=geom.jaco3d.T, axis=-1)
-        else:
-            return np.average(var, weights=geom.jacobian.T, axis=2)
+    return get_averager(geom).av(var, 'z')
 
 
 def y_av3d(var, geom):
@@ -48,18 +130,7 @@ def y_av3d(var, geom):
     :param var: Variable to average over
     :param geom: GENE geomtry object
     """
-    if geom.pnt.x_local:
-        if geom.pnt.y_local:  # Add the negative half of the Fourier space for ky
-            var[:, 0, :] *= 0.5
-            return np.sum(2*var, axis=1)
-        else:
-            return np.average(var, weights=geom.jaco3d.T, axis=1)
-    else:
-        if geom.pnt.y_local:
-            var[:, 0, :] *= 0.5
-            return np.sum(2*var, axis=1)
-        else:
-            return np.average(var, weights=geom.jacobian.T, axis=1)
+    return get_averager(geom).av(var, 'y')
 
 
 def x_av3d(var, geom):
@@ -68,17 +139,7 @@ def x_av3d(var, geom):
     :param var: Variable to average over
     :param geom: GENE geomtry object
     """
-    if geom.pnt.x_local:
-        if geom.pnt.y_local:
-            return np.sum(var, axis=0)
-        else:  # Mirror positive kx to negative kx
-            var[0, :, :] *= 0.5
-            return np.sum(2*var, axis=0)
-    else:
-        if geom.pnt.y_local:
-            return np.sum(var, axis=0)
-        else:
-            return np.average(var, weights=geom.jacobian.T, axis=0)
+    return get_averager(geom).av(var, 'x')
 
 
 def xz_av3d(var, geom):
@@ -87,35 +148,14 @@ def xz_av3d(var, geom):
     :param var: Variable to average over
     :param geom: GENE geomtry object
     """
-    if geom.pnt.x_local:
-        if geom.pnt.y_local:
-            return np.average(np.sum(var, axis=0), weights=geom.jacobian, axis=-1)
-        else:  # Mirror positive kx to negative kx
-            var[0, :, :] *= 0.5
-            return np.average(np.sum(2*var, axis=0), weights=geom.jacobian.T, axis=-1)
-    else:
-        if geom.pnt.y_local:
-            return np.average(var, weights=geom.jaco3d.T, axis=(0, -1))
-        else:
-            return np.average(var, weights=geom.jacobian.T, axis=(0, 2))
+    return get_averager(geom).av(var, 'xz')
 
 
 def yz_av3d(var, geom):
     """ Perform the average in y and z direction for a 3d variable
     param var: Variable to average over
     param geom: GENE geometry object """
-    if geom.pnt.x_local:
-        if geom.pnt.y_local:  # Add the negative half of the Fourier space for ky
-            var[:, 0, :] *= 0.5
-            return np.average(np.sum(2*var, axis=1), weights=geom.jacobian.T, axis=-1)
-        else:
-            return np.average(var, weights=geom.jaco3d.T, axis=(1, -1))  # geom has (y, z)
-    else:
-        if geom.pnt.y_local:
-            return np.average(np.sum(2*var, axis=1) - var[:, 0, :], weights=geom.jacobian.T,
-                              axis=-1)
-        else:
-            return np.average(var, weights=geom.jacobian.T, axis=(1, 2))
+    return get_averager(geom).av(var, 'yz')
 
 
 def xy_av3d_zprofile(var, geom):
@@ -124,18 +164,7 @@ def xy_av3d_zprofile(var, geom):
     :param var: Variable to average over
     :param geom: GENE geomtry object
     """
-    if geom.pnt.x_local:
-        if geom.pnt.y_local:
-            var[:, 0, :] *= 0.5
-            return np.sum(2*var, axis=(0, 1))/geom.gxx**0.5
-        else:  # Mirror positive kx to negative kx
-            print("Error!  Only ready for local simulations.")
-            os.exit()
-    else:
-        print("Error!  Only ready for local simulations.")
-        os.exit()
-
-
+    return get_averager(geom).xy_zprofile(var)
 
 
 def xy_av3d(var, geom):
@@ -144,19 +173,7 @@ def xy_av3d(var, geom):
     :param var: Variable to average over
     :param geom: GENE geomtry object
     """
-    if geom.pnt.x_local:
-        if geom.pnt.y_local:
-            var[:, 0, :] *= 0.5
-            return np.sum(2*var, axis=(0, 1))
-        else:  # Mirror positive kx to negative kx
-            var[0, :, :] *= 0.5
-            return np.average(np.sum(2*var, axis=0), weights=geom.jacobian.T, axis=1)
-    else:
-        if geom.pnt.y_local:
-            var[:, 0, :] *= 0.5
-            return np.average(np.sum(2*var, axis=1), weights=geom.jacobian.T, axis=0)
-        else:
-            return np.average(var, weights=geom.jacobian.T, axis=(0, 1))
+    return get_averager(geom).av(var, 'xy')
 
 
 def xyz_av3d(var, geom):
@@ -165,20 +182,7 @@ def xyz_av3d(var, geom):
     :param var: Variable to average over
     :param geom: GENE geomtry object
     """
-    if geom.pnt.x_local:
-        if geom.pnt.y_local:
-            var[:, 0, :] *= 0.5
-            return np.average(np.sum(2*var, axis=(0, 1)), weights=geom.jacobian)
-        else:  # Mirror positive kx to negative kx
-            var[0, :, :] *= 0.5
-            temp = np.sum(2*var, axis=0)
-            return np.average(temp, weights=geom.jacobian.T, axis=(0, -1))
-    else:
-        if geom.pnt.y_local:
-            var[:, 0, :] *= 0.5
-            return np.average(np.sum(2*var, axis=1), weights=geom.jacobian.T, axis=(0, -1))
-        else:
-            return np.average(var, weights=geom.jacobian.T)
+    return get_averager(geom).av(var, 'xyz')
 
 
 def av3d_by_switch(xavg, yavg, zavg):
@@ -244,6 +248,60 @@ def flux_spectra_yz_av(var, geom):
         raise NotImplementedError("No support for x-global yet")
 
 
+def flux_spectra_weights(geom):
+    """ Precompute the geometry weights used by flux_spectra_batch """
+    if not (geom.pnt.x_local and geom.pnt.y_local):
+        raise NotImplementedError("No support for x- or y-global")
+    w_ky = np.full(geom.pnt.nky0, 2.0)
+    w_ky[0] = 1.0
+    return {'jac': geom.jacobian/np.sum(geom.jacobian),
+            'ky': w_ky,
+            'gxx': 1.0/geom.gxx**0.5,
+            'nx0': geom.pnt.nx0}
+
+
+def flux_spectra_batch(field, moms, coef, weights):
+    """ Flux spectra of all species and fluxes built from one field term at once
+
+    The fluxes are Re(field*conj(sum_m coef[s,f,m]*moms[s,m])), the results are the
+    same as flux_spectra_yz_av, flux_spectra_xz_av and xy_av3d_zprofile of each flux
+    but no 3d flux array is formed. Leading axes (e.g. time) are kept.
+
+    :param field: (..., nx0, nky0, nz0) field term, e.g. the ExB velocity
+    :param moms: (..., nspec, nmom, nx0, nky0, nz0) moments
+    :param coef: (nspec, nflux, nmom) weight of each moment in each flux
+    :param weights: output of flux_spectra_weights
+    :returns: kx (..., nspec, nflux, nx0/2+1), ky (..., nky0) and z (..., nz0) spectra
+    """
+    f_jac = field*weights['jac']
+    f_ky = field*weights['ky'][:, np.newaxis]
+    # z average, still resolved in kx and ky
+    flux_xy = np.einsum('...xyz,...smxyz->...smxy', f_jac.real, moms.real)
+    flux_xy += np.einsum('...xyz,...smxyz->...smxy', f_jac.imag, moms.imag)
+    flux_z = np.einsum('...xyz,...smxyz->...smz', f_ky.real, moms.real)
+    flux_z += np.einsum('...xyz,...smxyz->...smz', f_ky.imag, moms.imag)
+    flux_xy = np.einsum('sfm,...smxy->...sfxy', coef, flux_xy)
+    flux_z = np.einsum('sfm,...smz->...sfz', coef, flux_z)*weights['gxx']
+
+    spec_ky = np.sum(flux_xy, axis=-2)*weights['ky']
+
+    # fold negative kx onto positive kx, the ky=0 plane only once
+    nx0 = weights['nx0']
+    nx0o2 = int(nx0/2)
+    ky0 = flux_xy[..., 0]
+    ky_pos = np.sum(flux_xy[..., 1:], axis=-1)
+    spec_kx = np.empty(flux_xy.shape[:-2] + (nx0o2 + 1,))
+    spec_kx[..., 0] = ky0[..., 0] + 2*ky_pos[..., 0]
+    if nx0%2 == 0:
+        spec_kx[..., 1:nx0o2] = 2*(ky0[..., 1:nx0o2] + ky_pos[..., 1:nx0o2] +
+                                   ky_pos[..., nx0 - 1:nx0o2:-1])
+        spec_kx[..., nx0o2] = ky0[..., nx0o2] + 2*ky_pos[..., nx0o2]
+    else:
+        spec_kx[..., 1:nx0o2 + 1] = 2*(ky0[..., 1:nx0o2 + 1] + ky_pos[..., 1:nx0o2 + 1] +
+                                       ky_pos[..., nx0 - 1:nx0o2:-1])
+    return spec_kx, spec_ky, flux_z
+
+
 def get_area(geom):
     """ Calculate flux surface area"""
     if geom.pnt.x_local:
@@ -70,6 +70,52 @@ def _autocorrtime_nd_helper(ind, flat, timefld, data):
     return autocorrtime_1d(var, timefld)
 
 
+def integrated_autocorrtime(data, timefld, window=5):
+    """ Integrated autocorrelation time along the first dimension of data
+
+    tau_int = dt*(1/2 + sum_k rho(k)) with the autocorrelation function rho
+    computed by FFT for all trailing dimensions at once. The sum is cut at the
+    first lag k >= window*tau_int to keep the noise of the tail of rho out.
+    Samples are assumed (roughly) equidistant in time.
+
+    :param data: First dimension is considered the direction to correlate over
+    :param timefld: The sampling times
+    :param window: Cut of the sum in units of tau_int
+    :returns: tau_int in an array that has ndim(data)-1 dimensions, 0 for constant data
+    """
+    data = np.array(data, dtype=float)
+    n_t = data.shape[0]
+    if n_t <= 2:
+        return np.zeros(data.shape[1:])
+    dt = (timefld[-1] - timefld[0])/(n_t - 1)
+    fluct = data - np.mean(data, axis=0)
+    # zero padding to twice the length avoids the periodic wrap around
+    nfft = 2**int(np.ceil(np.log2(2*n_t)))
+    spec = np.fft.rfft(fluct, n=nfft, axis=0)
+    acf = np.fft.irfft(spec*np.conj(spec), n=nfft, axis=0)[:n_t]
+    rho = np.divide(acf, acf[0], out=np.zeros_like(acf), where=acf[0] > 0)
+    # tau_int/dt when the sum is cut after lag k
+    taus = np.cumsum(rho, axis=0) - 0.5
+    lags = np.arange(n_t).reshape((n_t,) + (1,)*(data.ndim - 1))
+    converged = lags >= window*taus
+    cut = np.where(np.any(converged, axis=0), np.argmax(converged, axis=0), n_t - 1)
+    tau = np.take_along_axis(taus, np.expand_dims(cut, 0), axis=0)[0]
+    return np.where(acf[0] > 0, tau*dt, 0.0)
+
+
+def effective_samples(corrtime, timefld):
+    """ Number of independent samples in a time trace with integrated autocorrelation
+        time corrtime, at most the number of samples """
+    n_t = len(timefld)
+    if n_t <= 1:
+        return np.full(np.shape(corrtime), float(n_t))
+    total_dt = timefld[-1] - timefld[0]
+    corrtime = np.asarray(corrtime, dtype=float)
+    n_eff = np.divide(total_dt, 2*corrtime, out=np.full(corrtime.shape, float(n_t)),
+                      where=corrtime > 0)
+    return np.minimum(n_eff, n_t)
+
+
 def windowerr(data, timefld, std_mean=True, n_win=0):
     """ Wrapper for 1d or multidimensional windowed error calculation
 
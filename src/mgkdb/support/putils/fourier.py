@@ -1,42 +1,74 @@
-""" Module containing fourier transform routines for GENE time series"""
+""" Module containing fourier transform routines for GENE time series
+
+All transforms use scipy.fft with WORKERS threads. scipy.fft keeps the plans of
+recently used shapes, so transforming many arrays of one shape (all time steps
+of a diagnostic) plans only once. Dimensions other than the transformed ones
+are done in the same call: stack fields or moments along a new first axis to
+transform them together.
+"""
 
 import warnings
+from functools import lru_cache
 import numpy as np
-from scipy.fftpack import fft, ifft, rfft, irfft
+import scipy.fft
+
+# number of threads of a transform, -1 means all cores (see scipy.fft)
+WORKERS = -1
+
+
+def _workers(workers):
+    return WORKERS if workers is None else workers
 
 
-def apply_fouriertransforms(self, diagspace, var, geom):
-    """ Fourier transform the data as required by a diagnostic"""
-    if diagspace.xavg and diagspace.yavg:  # Nothing to do if both are averaged
-        return var
+def apply_fouriertransforms(pnt, diagspace, var, geom=None, workers=None):
+    """ Fourier transform the data as required by a diagnostic
+
+    :param pnt: parameters of the run (x_local, y_local, nx0, nky0)
+    :param diagspace: DiagSpace of the diagnostic
+    """
+    for step, axis in _transform_steps(pnt.x_local, pnt.y_local, diagspace.x_fourier,
+                                       diagspace.y_fourier, diagspace.z_fourier,
+                                       diagspace.xavg, diagspace.yavg, diagspace.zavg):
+        if step == 'kx_to_x':
+            var = kx_to_x(var, pnt.nx0, axis=axis, workers=workers)
+        elif step == 'x_to_kx':
+            var = x_to_kx(var, axis=axis, workers=workers)
+        elif step == 'ky_to_y':
+            var = ky_to_y(var, pnt.nky0, axis=axis, workers=workers)
+        elif step == 'y_to_ky':
+            if pnt.x_local:
+                warnings.warn("y-global is not supported", RuntimeWarning)
+            var = y_to_ky(var, axis=axis, workers=workers)
+        else:
+            var = z_to_kz(var, axis=axis, workers=workers)
+    return var
+
+
+@lru_cache(maxsize=None)
+def _transform_steps(x_local, y_local, x_fourier, y_fourier, z_fourier, xavg, yavg, zavg):
+    """ Transforms (and their axes) needed to go from the run to the diagnostic layout """
+    if xavg and yavg:  # Nothing to do if both are averaged
+        return ()
     xaxis = -3  # By default the last three dimensions of var are x, y, z.
     yaxis = -2  # This is changed if averages are applied
     zaxis = -1
-    if diagspace.yavg:
+    if yavg:
         xaxis += 1
         yaxis += 1
-    if diagspace.zavg:
+    if zavg:
         xaxis += 1
         yaxis += 1
-
-    if diagspace.x_fourier != self.run_data.x_local and not diagspace.xavg:
-        if self.run_data.x_local:
-            var = kx_to_x(var, self.run_data.pnt.nx0, axis=xaxis)
-        else:
-            var = x_to_kx(var, axis=xaxis)
-    if diagspace.y_fourier != self.run_data.y_local and not diagspace.yavg:
-        if self.run_data.y_local:
-            var = ky_to_y(var, self.run_data.pnt.nky0, axis=yaxis)
-        else:
-            if self.run_data.x_local:
-                warnings.warn("y-global is not supported", RuntimeWarning)
-            var = y_to_ky(var, geom, axis=yaxis)
-    if diagspace.z_fourier:
-        var = z_to_kz(var, geom, axis=zaxis)
-    return var
+    steps = []
+    if x_fourier != x_local and not xavg:
+        steps.append(('kx_to_x' if x_local else 'x_to_kx', xaxis))
+    if y_fourier != y_local and not yavg:
+        steps.append(('ky_to_y' if y_local else 'y_to_ky', yaxis))
+    if z_fourier:
+        steps.append(('z_to_kz', zaxis))
+    return tuple(steps)
 
 
-def kx_to_x(var_kx, nx0, axis=-3):
+def kx_to_x(var_kx, nx0, axis=-3, workers=None):
     """ Perform inverse FFT on kx spectral direction of variable
 
     Note: The fft and ifft in python and GENE/IDL have the factor 1/N switched!
@@ -45,12 +77,15 @@ def kx_to_x(var_kx, nx0, axis=-3):
     :param axis: Which axis of var_kx is the x direction, by default the third last one
     :returns: variable in real x space
     """
-    var_x = np.fft.ifft(nx0*var_kx, axis=axis)
+    # norm='forward' leaves the inverse unnormalised, i.e. the factor nx0 of GENE
+    var_x = scipy.fft.ifft(var_kx, axis=axis, norm='forward', workers=_workers(workers))
+    if np.shape(var_kx)[axis] != nx0:
+        var_x *= nx0/np.shape(var_kx)[axis]
     var_x = np.real_if_close(var_x, tol=1e5)
     return var_x
 
 
-def ky_to_y(var_ky, nky0, axis=-2):
+def ky_to_y(var_ky, nky0, axis=-2, workers=None):
     """ Perform inverse FFT on ky spectral direction of variable
 
     The GENE data only include the non-negative ky components, so we need to use the real
@@ -61,47 +96,69 @@ def ky_to_y(var_ky, nky0, axis=-2):
     :param axis: Which axis of var_kx is the x direction, by default the third last one
     :returns: variable in real y space
     """
-    # The GENE data only include the non-negative ky components, so we need to use the real
-    # valued FFT routines
-    var_y = np.fft.irfft(2*nky0*var_ky, n=2*nky0, axis=axis)
-    var_y = np.real_if_close(var_y, tol=1e5)
+    var_y = scipy.fft.irfft(var_ky, n=2*nky0, axis=axis, norm='forward', workers=_workers(workers))
     return var_y
 
 
-def x_to_kx(var_x, axis=-3):
+def kxky_to_xy(var_k, nx0, nky0, axes=(-3, -2), workers=None):
+    """ kx_to_x and ky_to_y in one transform
+
+    :param var_k: Variable in kx, ky space
+    :param axes: Which axes of var_k are the x and y directions
+    :returns: variable in real x, y space
+    """
+    return scipy.fft.irfftn(var_k, s=(nx0, 2*nky0), axes=axes, norm='forward',
+                            workers=_workers(workers))
+
+
+def x_to_kx(var_x, axis=-3, workers=None):
     """ Perform FFT on x direction of variable
 
     Note: The fft and ifft in python and GENE/IDL have the factor 1/N switched!
     :param var_x: Variable in real x space
-    :param nx0: Number of x grid points
     :param axis: Which axis of var_kx is the x direction
     :returns: variable in fourier kx space
     """
-    var_kx = np.fft.fft(var_x, axis=axis)
+    var_kx = scipy.fft.fft(var_x, axis=axis, workers=_workers(workers))
     return var_kx
 
 
-def y_to_ky(var_y, axis=-2):
+def y_to_ky(var_y, axis=-2, real=False, workers=None):
     """ Perform FFT on y direction of variable
 
     Note: The fft and ifft in python and GENE/IDL have the factor 1/N switched!
     :param var_y: Variable in real y space
     :param axis: Which axis of var_ky is the y direction
+    :param real: only return the non-negative ky (as GENE), var_y has to be real
     :returns: variable in fourier ky space
     """
-    var_ky = np.fft.fft(var_y, axis=axis)
+    if real:
+        return scipy.fft.rfft(var_y, axis=axis, workers=_workers(workers))
+    var_ky = scipy.fft.fft(var_y, axis=axis, workers=_workers(workers))
 
     return var_ky
 
 
-def z_to_kz(var_z, axis=-1):
+def z_to_kz(var_z, axis=-1, workers=None):
     """ Perform FFT on z direction of variable
 
     Note: The fft and ifft in python and GENE/IDL have the factor 1/N switched!
     :param var_z: Variable in real z space
-    :param nz0: Number of z grid points
     :param axis: Which axis of var_kz is the z direction
     :returns: variable in fourier kz space
     """
-    var_kz = np.fft.fft(var_z, axis=axis)
+    var_kz = scipy.fft.fft(var_z, axis=axis, workers=_workers(workers))
     return var_kz
+
+
+def kz_to_z(var_kz, axis=-1, workers=None):
+    """ Perform inverse FFT on kz spectral direction of variable
+
+    This is normalised as numpy, since there is no z-spectral version of GENE.
+    :param var_kz: Variable in kz space
+    :param axis: Which axis of var_kz is the z direction
+    :returns: variable in real z space
+    """
+    var_z = scipy.fft.ifft(var_kz, axis=axis, workers=_workers(workers))
+    var_z = np.real_if_close(var_z, tol=1e5)
+    return var_z
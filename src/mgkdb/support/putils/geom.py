@@ -2,6 +2,7 @@
 import numpy as np
 import h5py
 from .par_io import Parameters
+from ..data.geom_reader import read_geometry
 import os
 import matplotlib.pyplot as plt
 
@@ -45,156 +46,69 @@ class Geometry:
             raise NotImplementedError("y_local not supported")
         return geom
 
-    @staticmethod
-    def untangle_1d(arrlist, start, nxorny):
-        """ Process a geometry file section that contains a 1d (x or y) field
-
-        :param arrlist: The entire file as a list of lines
-        :param start: The starting index of the quantity in arrlist
-        :param nxorny: nx0 or nky0 depending on the type of simulation
-        :returns: A 1d numpy array
-        """
-        arr_1d = np.zeros(nxorny)
-        i = 0
-        for line in arrlist[start:-1]:
-            for j in range(len(line.split())):
-                arr_1d[i + j] = line.split()[j]
-            i += len(line.split())
-            if i >= nxorny:
-                break
-        return arr_1d
+    def getgeom(self,folder,extension,):
+        """ Returns the geometry from a non-hdf5 file
 
-    @staticmethod
-    def untangle_2d(arrlist, start, nxorny, nz):
-        """ Process a geometry file section that contains a 2d (x or y, z) field
-
-        :param arrlist: The entire file as a list of lines
-        :param start: The starting index of the quantity in arrlist
-        :param nxorny: nx0 or nky0 depending on the type of simulation
-        :param nz: nz0, number of z grid points
-        :returns: A 2d numpy array
+        The file is parsed once per process and shared with all other readers,
+        see data/geom_reader.py
         """
-        arr_2d = np.zeros((nz, nxorny))
-        ik = 0
-        for line in arrlist[start:-1]:
-            arr = line.split()[:]
-            lb = ik % nxorny
-            ub = min(lb + 16, nxorny)
-            k = int(ik/nxorny)
-            dim = ub - lb
-            arr_2d[k, lb:ub] = arr[0:dim]
-            if dim < 16:
-                arr_2d[k + 1, 0:16 - dim] = arr[dim:]
-            ik += 16
-            if ik >= nz*nxorny:
-                break
-        return arr_2d.T         # want (nx,nz) order
-
-    def getgeom(self,folder,extension,):
-        """ Returns the geometry from a non-hdf5 file """
         local = self.pnt.x_local
-
-        with open(os.path.join(folder, "{}{}".format(self.geomtype.strip("'"), \
-                                                extension)), "r") as geomfile:
-            if local:
-                geom = self.getgeom_loc(geomfile, self.pnt.nz0)
-            elif self.pnt.y_local:  # x-global
-                geom = self.getgeom_glob(geomfile, self.pnt.nz0, self.pnt.nx0)
-            elif self.pnt.x_local:  # y-global
-                raise NotImplementedError("x_local (y global) not supported")
-            else:
-                raise NotImplementedError("fully global not supported")
+        filename = os.path.join(folder, "{}{}".format(self.geomtype.strip("'"), extension))
+
+        if local:
+            geom = self.getgeom_loc(read_geometry(filename, self.pnt.nz0))
+        elif self.pnt.y_local:  # x-global
+            geom = self.getgeom_glob(read_geometry(filename, self.pnt.nz0, self.pnt.nx0))
+        elif self.pnt.x_local:  # y-global
+            raise NotImplementedError("x_local (y global) not supported")
+        else:
+            raise NotImplementedError("fully global not supported")
         return geom
 
-    def getgeom_loc(self, geomfile, nz):
-        geom = np.empty((16, nz), dtype=np.float64)
-        k = 0
-        for line in geomfile:
-            if len(line.split()) == 16:
-                geom[:, k] = line.split()[:]
-                k += 1
-            elif line.startswith('Cy'):
-                self.Cy = float(line.split()[-1])
-            elif line.startswith('Cxy'):
-                self.Cxy = float(line.split()[-1])
-            elif line.startswith('q0'):
-                self.q = float(line.split()[-1])
-        self.gxx = geom[0]
-        self.gxy = geom[1]
-        self.gxz = geom[2]
-        self.gyy = geom[3]
-        self.gyz = geom[4]
-        self.gzz = geom[5]
-        self.Bfield = geom[6]
-        self.dBdx = geom[7]
-        self.dBdy = geom[8]
-        self.dBdz = geom[9]
-        self.jacobian = geom[10]
-        self.R = geom[11]
-        self.Z = geom[13]
-        self.dxdR = geom[14]
-        self.dxdZ = geom[15]
-        gamma1 = self.gxx*self.gyy - self.gxy**2
-        gamma2 = self.gxx*self.gyz - self.gxy*self.gxz
-        gamma3 = self.gxy*self.gyz - self.gyy*self.gxz
-        self.Kx = -self.dBdy - gamma2/gamma1*self.dBdz
-        self.Ky = self.dBdx - gamma3/gamma1*self.dBdz
-        if not hasattr(self, 'Cxy'):
-            self.Cxy=1.0
+    def getgeom_loc(self, geom):
+        """ Set the attributes from the GeomFile of a local run """
+        if 'Cy' in geom.header:
+            self.Cy = geom.scalar('Cy')
+        self.Cxy = geom.scalar('Cxy', 1.0)
+        if 'q0' in geom.header:
+            self.q = geom.scalar('q0')
+        self.gxx = geom['gxx']
+        self.gxy = geom['gxy']
+        self.gxz = geom['gxz']
+        self.gyy = geom['gyy']
+        self.gyz = geom['gyz']
+        self.gzz = geom['gzz']
+        self.Bfield = geom['Bfield']
+        self.dBdx = geom['dBdx']
+        self.dBdy = geom['dBdy']
+        self.dBdz = geom['dBdz']
+        self.jacobian = geom['jacobian']
+        self.R = geom['geo_R']
+        self.Z = geom['geo_Z']
+        self.dxdR = geom['geo_c1']
+        self.dxdZ = geom['geo_c2']
+        self.Kx, self.Ky = geom.derived('curvature', self.curvature)
         return geom
 
-    def getgeom_glob(self, geomfile, nz0, nxorny):
-        """ Subroutine for geometry files from global runs """
-        NUMFIELDS = 19
-        geom = []
-
-        geomdict = {'q': 0, 'gxx': 1, 'gxy': 2, 'gxz': 3, 'gyy': 4, 'gyz': 5,
-                    'gzz': 6, 'Bfield': 7, 'dBdx': 8, 'dBdy': 9, 'dBdz': 10,
-                    'jacobian': 11, 'C_y': 12, 'C_xy': 13, 'geo_R': 14,
-                    'geo_Z': 15, 'geo_c1': 16, 'geo_c2': 17, 'dpdx_pm_arr': 18}
-        pos_start = np.zeros(NUMFIELDS, dtype=int)  # where a field starts
-        num = 0
-        parheader = True
-        geomlist = geomfile.readlines()
-        for linnum, line in enumerate(geomlist):
-            if parheader:  # ignore the top part of the file (copy of the geometry namelist)
-                if line.startswith(r'/'):
-                    parheader = False
-                continue
-            if len(line.split()) == 1:  # the variable names
-                try:
-                    num = geomdict[line.strip()]
-                    pos_start[num] = linnum + 1
-                except KeyError:
-                    try:  # Test if it is a single number (can occur for 1d arrays)
-                        float(line.strip())
-                    except ValueError:
-                        raise RuntimeError("Unknown entry name in geometry file")
-        for num in range(NUMFIELDS):
-            if pos_start[num] == 0:  # This should only occur if a field does not exist
-                continue
-            if num in [0, 12, 13, 18]:  # We have a 1d field following
-                tmp = self.untangle_1d(geomlist, pos_start[num], nxorny)
-            else:
-                tmp = self.untangle_2d(geomlist, pos_start[num], nxorny, nz0)
-            geom.append(tmp)
-        for key in geomdict:
-            setattr(self, key, geom[geomdict[key]])
-        self.Cy = self.C_y
-        self.Cxy = self.C_xy
-        self.q = self.q
-        self.R = self.geo_R
-        self.Z = self.geo_Z
-
-        self.dxdR = self.geo_c1
-        self.dxdZ = self.geo_c2
-        del self.C_y
-        del self.C_xy
-        del self.geo_R
-        del self.geo_Z
-        del self.geo_c1
-        del self.geo_c2
-        self.dpdx_pm_arr
+    @staticmethod
+    def curvature(geom):
+        """ Kx, Ky of a local geometry """
+        gamma1 = geom['gxx']*geom['gyy'] - geom['gxy']**2
+        gamma2 = geom['gxx']*geom['gyz'] - geom['gxy']*geom['gxz']
+        gamma3 = geom['gxy']*geom['gyz'] - geom['gyy']*geom['gxz']
+        Kx = -geom['dBdy'] - gamma2/gamma1*geom['dBdz']
+        Ky = geom['dBdx'] - gamma3/gamma1*geom['dBdz']
+        return Kx, Ky
+
+    def getgeom_glob(self, geom):
+        """ Set the attributes from the GeomFile of a global run """
+        names = {'q': 'q', 'gxx': 'gxx', 'gxy': 'gxy', 'gxz': 'gxz', 'gyy': 'gyy', 'gyz': 'gyz',
+                 'gzz': 'gzz', 'Bfield': 'Bfield', 'dBdx': 'dBdx', 'dBdy': 'dBdy', 'dBdz': 'dBdz',
+                 'jacobian': 'jacobian', 'C_y': 'Cy', 'C_xy': 'Cxy', 'geo_R': 'R',
+                 'geo_Z': 'Z', 'geo_c1': 'dxdR', 'geo_c2': 'dxdZ', 'dpdx_pm_arr': 'dpdx_pm_arr'}
+        for field, attr in names.items():
+            # 2d fields in (nx, nz) order
+            setattr(self, attr, geom[field] if geom[field].ndim == 1 else geom[field].T)
         return geom
 
     def getgeom_h5(self,folder,extension):
@@ -2,6 +2,8 @@
 
 from bisect import bisect_left, bisect_right
 from copy import deepcopy
+import queue
+import threading
 import numpy as np
 
 
@@ -20,11 +22,17 @@ class Loader:
             """
 
     def __init__(self):
-        pass
+        self.prefetcher = None
     
-    def set_interval(self, diagnostics, data, run, t_start, t_end, step):    
+    def set_interval(self, diagnostics, data, run, t_start, t_end, step, prefetch=0):    
+        """ Select the times to process. With prefetch>0 a background thread reads
+            the next prefetch steps while the current one is processed, call
+            wait(it) before executing the diagnostics on step it"""
         self.need_file={'field': False,
                         'mom': False}
+        # variables each file has to provide, None means all of them
+        self.need_vars={'field': set(),
+                        'mom': set()}
 
         #print("in loader data.av_times['field'].times",data.av_times['field'].times)
         #dummy = input('press key')
@@ -33,6 +41,10 @@ class Loader:
             my_files=diag.get_info()
             for k in self.need_file.keys():
                 self.need_file[k]=self.need_file[k] or my_files[k]
+                if my_files[k] and self.need_vars[k] is not None:
+                    # diagnostics may declare the variables they read, otherwise take all
+                    my_vars = my_files.get('vars', {}).get(k)
+                    self.need_vars[k] = self.need_vars[k].union(my_vars) if my_vars else None
             diag.setup_options(run)
         
         #append all times together
@@ -69,5 +81,180 @@ class Loader:
                         self.files[i_st]={k: data.av_times[k].files[st]} 
                     else:
                         self.steps[i_st].update({k: data.av_times[k].steps[st]})
-                        self.files[i_st].update({k: data.av_times[k].files[st]}) 
-                
+                        self.files[i_st].update({k: data.av_times[k].files[st]})
+
+        self.close()
+        if prefetch > 0 and self.times.size > 0:
+            self.prefetcher = Prefetcher(data, self, depth=prefetch)
+
+    def wait(self, it):
+        """ Make sure the data of step it is available in the file objects """
+        if self.prefetcher:
+            self.prefetcher.wait(it)
+
+    def close(self):
+        """ Stop reading ahead """
+        if self.prefetcher:
+            self.prefetcher.stop()
+            self.prefetcher = None
+
+
+class FusedLoader(Loader):
+    """ Single pass over the data for several groups of diagnostics, each with
+        its own time stride. Every time in the union of the groups is visited
+        once and handed to the diagnostics that asked for it:
+
+            loader = FusedLoader()
+            loader.add(spectra_diags, 1)
+            loader.add(snapshot_diags, 10)
+            loader.set_interval(data, run, t_start, t_end)
+            loader.reserve(range(len(loader.times)))
+            for it, time in enumerate(loader.times):
+                loader.wait(it)
+                for diag in loader.diags[it]:
+                    diag.execute(data, run, loader.steps[it], loader.files[it], time)
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.groups = []
+
+    def add(self, diagnostics, step, final_only=False):
+        """ Register diagnostics to be run every step times, or only at the last time """
+        self.groups.append((diagnostics, step, final_only))
+
+    def set_interval(self, data, run, t_start, t_end, prefetch=0):
+        self.need_file = {'field': False,
+                          'mom': False}
+        self.need_vars = {'field': set(),
+                          'mom': set()}
+        schedule = {}
+        for diagnostics, step, final_only in self.groups:
+            sub = Loader()
+            sub.set_interval(diagnostics, data, run, t_start, t_end, step)
+            for k in self.need_file.keys():
+                self.need_file[k] = self.need_file[k] or sub.need_file[k]
+                if sub.need_file[k]:
+                    if self.need_vars[k] is None or sub.need_vars[k] is None:
+                        self.need_vars[k] = None
+                    else:
+                        self.need_vars[k] = self.need_vars[k].union(sub.need_vars[k])
+            its = range(len(sub.times))
+            if final_only:
+                its = its[-1:]
+            for it in its:
+                entry = schedule.setdefault(sub.times[it], ({}, {}, []))
+                entry[0].update(sub.steps[it])
+                entry[1].update(sub.files[it])
+                entry[2].extend(diagnostics)
+            self.t_start, self.t_end = sub.t_start, sub.t_end
+
+        self.times = np.array(sorted(schedule))
+        self.steps = [schedule[time][0] for time in self.times]
+        self.files = [schedule[time][1] for time in self.times]
+        self.diags = [schedule[time][2] for time in self.times]
+
+        self.close()
+        if prefetch > 0 and self.times.size > 0:
+            self.prefetcher = Prefetcher(data, self, depth=prefetch)
+
+    def reserve(self, its):
+        """ Tell every diagnostic how many of the time points its it will get """
+        counts = {}
+        for it in its:
+            for diag in self.diags[it]:
+                counts[id(diag)] = counts.get(id(diag), 0) + 1
+        for diagnostics, step, final_only in self.groups:
+            for diag in diagnostics:
+                diag.reserve(counts.get(id(diag), 0))
+
+
+class Prefetcher:
+    """ Reads the data needed for the next steps of a loader in a background thread
+
+        The thread has its own file handles and only hands over arrays; wait(it)
+        puts them in the single step caches of the file objects (main thread).
+        Where every record is stored is resolved here, on the main thread, so the
+        thread never looks at the file objects, which change when a continuation
+        run is reached. At most depth steps are read ahead (a step is only read once
+        a slot is free), so with depth=1 there are two buffers: the step being
+        processed and the one being read.
+    """
+
+    def __init__(self, data, loader, depth=1):
+        self.data = data
+        self.steps = loader.steps
+        self.files = loader.files
+        self.jobs = []
+        for k, needed in loader.need_file.items():
+            if not needed:
+                continue
+            afiles = [data.field] if k == 'field' else data.mom
+            for afile in afiles:
+                for name in afile.varnames.values():
+                    if loader.need_vars[k] is None or name in loader.need_vars[k]:
+                        self.jobs.append((k, afile, name))
+        # (k, afile, name, filename, offset, shape, dtype) of every job and step
+        self.records = [[(k, afile, name) + afile.record_location(name, self.steps[it][k],
+                                                                   self.files[it][k])
+                         for k, afile, name in self.jobs] for it in range(len(self.steps))]
+
+        self.__slots = threading.Semaphore(depth)
+        self.__queue = queue.Queue(maxsize=depth)
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def __run(self):
+        fids = {}
+        try:
+            for it, records in enumerate(self.records):
+                if not self.__acquire():
+                    return
+                bundle = []
+                for k, afile, name, filename, offset, shape, dtype in records:
+                    if filename not in fids:
+                        fids[filename] = open(filename, 'rb')
+                    fids[filename].seek(offset)
+                    var3d = np.fromfile(fids[filename], count=int(np.prod(shape)), dtype=dtype)
+                    bundle.append((k, afile, name, filename, var3d.reshape(shape, order="F")))
+                if not self.__put((it, bundle)):
+                    return
+        except Exception as err:
+            self.__put((None, err))
+        finally:
+            for fid in fids.values():
+                fid.close()
+
+    def __acquire(self):
+        """ Wait for a free read ahead slot, gives up when we are stopped """
+        while not self.__stop.is_set():
+            if self.__slots.acquire(timeout=0.1):
+                return True
+        return False
+
+    def __put(self, item):
+        """ Blocking put that gives up when we are stopped """
+        while not self.__stop.is_set():
+            try:
+                self.__queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def wait(self, it):
+        """ Block until step it has been read and hand it over to the file objects """
+        while True:
+            i_read, bundle = self.__queue.get()
+            if i_read is None:
+                raise bundle
+            self.__slots.release()
+            if i_read == it:
+                break
+        for k, afile, name, filename, var3d in bundle:
+            afile.preload(name, self.steps[it][k], var3d, self.files[it][k], filename)
+
+    def stop(self):
+        self.__stop.set()
+        self.__thread.join()
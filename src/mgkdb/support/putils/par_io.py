@@ -1,7 +1,7 @@
 """ par_io.py: Contains the class to handle reading and writing of parameter files """
-import re
 from collections import namedtuple, OrderedDict
 import numpy as np
+from ..data.par_reader import read_parameters, clearcomments
 import os
 
 class Parameters:
@@ -32,88 +32,41 @@ class Parameters:
 
     @staticmethod
     def _clearcomments(variable):
-        regex = re.compile(r'\s*([-+\'\"\[\];.,/a-zA-Z0-9_\s*]*)\s*!?\s*(.*)')
-        result = regex.search(variable)
-        if result and result.group(2)[:4] != 'scan':
-            return regex.search(variable).group(1)
-        else:
-            return variable
+        return clearcomments(variable)
 
     def read_pars(self, path):
         """ Read parameters file and make it a dict """
         self.pardict.clear()
         self.nmldict.clear()
-        # counts species namelists
-        countspec = 0
-        ispec=-1
-        self.species=[]
+        ispec = -1
+        self.species = []
         try:
-            with open(path, "r") as parfile:
-                # Search file for parameters using regular expressions
-                for line in parfile:
-                    # Exclude commented lines
-                    if re.search(r'\s*!\w*\s*=.*', line) is None:
-                        # Check for and count species namelists
-                        if re.search(r'^\s*&(.*)', line):
-                            # if namelist belongs to a species, append its number to the namelist
-                            if re.search(r'^\s*&(.*)', line).group(1) == 'species':
-                                countspec += 1
-                                nml = re.search(r'^\s*&(.*)', line).group(1) + str(countspec)
-                            else:
-                                nml = re.search(r'^\s*&(.*)', line).group(1)
-                            if nml not in self.namelists:
-                                self.namelists.append(nml)
-                    # Search lines for <parameter> = <value> patterns
-                    par = re.compile(r'^\s*(.*)\s*=\s*(.*)')
-                    match = par.search(line)
-                    # Pick matching lines and build parameter dictionary
-                    if match:
-                        # need to sort species by name and not by appending a number
-                        if match.group(1).strip() in self.spec_nl:
-                            # the first output of GENE is the name, so this should be always fine
-                            if match.group(1).strip() == 'name':
-                                myname = match.group(2).strip().replace("'", "")
-                                ispec+=1
-                                self.specnames.append(myname)
-                                self.species.insert(ispec,{"name": myname})
-                            else:
-                                #cast all to doubles
-                                self.species[ispec].update({match.group(1).strip(): np.array(match.group(2),dtype=np.float64)})
-                            self.pardict[match.group(1).strip() + myname] = match.group(2)
-                            self.nmldict[match.group(1).strip() + myname] = nml
-                            
-                        else:
-                            self.pardict[match.group(1).strip()] = match.group(2)
-                            self.nmldict[match.group(1).strip()] = nml
-
-
+            parsed = read_parameters(path)
         except IOError:
             print("Could not read parameters file")
             raise
-        self._clean_parameters()
+        for entry in parsed.entries:
+            # need to sort species by name and not by appending a number
+            if entry.name in self.spec_nl:
+                # the first output of GENE is the name, so this should be always fine
+                if entry.name == 'name':
+                    myname = entry.raw.strip().replace("'", "")
+                    ispec += 1
+                    self.specnames.append(myname)
+                    self.species.insert(ispec, {"name": myname})
+                else:
+                    # cast all to doubles
+                    self.species[ispec].update({entry.name: np.array(entry.raw, dtype=np.float64)})
+                key = entry.name + myname
+            else:
+                key = entry.name
+            self.pardict[key] = entry.value
+            self.nmldict[key] = entry.namelist
+        for nml in parsed.namelists:
+            if nml not in self.namelists:
+                self.namelists.append(nml)
         self.add_defaults()
 
-    def _clean_parameters(self):
-        """ Clear the comments from all variables,
-
-        Cast some strings to integers and floats
-        """
-        boolstr_t = [".T.", ".t.", "T", "t", ".true."]
-        boolstr_f = [".F.", ".f.", "F", "f", ".false."]
-        for item in self.pardict:
-            self.pardict[item] = self._clearcomments(self.pardict[item])
-            try:  # Can it be converted to int?
-                self.pardict[item] = int(self.pardict[item])
-            except ValueError:
-                try:  # No, but can it be converted to float?
-                    self.pardict[item] = float(self.pardict[item])
-                except ValueError:
-                    pass
-            if self.pardict[item] in boolstr_t:  # cast switches to boolean values
-                self.pardict[item] = True
-            elif self.pardict[item] in boolstr_f:
-                self.pardict[item] = False
-
     def add_defaults(self):
         """ Set default values GENE does not write
 
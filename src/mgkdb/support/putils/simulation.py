@@ -13,7 +13,8 @@ class Simulation:
     ## out_folder [str]: directory to save results of diagnostics
     ## extensions [list(str/int)]: extensions of runs to include in diagnostics,
     ##                              pass as list iterable
-    def __init__(self, in_folder=None, out_folder=None, extensions=None):
+    ## usemmap [bool]: memory map field/mom files, reads return views (no copy)
+    def __init__(self, in_folder=None, out_folder=None, extensions=None, usemmap=False):
         # folder containing the simulation data
         self.in_folder = in_folder
         if in_folder:
@@ -23,6 +24,9 @@ class Simulation:
         # extensions to be analyzed
         self.extensions = extensions
 
+        # read binary data through memory maps
+        self.usemmap = usemmap
+
         # folder for output
         self.out_folder = out_folder
         if out_folder:
@@ -68,7 +72,7 @@ class Simulation:
          Still need to keep avail_vars and times per run.
          """
         
-        self.data = Data(self.in_folder, self.extensions, self.runs)
+        self.data = Data(self.in_folder, self.extensions, self.runs, usemmap=self.usemmap)
 
     def __update_variables_and_times(self, variables, times):
         pass
@@ -33,4 +33,155 @@ def find_nearest(array, value):
         return array[idx-1], idx-1
     else:
         return array[idx], idx
-    
\ No newline at end of file
+
+
+def find_saturated_window(time, trace, n_windows=20, ref_fraction=0.3, tolerance=1.0,
+                          min_fraction=0.2):
+    """ Find the statistically steady phase at the end of a time trace
+
+    The trace is cut into n_windows blocks of samples. The last ref_fraction of
+    the trace is the reference. Going back from the end, a block belongs to the
+    saturated phase while its mean is within tolerance reference standard deviations
+    of the reference mean and its standard deviation is below (1 + tolerance) times
+    the reference one; the first block failing this is the change point.
+    :param time: sample times
+    :param trace: samples (e.g. heat flux)
+    :returns: t_start, t_end and whether a saturated phase of at least min_fraction
+              of the trace was found. If not, the whole trace is returned
+    """
+    time = np.asarray(time, dtype=float)
+    trace = np.asarray(trace, dtype=float)
+    n_windows = min(n_windows, time.size//2)
+    if n_windows < 2:
+        return time[0], time[-1], False
+    blocks = np.array_split(np.arange(time.size), n_windows)
+    n_ref = min(max(1, int(round(ref_fraction*n_windows))), n_windows)
+    ref = trace[blocks[-n_ref][0]:]
+    ref_mean, ref_std = np.mean(ref), np.std(ref)
+
+    i_start = n_windows
+    for i_b in range(n_windows - 1, -1, -1):
+        block = trace[blocks[i_b]]
+        if (abs(np.mean(block) - ref_mean) > tolerance*ref_std or
+                np.std(block) > (1.0 + tolerance)*ref_std):
+            break
+        i_start = i_b
+    if i_start == n_windows:
+        return time[0], time[-1], False
+    t_start = time[blocks[i_start][0]]
+    if time[-1] - t_start < min_fraction*(time[-1] - time[0]):
+        return time[0], time[-1], False
+    return t_start, time[-1], True
+
+
+class TraceStack:
+    """ Results of a diagnostic at successive time points, stored in contiguous
+        (nt, ...) arrays instead of lists of arrays
+
+        Space for nt points is set aside by reserve(nt), the arrays are doubled if
+        more points come in. With average=True the time average (as mytrapz) is
+        accumulated on the fly; with keep=False only that average is kept, so the
+        memory does not grow with the number of time points.
+
+        stack = TraceStack({'kx': (nspec, nkx)})
+        out = stack.next()          # views to write the next time point into
+        out['kx'][...] = ...
+        stack.commit(time)
+        stack['kx']                 # (nt, nspec, nkx) view
+    """
+
+    def __init__(self, shapes, dtype=np.float64, keep=True, average=False):
+        self.shapes = {key: tuple(shape) for key, shape in shapes.items()}
+        self.dtype = dtype
+        self.keep = keep
+        self.average = average or not keep
+        self.time = []
+        self.nt = 0
+        # without keep two rows are used in turn, the last point is needed for the average
+        self.__data = {key: np.empty((0 if keep else 2,) + shape, dtype=dtype)
+                       for key, shape in self.shapes.items()}
+        if self.average:
+            self.__integral = {key: np.zeros(shape, dtype=dtype) for key, shape in self.shapes.items()}
+            self.__first = None
+
+    def reserve(self, nt):
+        """ Make room for nt time points in total """
+        if not self.keep or nt <= self.__data_size():
+            return
+        for key, old in self.__data.items():
+            self.__data[key] = np.empty((nt,) + old.shape[1:], dtype=self.dtype)
+            self.__data[key][:self.nt] = old[:self.nt]
+
+    def __data_size(self):
+        if not self.__data:
+            # only the times are recorded
+            return np.inf
+        return next(iter(self.__data.values())).shape[0]
+
+    def __row(self, it):
+        return it if self.keep else it%2
+
+    def next(self):
+        """ Arrays the next time point is written into """
+        if self.keep and self.nt == self.__data_size():
+            self.reserve(max(2*self.nt, 16))
+        return {key: data[self.__row(self.nt)] for key, data in self.__data.items()}
+
+    def commit(self, time):
+        """ The arrays returned by next are filled for this time """
+        if self.average:
+            current = {key: data[self.__row(self.nt)] for key, data in self.__data.items()}
+            if self.nt == 0:
+                self.__first = {key: value.copy() for key, value in current.items()}
+            else:
+                d_t = time - self.time[-1]
+                for key, value in current.items():
+                    self.__integral[key] += 0.5*d_t*(value + self.__data[key][self.__row(self.nt - 1)])
+        self.time.append(time)
+        self.nt += 1
+
+    def append(self, time, **values):
+        out = self.next()
+        for key, value in values.items():
+            out[key][...] = value
+        self.commit(time)
+
+    def extend(self, other):
+        """ Append the time points of another stack that follow ours """
+        if other.keep:
+            for it, time in enumerate(other.time):
+                self.append(time, **{key: other[key][it] for key in self.shapes})
+            return
+        if self.keep:
+            raise ValueError("Cannot extend a stack that keeps its data by an averaged one")
+        if other.nt == 0:
+            return
+        # bridge the gap between our last and their first point, then take their integral
+        self.append(other.time[0], **other.first())
+        for key in self.shapes:
+            self.__integral[key] += other.integral(key)
+        self.time.extend(other.time[1:])
+        self.nt += other.nt - 1
+        for key in self.shapes:
+            self.__data[key][self.__row(self.nt - 1)] = other.last(key)
+
+    def __getitem__(self, key):
+        """ All kept time points, (nt, ...) """
+        if not self.keep:
+            raise KeyError("{} only has the time average".format(key))
+        return self.__data[key][:self.nt]
+
+    def first(self):
+        return self.__first
+
+    def last(self, key):
+        return self.__data[key][self.__row(self.nt - 1)]
+
+    def integral(self, key):
+        return self.__integral[key]
+
+    def mean(self, key):
+        """ Time average of key, like mytrapz """
+        if self.nt == 1:
+            return self.last(key).copy()
+        return self.__integral[key]/(self.time[-1] - self.time[0])
@@ -7,6 +7,7 @@ import mmap
 import numpy as np
 
 from ..utils.averages import mytrapz
+from ...data.continuation import continuation_cuts, glue_arrays
 
 
 class BinaryFile(object):
@@ -50,6 +51,19 @@ class BinaryFile(object):
         self.get_timearray()
         self.reset_tinds()
 
+    def reopen(self):
+        """ Open the same file again without rereading the times
+
+        A forked process has to do this before reading, it would share the file offset
+        with its parent otherwise.
+        """
+        file = open(self.filename, 'rb')
+        if self.usemmap:
+            self.file = mmap.mmap(file.fileno(), length=0, access=mmap.ACCESS_READ)
+        else:
+            self.file = file
+        self.reset_tinds()
+
     def _set_datatypes(self):
         try:
             self.bigendian = self.cm.pars['ENDIANNESS'] == 'BIG'
@@ -218,19 +232,10 @@ def gluetimetraces(tserieslist):
     if len(tserieslist) == 1:
         return tserieslist[0]
     # Use first TimeSeries as basis for the construction of the glued object
-    result = tserieslist.pop(0)
-    # If the timefield has been converted to a np array before we need to undo it
-    try:
-        result.timearray = result.timearray.tolist()
-    except AttributeError:
-        pass
-    for tseries in tserieslist:
-        # When times overlap, give following TimeSeries preference
-        while result.timearray[-1] > tseries.timearray[0]:
-            del result.timearray[-1]
-            del result.dataarray[-1]
-        result.timearray = np.concatenate((result.timearray, tseries.timearray))
-        result.dataarray = np.concatenate((result.dataarray, tseries.dataarray))
+    result = tserieslist[0]
+    # When times overlap, give following TimeSeries preference
+    n_keep = continuation_cuts([tseries.timearray for tseries in tserieslist], keep_equal=True)
+    result.dataarray = glue_arrays([tseries.dataarray for tseries in tserieslist], n_keep)
+    result.timearray = glue_arrays([tseries.timearray for tseries in tserieslist], n_keep)
     result.endtime = tserieslist[-1].endtime
-    del tserieslist
     return result
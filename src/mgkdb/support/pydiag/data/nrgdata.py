@@ -2,10 +2,11 @@
 Module handling nrg files
 
 """
-import csv
 import numpy as np
 
 from .base_file import TimeSeries
+from ...data.nrg_reader import read_nrg
+from ...data.continuation import continuation_cuts, glue_arrays
 
 
 class NrgFile(TimeSeries):
@@ -22,33 +23,16 @@ class NrgFile(TimeSeries):
 
     def generate_timeseries(self):
         """ Fill the Nrgdata object with data """
-        n_col = self.n_col
-        self.timearray = []
-        self.dataarray = []
         try:
-            with open(self.objectname) as nrgfile:
-                csvnrg = csv.reader(nrgfile, delimiter=' ', skipinitialspace=True)
-                for line in csvnrg:
-                    if len(line) == 0:
-                        continue
-                    if len(line) == 1:
-                        self.timearray.append(float(line[0]))
-                        self.dataarray.append([[] for _ in range(self.n_spec)])
-                        ispec = 0  # Reset index for the species at the current time step
-                    elif len(line) == n_col:
-                        self.dataarray[-1][ispec] = line
-                        ispec += 1
-                    else:
-                        raise IOError("Incorrect number of columns")
-        except IOError:
+            self.timearray, self.dataarray = read_nrg(self.objectname, self.n_spec, self.n_col)
+        except (IOError, ValueError):
             raise IOError("nrg file does not exist or has"
                           " wrong number of columns: {}".format(self.objectname))
         self.check_times()
         pos = self.calc_positions()
-        self.dataarray = np.array(self.dataarray).astype(float, copy=False)
         # Reduce the nrgcols to only the required time frame
         self.dataarray = self.dataarray[pos, ...]
-        self.timearray = np.array(self.timearray)[pos]
+        self.timearray = self.timearray[pos]
 
 
 def gluenrgdata(nrglist):
@@ -60,19 +44,12 @@ def gluenrgdata(nrglist):
     # TODO: More sanity checks for agreeing parameters in the list
     if len(nrglist) == 1:
         return nrglist[0]
-    result = nrglist.pop(0)
-    for nrg in nrglist:
-        # When times overlap, give following Nrgdata preference
-        nrg.timearray = nrg.timearray.tolist()
-        result.timearray = result.timearray.tolist()
-        try:
-            while result.timearray[-1] >= nrg.timearray[0]:
-                del result.timearray[-1]
-        except IndexError:
-            raise IndexError("The nrg files completely overlap")
-        result.dataarray = result.dataarray[:len(result.timearray), ...]
-        result.timearray = np.concatenate((result.timearray, nrg.timearray))
-        result.dataarray = np.concatenate((result.dataarray, nrg.dataarray))
+    result = nrglist[0]
+    # When times overlap, give following Nrgdata preference
+    n_keep = continuation_cuts([nrg.timearray for nrg in nrglist])
+    if n_keep[0] == 0:
+        raise IndexError("The nrg files completely overlap")
+    result.dataarray = glue_arrays([nrg.dataarray for nrg in nrglist], n_keep)
+    result.timearray = glue_arrays([nrg.timearray for nrg in nrglist], n_keep)
     result.endtime = nrglist[-1].endtime
-    del nrglist
     return result
@@ -8,6 +8,7 @@ import math
 import numpy as np
 
 from .base_file import TimeSeries
+from ...data.continuation import continuation_cuts, glue_arrays, glue_lists
 from ..utils.geom import Geometry
 from ..utils.nc_predictions import chang_hinton
 
@@ -188,24 +189,16 @@ def glueprofiledata(prdlist):
     if len(prdlist) == 1:
         return prdlist[0]
     # Use first ProfileData as basis for the construction of the glued object
-    result = prdlist.pop(0)
-    for prd in prdlist:
-        for n in range(result.cm.pnt.n_spec):
-            # When times overlap, give following ProfileData preference
-            # If the timefield has been converted to a np array before we need to undo it
-            result.prspec[n].timearray = result.prspec[n].timearray.tolist()
-            prd.prspec[n].timearray = prd.prspec[n].timearray.tolist()
-
-            while result.prspec[n].timearray[-1] >= prd.prspec[n].timearray[0]:
-                del result.prspec[n].timearray[-1]
-                for key in result.prspec[n].dataarray:
-                    del result.prspec[n].dataarray[key][-1]
-            result.prspec[n].timearray = np.concatenate((result.prspec[n].timearray,
-                                                         prd.prspec[n].timearray))
-            for key in result.prspec[n].dataarray:
-                result.prspec[n].dataarray[key] += prd.prspec[n].dataarray[key]
+    result = prdlist[0]
+    for n in range(result.cm.pnt.n_spec):
+        # When times overlap, give following ProfileData preference
+        prspecs = [prd.prspec[n] for prd in prdlist]
+        n_keep = continuation_cuts([prs.timearray for prs in prspecs])
+        for key in result.prspec[n].dataarray:
+            result.prspec[n].dataarray[key] = glue_lists([prs.dataarray[key] for prs in prspecs],
+                                                         n_keep)
+        result.prspec[n].timearray = glue_arrays([prs.timearray for prs in prspecs], n_keep)
     result.cm.endtime = prdlist[-1].cm.endtime
     result.calc_nustar()
     result.Qcharr = chang_hinton(result, 0)
-    del prdlist
     return result
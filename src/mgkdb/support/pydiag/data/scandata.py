@@ -8,6 +8,7 @@ import numpy as np
 from ..utils.ParIO import Parameters
 from ..utils.comm import CommonData
 from .nrgdata import NrgFile
+from ...data.scan_reader import parse_scanlog
 
 
 class Scandata:
@@ -38,19 +39,14 @@ class Scandata:
         """ Parse scan.log for IV and NC and get additional data from parameters_run """
         try:
             with open("scan.log", 'r') as scanlog:
-                header = scanlog.readline().split()
-                self.set_scan_names(header)
-                for line in scanlog:
-                    lst = line.split()
-                    # scan.log has column majority ("Fortran") order
-                    coord = np.unravel_index(int(lst[0])-1, self.scandims, order='F')
-                    for ipar in range(len(self.scandims)):
-                        self.grid[coord + (ipar,)] = float(lst[2+2*ipar])
-                    self.growthrates[coord] = [float(lst[-(2+3*i_ev)]) for i_ev in range(self.n_ev)]
-                    self.frequencies[coord] = [float(lst[-(1+3*i_ev)]) for i_ev in range(self.n_ev)]
+                scan = parse_scanlog(scanlog, self.scandims, self.n_ev)
         except IOError:
             print("Could not read scan.log file")
             raise
+        self.scannames[:] = scan.names
+        self.grid = scan.grid
+        self.growthrates = scan.growthrates
+        self.frequencies = scan.frequencies
         self._reducegrid()
 
     def _reducegrid(self):
@@ -4,6 +4,7 @@ from ..utils.averages import av3d_by_switch
 from ..utils.geom import Geometry
 from .base_file import TimeSeries
 from ..utils.fourier import kx_to_x, x_to_kx, ky_to_y, y_to_ky, z_to_kz
+from ..utils.procpool import map_timesteps
 
 
 class MomFieldSlice(TimeSeries):
@@ -37,17 +38,17 @@ class MomFieldSlice(TimeSeries):
         self.modifier_func = modifier_func
 
     def generate_timeseries(self, sparsefactor=1):
+        generate_slice, times = self._timeseries_job(sparsefactor)
+        self.dataarray = np.atleast_2d(np.array([generate_slice(time) for time in times]))
+        self.timearray = np.array(times)
+
+    def _timeseries_job(self, sparsefactor=1):
+        """ (generate_slice_attime, times) of the time series for map_timesteps """
         self.check_times()
         pos = self.calc_positions()
-        self.dataarray = []
-        new_timearray = []
         if sparsefactor != 1:
             pos = pos[::sparsefactor]
-        for tind in pos:
-            self.dataarray.append(self.generate_slice_attime(self.timearray[tind]))
-            new_timearray.append(self.timearray[tind])
-        self.timearray = np.array(new_timearray)
-        self.dataarray = np.atleast_2d((np.array(self.dataarray)))
+        return self.generate_slice_attime, [self.timearray[tind] for tind in pos]
 
     def generate_slice_attime(self, time):
         """ Create a slice of the data at a fixed time with the desired dimensions
@@ -121,3 +122,17 @@ class MomFieldSlice(TimeSeries):
                     np.savetxt(file, np.atleast_1d(np.squeeze(self.dataarray[tind])), fmt='%.9e',
                                header="{}".format(self.timearray[tind]))
                     file.write(b"\n")
+
+
+def generate_timeseries(slices, sparsefactor=1, workers=None):
+    """ MomFieldSlice.generate_timeseries for several slices at once
+
+    The time steps of all slices are distributed over a pool of processes, see
+    utils.procpool.map_timesteps. The results are the same as of the method.
+    :param workers: number of processes, procpool.WORKERS if not given
+    """
+    jobs = [mfslice._timeseries_job(sparsefactor) for mfslice in slices]
+    results = map_timesteps(jobs, [mfslice.fileobject for mfslice in slices], workers=workers)
+    for mfslice, (_, times), result in zip(slices, jobs, results):
+        mfslice.timearray = np.array(times)
+        mfslice.dataarray = np.atleast_2d(result[0] if result else np.array([]))
@@ -44,7 +44,9 @@ class Plotting(object):
         mpl.rc('figure', facecolor=(1, 1, 1, 0))
         mpl.rc('figure', frameon=False)
         mpl.rc('savefig', facecolor=(1, 1, 1, 0))
-        mpl.rc('savefig', frameon=False)
+        # savefig.frameon was removed in mpl 3.3
+        if parse_version(mpl.__version__) < parse_version("3.3"):
+            mpl.rc('savefig', frameon=False)
         # mpl 1.5 introduces a new, more flexible prop_cycle parameter, so different line styles
         # can be defined in the else case as well
         if parse_version(mpl.__version__) <= parse_version("1.4"):
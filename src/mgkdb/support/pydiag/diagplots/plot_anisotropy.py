@@ -7,9 +7,9 @@ from multiprocessing.dummy import Pool
 from .baseplot import Plotting
 from ..data.slices import MomFieldSlice
 
-from .comm import DiagSpace
-import .averages as averages
-import .fourier as fourier
+from ..utils.comm import DiagSpace
+from ..utils import averages
+from ..utils import fourier
 from ..utils import errors as err
 
 class Anisotropy(object):
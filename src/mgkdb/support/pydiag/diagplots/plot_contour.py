@@ -6,12 +6,12 @@ import numpy as np
 import warnings
 import multiprocessing
 
-import .baseplot
+from .baseplot import Plotting
 from ..data.slices import MomFieldSlice
 from ..utils.comm import DiagSpace
 
-import ..utils.averages as averages
-import ..utils.geom
+from ..utils import averages
+from ..utils.geom import Geometry
 
 
 class MomFieldContour(object):
@@ -48,7 +48,7 @@ class MomFieldContour(object):
             self.contourdata.update({quantity: qslice})
 
 
-class PlotXYContour(pydiag.diagplots.baseplot.Plotting):
+class PlotXYContour(Plotting):
     """ Class to handle contour plots of mom or field data in x-y real space"""
 
     def __init__(self, contourlist):
@@ -1,7 +1,7 @@
 """plotfsamom.py: Module to do the plotting of flux-surface averaged moments """
 
 import numpy as np
-import ..utils.averages as av
+from ..utils import averages as av
 from .baseplot import plt, Plotting
 
 
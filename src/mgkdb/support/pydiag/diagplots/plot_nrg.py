@@ -1,7 +1,7 @@
 import numpy as np
-import ..utils.averages as av
+from ..utils import averages as av
 from .baseplot import Plotting, plt
-from .utils import errors as err
+from ..utils import errors as err
 
 
 class PlotNrgdata(Plotting):
@@ -1,7 +1,7 @@
 """PlotProfiles.py: Module to do the plotting of profile diagnostic outputput """
 
 import numpy as np
-import ..utils.averages as av
+from ..utils import averages as av
 from ..utils import errors as err, nc_predictions
 from .baseplot import plt, Plotting
 
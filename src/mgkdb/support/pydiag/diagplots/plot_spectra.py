@@ -3,23 +3,24 @@
 import matplotlib.pyplot as plt
 import numpy as np
 import warnings
-from multiprocessing.dummy import Pool
 
 from .baseplot import Plotting
-from ..data.slices import MomFieldSlice
+from ..data.slices import MomFieldSlice, generate_timeseries
+from ..utils.procpool import map_timesteps
 from ..utils.comm import DiagSpace
 
-import ..utils.averages as averages
-import ..utils.geom
+from ..utils import averages
+from ..utils.geom import Geometry
 
 
 class AmplitudeSpectra(object):
     """ kx and ky spectra of 3d mom and field data
 
-     Collect the squared absolute field and mom data as kx and ky spectra
+     Collect the squared absolute field and mom data as kx and ky spectra.
+     The time steps are processed by workers processes (see utils.procpool).
      """
 
-    def __init__(self, common, species, rundatafiles, moms=None):
+    def __init__(self, common, species, rundatafiles, moms=None, workers=None):
         if not common.y_local:
             raise NotImplementedError("Only implemented for local simulations yet")
         self.cm = common
@@ -42,28 +43,24 @@ class AmplitudeSpectra(object):
             self.momamps_kx = {mom: self.momamps_kx[mom] for mom in moms if mom in self.momamps_kx}
             self.momamps_ky = {mom: self.momamps_ky[mom] for mom in moms if mom in self.momamps_ky}
 
-        with Pool(len(self.momamps_kx)) as p:
-            momamps_kx_temp = p.map(
-                lambda mom: MomFieldSlice(common, mom, species, self.diagspace_kx, rundatafiles),
-                self.momamps_kx)
-            momamps_ky_temp = p.map(
-                lambda mom: MomFieldSlice(common, mom, species, self.diagspace_ky, rundatafiles),
-                self.momamps_ky)
-        for imom, mom in enumerate(self.momamps_kx):
-            self.momamps_kx[mom] = momamps_kx_temp[imom]
-            self.momamps_kx[mom].generate_timeseries()
-            self.momamps_kx[mom].generate_timeaverage()
-            self.momamps_ky[mom] = momamps_ky_temp[imom]
-            self.momamps_ky[mom].generate_timeseries()
-            self.momamps_ky[mom].generate_timeaverage()
+        for mom in self.momamps_kx:
+            self.momamps_kx[mom] = MomFieldSlice(common, mom, species, self.diagspace_kx,
+                                                 rundatafiles)
+            self.momamps_ky[mom] = MomFieldSlice(common, mom, species, self.diagspace_ky,
+                                                 rundatafiles)
+        slices = list(self.momamps_kx.values()) + list(self.momamps_ky.values())
+        generate_timeseries(slices, workers=workers)
+        for mfslice in slices:
+            mfslice.generate_timeaverage()
 
 class PerpSpectra(object):
     """ 1d perpendicular spectra of 3d mom and field data
 
-     Collect the squared absolute field and mom data as kperp spectra
+     Collect the squared absolute field and mom data as kperp spectra.
+     The time steps are processed by workers processes (see utils.procpool).
      """
 
-    def __init__(self, common, species, rundatafiles):
+    def __init__(self, common, species, rundatafiles, workers=None):
         if not common.x_local or not common.y_local:
             raise NotImplementedError("Only implemented for local simulations yet")
         self.cm = common
@@ -76,14 +73,12 @@ class PerpSpectra(object):
             if common.bpar:
                 self.momamps_kperp.update({"bpar": None})
 
-        with Pool() as p:
-            momamps_kperp_temp = p.map(
-                lambda mom: MomFieldSlice(common, mom, species, self.diagspace_kxky, rundatafiles),
-                self.momamps_kperp)
-        for imom, mom in enumerate(self.momamps_kperp):
-            self.momamps_kperp[mom] = momamps_kperp_temp[imom]
-            self.momamps_kperp[mom].generate_timeseries()
-            self.momamps_kperp[mom].generate_timeaverage()
+        for mom in self.momamps_kperp:
+            self.momamps_kperp[mom] = MomFieldSlice(common, mom, species, self.diagspace_kxky,
+                                                    rundatafiles)
+        generate_timeseries(list(self.momamps_kperp.values()), workers=workers)
+        for mfslice in self.momamps_kperp.values():
+            mfslice.generate_timeaverage()
 
 
 
@@ -92,10 +87,11 @@ class FluxSpectra(object):
 
     Collect and calculate the kx and ky spectra for the radial fluxes from
     mom files. For further information see diagnostics/doc/spectra.pdf
+    The time steps are processed by workers processes (see utils.procpool).
 
     """
 
-    def __init__(self, common, species, rundatafiles, with_momentum=True):
+    def __init__(self, common, species, rundatafiles, with_momentum=True, workers=None):
         if not common.y_local:
             raise NotImplementedError("Not implemented for y-global simulations yet")
         self.cm = common
@@ -112,7 +108,8 @@ class FluxSpectra(object):
             if with_momentum:
                 self.fluxes_kx.update({"Piem": []})
                 self.fluxes_ky.update({"Piem": []})
-        self.calc_fluxes(species=species, rundatafiles=rundatafiles, with_momentum=with_momentum)
+        self.calc_fluxes(species=species, rundatafiles=rundatafiles, with_momentum=with_momentum,
+                         workers=workers)
 
     def _fetch_moms(self, rundatafiles, species):
         """ Get mom and field slice object for species"""
@@ -123,23 +120,23 @@ class FluxSpectra(object):
             momamps.update({"apar": None})
             if self.cm.bpar:
                 momamps.update({"bpar": None})
-        with Pool(len(momamps)) as p:
-            momamp_temp = p.map(
-                lambda mom: MomFieldSlice(self.cm, mom, species, diagspace, rundatafiles,
-                                          modifier_func=lambda dum: dum), momamps)
-        for imom, mom in enumerate(momamps):
-            momamps[mom] = momamp_temp[imom]
+        for mom in momamps:
+            momamps[mom] = MomFieldSlice(self.cm, mom, species, diagspace, rundatafiles,
+                                         modifier_func=lambda dum: dum)
         return momamps
 
-    def calc_fluxes(self, species, rundatafiles, with_momentum):
+    def calc_fluxes(self, species, rundatafiles, with_momentum, workers=None):
         """ Calculate the flux spectra"""
         momamps = self._fetch_moms(rundatafiles, species=species)
         ispec = self.cm.specnames.index(species) + 1
-        geom = pydiag.utils.geom.Geometry(self.cm)
+        geom = Geometry(self.cm)
         momamps["dens"].check_times()
         pos = momamps["dens"].calc_positions()
         self.timearray = np.take(momamps["dens"].timearray, pos)
-        for time in self.timearray:
+        fluxnames = list(self.fluxes_kx)
+
+        def fluxes_attime(time):
+            """ kx spectra of all fluxes followed by their ky spectra at time """
             # vE_x = -c/C_{xy} d phi / dy
             vE_x = - 1j*self.cm.spatialgrid.ky[np.newaxis, :, np.newaxis]*momamps[
                 "phi"].generate_slice_attime(time)
@@ -187,12 +184,18 @@ class FluxSpectra(object):
                     raise NotImplementedError("bpar part of the fluxes is not implemented yet")
                     fluxfactors["Gammaem"] += 0
                     fluxfactors["Qem"] += 0
-            for flux in self.fluxes_kx:
-                self.fluxes_kx[flux].append(averages.flux_spectra_yz_av(fluxfactors[flux], geom))
-                self.fluxes_ky[flux].append(averages.flux_spectra_xz_av(fluxfactors[flux], geom))
-        for flux in self.fluxes_kx:
-            self.fluxes_kx[flux] = averages.mytrapz(self.fluxes_kx[flux], self.timearray)
-            self.fluxes_ky[flux] = averages.mytrapz(self.fluxes_ky[flux], self.timearray)
+            return tuple([averages.flux_spectra_yz_av(fluxfactors[flux], geom)
+                          for flux in fluxnames] +
+                         [averages.flux_spectra_xz_av(fluxfactors[flux], geom)
+                          for flux in fluxnames])
+
+        (spectra,) = map_timesteps([(fluxes_attime, list(self.timearray))],
+                                   [momamp.fileobject for momamp in momamps.values()],
+                                   workers=workers)
+        for iflux, flux in enumerate(fluxnames):
+            self.fluxes_kx[flux] = averages.mytrapz(spectra[iflux], self.timearray)
+            self.fluxes_ky[flux] = averages.mytrapz(spectra[len(fluxnames) + iflux],
+                                                    self.timearray)
 
     def print_total_fluxes(self):
         """Print the total flux for comparison with nrg diag"""
@@ -290,7 +293,7 @@ class PlotPerpSpectra(Plotting):
                 #with spectral amplitude as the weight
                 mom_kperp,kperp_bins=np.histogram(np.sqrt(kperp_sq_2d),bins=kperp_bins,weights=tmp)
                 ax_log_kperp.plot(kperp_bc, mom_kperp,label=self.titles[mom])
-            xmin,xmax=kperp_bc[0],kperp_bc[np.int(nbins/np.sqrt(2))]
+            xmin,xmax=kperp_bc[0],kperp_bc[int(nbins/np.sqrt(2))]
             ax_log_kperp.set_xlim(xmin,xmax)
             kp_mhd=np.linspace(xmin,1,128)
             kp_kin=np.linspace(1,xmax,128)
@@ -1,3 +1,6 @@
+import os
+import hashlib
+from collections import OrderedDict
 import numpy as np
 import warnings
 import scipy.interpolate as interp
@@ -5,16 +8,25 @@ import matplotlib.pyplot as plt
 import matplotlib.tri as mtri
 import matplotlib.animation as animation
 
-import ..utils.comm
-import ..utils.geom
-import ..utils.averages
-import ..data.slices
-import .baseplot
+from .baseplot import Plotting
+from ..data.slices import MomFieldSlice
+from ..utils.comm import DiagSpace
+from ..utils.geom import Geometry
 
 import multiprocessing
 
+# Triangulations and interpolation weights of torus cuts are kept in this folder, one .npz per
+# geometry, z_res and toroidal angle, see TorusCutTriangulation
+TORUS_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "mgkdb", "torus")
+TORUS_CACHE_VERSION = 1
+DISK_CACHE = True
+# Number of cuts kept in memory, e.g. an animation sweeping the angle only keeps the last ones
+TORUS_CACHE_ENTRIES = 16
+_CACHE_FIELDS = ("R", "Z", "triangles", "mask", "coef_y", "coef_z", "index", "weight")
+_CACHE = OrderedDict()
 
-class TorusContourCut(pydiag.data.slices.MomFieldSlice):
+
+class TorusContourCut(MomFieldSlice):
     """ Generate a phi (toroidal angle) cut of mom or field data and a triangulation """
 
     def __init__(self, common, species, rundatafiles, torangle=0, z_res=400, quantity="phi"):
@@ -28,9 +40,8 @@ class TorusContourCut(pydiag.data.slices.MomFieldSlice):
         :param quantity: Name of the quantity to plot (from field or mom, refer to MomFieldSlice
         constructor
         """
-        diagspace = pydiag.utils.comm.DiagSpace(common.spatialgrid, False, False, False,
-                                                (None, None), (None, None), (None, None), False,
-                                                False, False)
+        diagspace = DiagSpace(common.spatialgrid, False, False, False, (None, None), (None, None),
+                              (None, None), False, False, False)
         super().__init__(common, quantity, species, diagspace, rundatafiles, lambda dum: dum)
         if common.pnt.magn_geometry == "miller":
             warnings.warn(
@@ -42,63 +53,100 @@ class TorusContourCut(pydiag.data.slices.MomFieldSlice):
         self.nz_extended = z_res
         self.z_full = np.append(self.cm.spatialgrid.z, np.pi)  # Extend the z grid to pi
         self.z_full_fine = np.linspace(self.z_full[0], self.z_full[-1], self.nz_extended)
-        tortri = TorusCutTriangulation(common, z_res)
+        tortri = TorusCutTriangulation(common, z_res, self.torangle)
         self.triangulation = tortri.calc_triangulation()
+        self.weights = tortri.calc_weights()
 
     def generate_slice_attime(self, time):
-        """ Specialised version of the slice version, interpolates onto the finer z grid"""
-        slice3d_t = np.pad(super().generate_slice_attime(time), (0, 1), mode="wrap")
-        pos_y = self._get_nearest_y_pos()
-        posyrange = np.arange(0, self.cm.pnt.nky0*2 + 1)
-        interp_data = np.empty((self.cm.pnt.nx0, self.nz_extended))
-
-        for ix in range(len(self.cm.spatialgrid.x_a)):
-            data_interp = interp.RectBivariateSpline(posyrange, self.z_full, slice3d_t[ix, ...])
-            interp_data[ix, :] = data_interp(pos_y[ix, :], self.z_full_fine, grid=False)
-        return interp_data
+        """ Specialised version of the slice version, interpolates onto the finer z grid
 
-    def _get_nearest_y_pos(self):
-        """ Calculate which y position we need for the toroidal slice """
-        z = self.z_full_fine
-        qprof = self.cm.pnt.q0*(
-                1 + self.cm.pnt.shat/self.cm.pnt.x0*(self.cm.spatialgrid.x_a - self.cm.pnt.x0))
-        # Get nearest y for given torangle \phi, y=C_y*(q(x)z - \phi)
-        y_near = self.geom.Cy*(np.outer(qprof, z)*self.cm.pnt.sign_Ip_CW - self.torangle)
-        ny = 2*self.cm.pnt.nky0
-        dy = self.cm.pnt.rhostar*self.cm.pnt.ly/ny
-        pos_y_near = (y_near/dy + ny/2)%ny
-        return pos_y_near
+        Uses the spline weights of TorusCutTriangulation: two matrix products for the spline
+        coefficients and one gather for the values on the cut
+        """
+        slice3d_t = np.pad(super().generate_slice_attime(time), ((0, 0), (0, 1), (0, 1)),
+                           mode="wrap")
+        coef_y, coef_z, index, weight = self.weights
+        coeffs = coef_y @ slice3d_t @ coef_z.T
+        return np.sum(weight*coeffs.reshape(-1)[index], axis=-1)
 
 
 class TorusCutTriangulation(object):
-    """ Set up the triangulation of a torus cut based on GENE geometry outpout"""
+    """ Set up the triangulation of a torus cut based on GENE geometry outpout
 
-    def __init__(self, common, z_res):
+    Together with the triangulation, the weights interpolating a (x, y, z) slice onto the cut are
+    set up. The cubic spline of the slice in y and z has the coefficients
+    coef_y @ slice[x] @ coef_z.T, and at every point of the cut only 4x4 B-splines are nonzero:
+    their flat positions in the coefficients array are index[x, j, :], their values weight[x, j, :].
+    Both are cached per process (the last TORUS_CACHE_ENTRIES cuts) and, with DISK_CACHE, in
+    TORUS_CACHE_DIR, keyed by a hash of the geometry and grid, z_res and the toroidal angle, so
+    that other cuts, plots and runs with the same geometry do not recompute them.
+    """
+
+    def __init__(self, common, z_res, torangle=0):
         """
         :param common: CommonData object of the run
         :param z_res: The number of points that z should be interpolated to
+        :param torangle: The toroidal angle of the cut, phi=[0, 2*pi]
         """
         self.cm = common
-        self.geom = self.geom = pydiag.utils.geom.Geometry(common)
+        self.geom = Geometry(common)
         self.z_full = np.append(self.cm.spatialgrid.z, np.pi)  # Extend the z grid to pi
         self.z_full_fine = np.linspace(self.z_full[0], self.z_full[-1], z_res)
+        self.torangle = torangle%(2*np.pi)
         self.triangulation = None
+        self.weights = None
 
     def calc_triangulation(self, recalculate=False):
         """ Calculate the triangulation based on local/global
 
-        :param recalculate: Force recalculation of the triangulation, otherwise a previous result is
-        used
+        :param recalculate: Force recalculation of the triangulation, otherwise a previous
+        (or cached) result is used
         """
         if not self.cm.y_local:
             raise RuntimeError("y-global is not supported in torus cut visualisation")
         if (not self.triangulation) or recalculate:
-            if self.cm.x_local:
-                return self._calc_triangulation_local()
-            else:
+            if not self.cm.x_local:
                 return self._calc_triangulation_xglobal()
-        else:
-            return self.triangulation
+            self._setup(recalculate)
+        return self.triangulation
+
+    def calc_weights(self, recalculate=False):
+        """ Interpolation weights (coef_y, coef_z, index, weight) of the cut, see the class
+        description """
+        if self.weights is None or recalculate:
+            self.calc_triangulation(recalculate)
+        return self.weights
+
+    def _cache_key(self):
+        """ Hash of everything the triangulation and the weights depend on """
+        sha = hashlib.sha256()
+        for arr in (self.geom.R, self.geom.Z, self.geom.dxdR, self.geom.dxdZ, self.geom.gxx,
+                    self.cm.spatialgrid.x_a, self.z_full, self.z_full_fine):
+            sha.update(np.ascontiguousarray(arr, dtype=np.float64).tobytes())
+        pnt = self.cm.pnt
+        sha.update(repr((TORUS_CACHE_VERSION, float(self.geom.Cy), pnt.x0, pnt.Lref, pnt.q0,
+                         pnt.shat, pnt.sign_Ip_CW, pnt.nky0, pnt.rhostar, pnt.ly,
+                         float(self.torangle))).encode())
+        return sha.hexdigest()
+
+    def _setup(self, recalculate=False):
+        key = self._cache_key()
+        cachefile = os.path.join(TORUS_CACHE_DIR, key + ".npz")
+        cached = None if recalculate else _CACHE.get(key)
+        if cached is None and DISK_CACHE and not recalculate:
+            cached = _read_cache(cachefile)
+        if cached is None:
+            cached = self._calc_triangulation_local() + self._calc_weights()
+            if DISK_CACHE:
+                _write_cache(cachefile, cached)
+        _CACHE[key] = cached
+        _CACHE.move_to_end(key)
+        while len(_CACHE) > TORUS_CACHE_ENTRIES:
+            _CACHE.popitem(last=False)
+        R_flat, Z_flat, triangles, mask = cached[:4]
+        self.triangulation = mtri.Triangulation(R_flat, Z_flat, triangles)
+        self.triangulation.set_mask(mask)
+        self.weights = cached[4:]
 
     def _calc_triangulation_xglobal(self):
         raise NotImplementedError("Torus viz for x-global is still work-in-progress")
@@ -121,16 +169,72 @@ class TorusCutTriangulation(object):
         RZtri = mtri.Triangulation(R_pos.flatten(), Z_pos.flatten())
         # Mask central hole
         centretri = mtri.Triangulation(R_pos[0, :], Z_pos[0, :])
-        centermask = np.full(RZtri.triangles.shape[0], False)
-        for ct in centretri.triangles:
-            start = np.where(ct.mean() == RZtri.triangles.mean(axis=1))
-            centermask[start] = True
-        RZtri.set_mask(centermask)
-        self.triangulation = RZtri
-        return self.triangulation
+        centermask = np.isin(RZtri.triangles.mean(axis=1), centretri.triangles.mean(axis=1))
+        return RZtri.x, RZtri.y, RZtri.triangles, centermask
+
+    def _nearest_y_pos(self):
+        """ Calculate which y position we need for the toroidal slice """
+        z = self.z_full_fine
+        qprof = self.cm.pnt.q0*(
+                1 + self.cm.pnt.shat/self.cm.pnt.x0*(self.cm.spatialgrid.x_a - self.cm.pnt.x0))
+        # Get nearest y for given torangle \phi, y=C_y*(q(x)z - \phi)
+        y_near = self.geom.Cy*(np.outer(qprof, z)*self.cm.pnt.sign_Ip_CW - self.torangle)
+        ny = 2*self.cm.pnt.nky0
+        dy = self.cm.pnt.rhostar*self.cm.pnt.ly/ny
+        pos_y_near = (y_near/dy + ny/2)%ny
+        return pos_y_near
+
+    def _calc_weights(self):
+        """ Weights of the (not-a-knot) cubic splines through the y and z grid points, evaluated
+        at the cut """
+        posyrange = np.arange(0, self.cm.pnt.nky0*2 + 1)
+        pos_y = self._nearest_y_pos()
+        # coefficients of the splines through unit data
+        spline_y = interp.make_interp_spline(posyrange, np.eye(posyrange.size), k=3)
+        spline_z = interp.make_interp_spline(self.z_full, np.eye(self.z_full.size), k=3)
+        # the 4 nonzero B-splines at every point, y depends on x as well
+        basis_y = interp.BSpline.design_matrix(pos_y.ravel(), spline_y.t, 3)
+        basis_z = interp.BSpline.design_matrix(self.z_full_fine, spline_z.t, 3)
+        ind_y = basis_y.indices.reshape(pos_y.shape + (4, 1))
+        val_y = basis_y.data.reshape(pos_y.shape + (4, 1))
+        ind_z = basis_z.indices.reshape(-1, 1, 4)
+        val_z = basis_z.data.reshape(-1, 1, 4)
+        n_coef_y, n_coef_z = spline_y.c.shape[0], spline_z.c.shape[0]
+        ind_x = np.arange(pos_y.shape[0]).reshape(-1, 1, 1, 1)
+        index = (ind_x*n_coef_y + ind_y)*n_coef_z + ind_z
+        weight = val_y*val_z
+        return (spline_y.c, spline_z.c, index.reshape(pos_y.shape + (16,)),
+                weight.reshape(pos_y.shape + (16,)))
+
+
+def _read_cache(cachefile):
+    if not os.path.isfile(cachefile):
+        return None
+    try:
+        with np.load(cachefile, allow_pickle=False) as cache:
+            return tuple(cache[name] for name in _CACHE_FIELDS)
+    except (OSError, KeyError, ValueError):
+        # unreadable, just recalculate
+        return None
+
+
+def _write_cache(cachefile, cached):
+    """ Failing to write (e.g. read-only home) is not an error """
+    tmpfile = cachefile + ".{}.tmp".format(os.getpid())
+    try:
+        os.makedirs(TORUS_CACHE_DIR, exist_ok=True)
+        with open(tmpfile, "wb") as fid:
+            np.savez(fid, **dict(zip(_CACHE_FIELDS, cached)))
+        os.replace(tmpfile, cachefile)
+    except OSError as err:
+        print("Could not write torus cut cache {}: {}".format(cachefile, err))
+        try:
+            os.remove(tmpfile)
+        except OSError:
+            pass
 
 
-class PlotTorusCut(pydiag.diagplots.baseplot.Plotting):
+class PlotTorusCut(Plotting):
     """ Class handling the plotting of the triangulated torus cuts"""
 
     def __init__(self, toruscutlist):
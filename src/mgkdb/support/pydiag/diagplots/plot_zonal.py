@@ -1,15 +1,15 @@
 """ Classes to do plots of the potential and its derivatives """
 import numpy as np
-import ..utils.averages as av
+from ..utils import averages as av
 from .baseplot import plt, Plotting
-import ..utils.fourier as fourier
+from ..utils import fourier
 from ..utils import errors as err
 from ..utils.geom import Geometry
-import ..data.slices
+from ..data.slices import MomFieldSlice
 from ..utils.comm import DiagSpace
 
 
-class ZonalAverage(pydiag.data.slices.MomFieldSlice):
+class ZonalAverage(MomFieldSlice):
     """ Create a flux-surface averaged ky=0 time series from the field file
 
     :param common: CommonData object of the run
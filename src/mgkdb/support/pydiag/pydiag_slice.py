@@ -3,8 +3,8 @@
 import argparse
 import os
 
-import ..data.slices as sli
-import ..utils.comm as comm
+from .data import slices as sli
+from .utils import comm
 
 xrange = (None, None)
 yrange = (None, None)
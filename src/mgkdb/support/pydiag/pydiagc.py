@@ -7,25 +7,24 @@ import os
 import matplotlib.pyplot as plt
 from multiprocessing.dummy import Pool
 
-import .pydiag.data.datafiles as datafiles
-import .pydiag.data.srcmom_data
-import .pydiag.data.nrgdata as nrg
-import .pydiag.diagplots.plot_zonal as pzf
-import .pydiag.diagplots.plot_fsamom as pfsa
-import .pydiag.diagplots.plot_probdensfunc as ppdf
-import .pydiag.utils.averages
-import .pydiag.utils.comm as comm
-import .pydiag.utils.gkdb as gkdb
-import .pydiag.utils.geomfft as geomfft
-import .pydiag.diagplots.plot_spectra as spectra
-import .pydiag.diagplots.plot_contour as contour
-import .pydiag.diagplots.plot_torus as torus
-import .pydiag.diagplots.plot_ball as ballooning
-import .pydiag.diagplots.plot_anisotropy as anisotropy
-from .pydiag.data import profile_data, fsamom_data
-from .pydiag.diagplots import plot_profiles, plot_nrg
-from .pydiag.diagplots import plot_srcmom
-from .pydiag.data.base_file import gluetimetraces
+from .data import datafiles
+from .data import nrgdata as nrg
+from .data.srcmom_data import SrcmomSeries
+from .diagplots import plot_zonal as pzf
+from .diagplots import plot_fsamom as pfsa
+from .diagplots import plot_probdensfunc as ppdf
+from .utils import comm
+from .utils import gkdb
+from .utils import geomfft
+from .diagplots import plot_spectra as spectra
+from .diagplots import plot_contour as contour
+from .diagplots import plot_torus as torus
+from .diagplots import plot_ball as ballooning
+from .diagplots import plot_anisotropy as anisotropy
+from .data import profile_data, fsamom_data
+from .diagplots import plot_profiles, plot_nrg
+from .diagplots import plot_srcmom
+from .data.base_file import gluetimetraces
 
 xrange = (None, None)
 yrange = (None, None)
@@ -60,6 +59,9 @@ gridopts.add_argument("--yfourier", help="Operate in ky space", action="store_tr
 gridopts.add_argument("--zfourier", help="Operate in kz space", action="store_true")
 gridopts.add_argument("--species", "-s", help="Names of species to process", nargs='+')
 
+parser.add_argument("--workers", "-w", type=int, default=None,
+                    help="Number of processes for the spectra diagnostics (default: one per core)")
+
 # Auxiliary options to request particular index values (/ranges)
 indexargs = parser.add_argument_group("Index values / ranges")
 indexargs.add_argument("--kyind", type=int, nargs=1, #action="store_const",
@@ -200,9 +202,8 @@ elif args.fsa:
     plotfsa.createfigs(poutput=args.save)
 elif args.srcmom:
     for icomm, common in enumerate(inputcomm):
-        srcmom_f0 = pydiag.data.srcmom_data.SrcmomSeries(common, inputdata[icomm], "energy", "f0")
-        srcmom_ckh = pydiag.data.srcmom_data.SrcmomSeries(common, inputdata[icomm], "energy",
-                                                          "ck_heat")
+        srcmom_f0 = SrcmomSeries(common, inputdata[icomm], "energy", "f0")
+        srcmom_ckh = SrcmomSeries(common, inputdata[icomm], "energy", "ck_heat")
         srcmom = [srcmom_f0, srcmom_ckh]
         inputsrcmom.append(srcmom)
     inputsrcmom = [item for sublist in inputsrcmom for item in sublist]
@@ -212,31 +213,29 @@ elif args.srcmom:
 
 elif args.spectra:
     inputampspec = []
+    # the spectra distribute their time steps over processes themselves
     for icomm, common in enumerate(inputcomm):
-        with Pool(len(speclist)) as p:
-            inputampspec = p.map(
-                    lambda spec: spectra.AmplitudeSpectra(common, spec, inputdata[icomm]),
-                    speclist)
+        for spec in speclist:
+            inputampspec.append(spectra.AmplitudeSpectra(common, spec, inputdata[icomm],
+                                                         workers=args.workers))
     specplt = spectra.PlotAmplitudeSpectra(inputcomm, inputampspec)
     specplt.createfigs()
 
 elif args.perpspectra:
     inputperpspec = []
     for icomm, common in enumerate(inputcomm):
-        with Pool(len(args.species)) as p:
-            inputperpspec = p.map(
-                    lambda spec: spectra.PerpSpectra(common, spec, inputdata[icomm]),
-                    args.species)
+        for spec in args.species:
+            inputperpspec.append(spectra.PerpSpectra(common, spec, inputdata[icomm],
+                                                     workers=args.workers))
     specplt = spectra.PlotPerpSpectra(inputcomm, inputperpspec)
     specplt.createfigs()
 
 elif args.fluxspectra:
     inputfluxspec = []
     for icomm, common in enumerate(inputcomm):
-        with Pool(len(speclist)) as p:
-            inputfluxspec = p.map(lambda spec: spectra.FluxSpectra(common, spec, inputdata[icomm],
-                                                                   with_momentum=False),
-                                  speclist)
+        for spec in speclist:
+            inputfluxspec.append(spectra.FluxSpectra(common, spec, inputdata[icomm],
+                                                     with_momentum=False, workers=args.workers))
     specplt = spectra.PlotFluxSpectra(inputcomm, inputfluxspec)
     specplt.createfigs()
     for s in inputfluxspec:
@@ -295,7 +294,7 @@ elif args.anisotropy:
 else:
     for icomm, common in enumerate(inputcomm):
         prdat = profile_data.ProfileData(common, inputdata[icomm])
-        fielddat = pydiag.diagplots.plot_zonal.ZonalAverage(common, inputdata[icomm], xrange=xrange)
+        fielddat = pzf.ZonalAverage(common, inputdata[icomm], xrange=xrange)
         prdat.get_profiles()
         inputprof.append(prdat)
         if not (args.averageprofiles or args.timetrace or args.probabilitydens or args.profxt):
@@ -1,7 +1,7 @@
 """ ParIO.py: Contains the class to handle reading and writing of parameter files """
-import re
 import numpy as np
 from collections import namedtuple, OrderedDict
+from ...data.par_reader import read_parameters, clearcomments
 
 
 class Parameters(object):
@@ -24,73 +24,29 @@ class Parameters(object):
 
     @staticmethod
     def clearcomments(variable):
-        regex = re.compile(r'\s*([-+\'\"\[\];.,/a-zA-Z0-9_\s*]*)\s*!?\s*(.*)')
-        result = regex.search(variable)
-        if result and result.group(2)[:4] != 'scan':
-            return regex.search(variable).group(1)
-        else:
-            return variable
+        return clearcomments(variable)
 
     def Read_Pars(self, path):
         """ Read parameters file and make it a dict """
         self.pardict.clear()
         self.nmldict.clear()
-        # counts species namelists
-        countspec = 0
         try:
-            with open(path, "r") as parfile:
-                # Search file for parameters using regular expressions
-                for line in parfile:
-                    # Exclude commented lines
-                    if re.search(r'\s*!\w*\s*=.*', line) is None:
-                        # Check for and count species namelists
-                        if re.search(r'^\s*&(.*)', line):
-                            # if namelist belongs to a species, append its number to the namelist
-                            if re.search(r'^\s*&(.*)', line).group(1) == 'species':
-                                countspec += 1
-                                nml = re.search(r'^\s*&(.*)', line).group(1) + str(countspec)
-                            else:
-                                nml = re.search(r'^\s*&(.*)', line).group(1)
-                            if nml not in self.namelists:
-                                self.namelists.append(nml)
-                    # Search lines for <parameter> = <value> patterns
-                    p = re.compile(r'^\s*(.*)\s*=\s*(.*)')
-                    m = p.search(line)
-                    # Pick matching lines and build parameter dictionary
-                    if m:
-                        if m.group(1).strip() in self.spec_nl:
-                            self.pardict[m.group(1).strip() + str(countspec)] = m.group(2)
-                            self.nmldict[m.group(1).strip() + str(countspec)] = nml
-                        else:
-                            self.pardict[m.group(1).strip()] = m.group(2)
-                            self.nmldict[m.group(1).strip()] = nml
+            parsed = read_parameters(path)
         except IOError:
             print("Could not read parameters file")
             raise
-        self._clean_parameters()
+        for entry in parsed.entries:
+            if entry.name in self.spec_nl:
+                key = entry.name + str(entry.species)
+            else:
+                key = entry.name
+            self.pardict[key] = entry.value
+            self.nmldict[key] = entry.namelist
+        for nml in parsed.namelists:
+            if nml not in self.namelists:
+                self.namelists.append(nml)
         self.add_defaults()
 
-    def _clean_parameters(self):
-        """ Clear the comments from all variables,
-
-        Cast some strings to integers and floats
-        """
-        boolstr_t = [".T.", ".t.", "T", "t", ".true."]
-        boolstr_f = [".F.", ".f.", "F", "f", ".false."]
-        for item in self.pardict:
-            self.pardict[item] = self.clearcomments(self.pardict[item])
-            try:  # Can it be converted to int?
-                self.pardict[item] = int(self.pardict[item])
-            except ValueError:
-                try:  # No, but can it be converted to float?
-                    self.pardict[item] = float(self.pardict[item])
-                except ValueError:
-                    pass
-            if self.pardict[item] in boolstr_t:  # cast switches to boolean values
-                self.pardict[item] = True
-            elif self.pardict[item] in boolstr_f:
-                self.pardict[item] = False
-
     def add_defaults(self):
         """ Set default values GENE does not write
 
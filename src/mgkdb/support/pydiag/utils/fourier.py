@@ -1,41 +1,13 @@
-""" Module containing fourier transform routines for GENE time series"""
+""" Module containing fourier transform routines for GENE time series
 
-import numpy as np
+Wrappers of putils/fourier.py with the grid sizes as arguments
+"""
 
+from ...putils import fourier
+from ...putils.fourier import kx_to_x, ky_to_y, kxky_to_xy
 
-def kx_to_x(var_kx, nx0, axis=-3):
-    """ Perform inverse FFT on kx spectral direction of variable
 
-    Note: The fft and ifft in python and GENE/IDL have the factor 1/N switched!
-    :param var_kx: Variable in kx space
-    :param nx0: Number of kx grid points
-    :param axis: Which axis of var_kx is the x direction, by default the third last one
-    :returns: variable in real x space
-    """
-    var_x = np.fft.ifft(nx0*var_kx, axis=axis)
-    var_x = np.real_if_close(var_x, tol=1e5)
-    return var_x
-
-
-def ky_to_y(var_ky, nky0, axis=-2):
-    """ Perform inverse FFT on ky spectral direction of variable
-
-    The GENE data only include the non-negative ky components, so we need to use the real
-    valued FFT routines
-    Note: The fft and ifft in python and GENE/IDL have the factor 1/N switched!
-    :param var_ky: Variable in kx space
-    :param nky0: Number of ky grid points
-    :param axis: Which axis of var_kx is the x direction, by default the third last one
-    :returns: variable in real y space
-    """
-    # The GENE data only include the non-negative ky components, so we need to use the real
-    # valued FFT routines
-    var_y = np.fft.irfft(2*nky0*var_ky, n=2*nky0, axis=axis)
-    var_y = np.real_if_close(var_y, tol=1e5)
-    return var_y
-
-
-def kz_to_z(var_kz, nz0, axis=-1):
+def kz_to_z(var_kz, nz0, axis=-1, workers=None):
     """ Perform inverse FFT on kz spectral direction of variable
 
     Note: The fft and ifft in python and GENE/IDL have the factor 1/N switched!
@@ -46,12 +18,10 @@ def kz_to_z(var_kz, nz0, axis=-1):
     :param axis: Which axis of var_kz is the z direction, by default the third last one
     :returns: variable in real z space
     """
-    var_z = np.fft.ifft(var_kz, axis=axis)
-    var_z = np.real_if_close(var_z, tol=1e5)
-    return var_z
+    return fourier.kz_to_z(var_kz, axis=axis, workers=workers)
 
 
-def x_to_kx(var_x, nx0, axis=-3):
+def x_to_kx(var_x, nx0, axis=-3, workers=None):
     """ Perform FFT on x direction of variable
 
     Note: The fft and ifft in python and GENE/IDL have the factor 1/N switched!
@@ -60,12 +30,11 @@ def x_to_kx(var_x, nx0, axis=-3):
     :param axis: Which axis of var_kx is the x direction
     :returns: variable in fourier kx space
     """
-    var_kx = np.fft.fft(var_x, axis=axis)
-    return var_kx
+    return fourier.x_to_kx(var_x, axis=axis, workers=workers)
 
 
-def y_to_ky(var_y, nky0, axis=-2):
-    """ Perform FFT on y direction of variable
+def y_to_ky(var_y, nky0, axis=-2, workers=None):
+    """ Perform FFT on y direction of variable, non-negative ky only
 
     Note: The fft and ifft in python and GENE/IDL have the factor 1/N switched!
     :param var_y: Variable in real y space
@@ -73,11 +42,10 @@ def y_to_ky(var_y, nky0, axis=-2):
     :param axis: Which axis of var_ky is the y direction
     :returns: variable in fourier ky space
     """
-    var_ky = np.fft.rfft(var_y, axis=axis)
-    return var_ky
+    return fourier.y_to_ky(var_y, axis=axis, real=True, workers=workers)
 
 
-def z_to_kz(var_z, nz0, axis=-1):
+def z_to_kz(var_z, nz0, axis=-1, workers=None):
     """ Perform FFT on z direction of variable
 
     Note: The fft and ifft in python and GENE/IDL have the factor 1/N switched!
@@ -86,5 +54,4 @@ def z_to_kz(var_z, nz0, axis=-1):
     :param axis: Which axis of var_kz is the z direction
     :returns: variable in fourier kz space
     """
-    var_kz = np.fft.fft(var_z, axis=axis)
-    return var_kz
+    return fourier.z_to_kz(var_z, axis=axis, workers=workers)
@@ -5,14 +5,14 @@ import datetime
 import numpy as np
 import warnings
 from collections import OrderedDict
-import .geom
-import .comm
-import ..data.omega_eigenvalue as eigenvalue
+from .geom import Geometry
+from . import comm
+from ..data import omega_eigenvalue as eigenvalue
 import json
-import .averages as averages
+from . import averages
 import matplotlib.pyplot as plt #remove later
-import ..diagplots.plot_ball as ballooning
-import ..data.nrgdata as nrg
+from ..diagplots import plot_ball as ballooning
+from ..data import nrgdata as nrg
 from scipy import interpolate
 
 class GEOMFFT(object):
@@ -25,7 +25,7 @@ class GEOMFFT(object):
     def __init__(self,common,rundatafiles):
         print ("Called flux surface parametrization tool ... ")
         self.cm = common
-        self.geom = pydiag.utils.geom.Geometry(self.cm)
+        self.geom = Geometry(self.cm)
         self.get_shape()
 
     def get_flux_surface_distance(self,R0,Z0,R,Z):
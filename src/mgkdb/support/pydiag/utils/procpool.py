@@ -0,0 +1,111 @@
+""" Process pools over the time steps of binary GENE output
+
+The pydiag objects (CommonData, RunDataFiles, slices, ...) hold open files and
+closures and cannot be pickled. The workers are therefore forked and inherit
+them, only chunks of time indices are sent. The results are written into arrays
+in shared memory allocated before the fork, so they are not copied back either.
+Every worker reopens the binary files it reads, a forked file shares its offset
+with the parent.
+"""
+
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# number of worker processes, None is one per core
+WORKERS = None
+# time chunks per worker, more chunks balance uneven jobs better
+CHUNKS_PER_WORKER = 4
+
+# (jobs, outputs, fileobjects) of the running map_timesteps, inherited by the workers
+_TASK = None
+
+
+def _n_workers(workers):
+    if workers is None:
+        workers = WORKERS
+    return multiprocessing.cpu_count() if workers is None else max(1, workers)
+
+
+def _as_tuple(result):
+    return result if isinstance(result, tuple) else (result,)
+
+
+def _init_worker():
+    for fileobject in _TASK[2]:
+        fileobject.reopen()
+
+
+def _run_chunk(chunk):
+    ijob, start, stop = chunk
+    func, times = _TASK[0][ijob]
+    outputs = _TASK[1][ijob]
+    for itime in range(start, stop):
+        for out, result in zip(outputs, _as_tuple(func(times[itime]))):
+            out[itime] = result
+
+
+def _chunks(jobs, n_workers):
+    """ (job, start, stop) of the time steps after the first one of every job """
+    n_steps = sum(len(times) - 1 for _, times in jobs)
+    size = max(1, int(np.ceil(n_steps/(CHUNKS_PER_WORKER*n_workers))))
+    return [(ijob, start, min(start + size, len(times)))
+            for ijob, (_, times) in enumerate(jobs) for start in range(1, len(times), size)]
+
+
+def _shared_array(shms, first, n_times):
+    """ Array of n_times steps like first in shared memory, with first as its first step """
+    first = np.asarray(first)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, n_times*first.nbytes))
+    shms.append(shm)
+    out = np.ndarray((n_times,) + first.shape, dtype=first.dtype, buffer=shm.buf)
+    out[0] = first
+    return out
+
+
+def _map_serial(func, times):
+    stacked = [[value] for value in _as_tuple(func(times[0]))] if len(times) else []
+    for time in times[1:]:
+        for values, value in zip(stacked, _as_tuple(func(time))):
+            values.append(value)
+    return tuple(np.array(values) for values in stacked)
+
+
+def map_timesteps(jobs, fileobjects=(), workers=None):
+    """ Evaluate functions of time for many time steps in forked worker processes
+
+    :param jobs: list of (func, times), func(time) returns an array or a tuple of arrays
+    with the same shapes for all times
+    :param fileobjects: BinaryFile objects read by the functions, reopened in every worker
+    :param workers: number of processes, WORKERS if not given. With 1 (or where processes
+    cannot be forked) everything is done in this process.
+    :returns: for every job a tuple of arrays, func(time) stacked along a first time axis
+    """
+    global _TASK
+    n_workers = _n_workers(workers)
+    if n_workers == 1 or 'fork' not in multiprocessing.get_all_start_methods():
+        return [_map_serial(func, times) for func, times in jobs]
+    shms = []
+    # the views into the shared memory, they have to be gone before it is closed
+    outputs = []
+    try:
+        # The first time step is done here, it gives the shapes of the outputs
+        for func, times in jobs:
+            outputs.append([_shared_array(shms, first, len(times))
+                            for first in (_as_tuple(func(times[0])) if len(times) else ())])
+        chunks = _chunks(jobs, n_workers)
+        if chunks:
+            _TASK = (jobs, outputs, list({id(f): f for f in fileobjects}.values()))
+            try:
+                with multiprocessing.get_context('fork').Pool(
+                        min(n_workers, len(chunks)), initializer=_init_worker) as pool:
+                    pool.map(_run_chunk, chunks, chunksize=1)
+            finally:
+                _TASK = None
+        return [tuple(np.array(out) for out in job_outputs) for job_outputs in outputs]
+    finally:
+        outputs.clear()
+        for shm in shms:
+            shm.close()
+            shm.unlink()